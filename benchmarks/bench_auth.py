@@ -0,0 +1,54 @@
+"""Cost of utils.authenticate per call: legacy Auth() vs signed tokens.
+
+    python -m benchmarks.bench_auth --calls 100000
+"""
+import argparse
+import base64
+import json
+import os
+import time
+import timeit
+
+from benchmarks.common import BenchHandler
+from utils.utils import Auth, authenticate, auth
+
+
+def legacy_authenticate(self):
+    # The previous implementation: a fresh Auth() (and os.urandom) per
+    # request, then base64 + JSON decoding of an unsigned token
+    auth_header = self.headers.get("Authorization")
+    if auth_header is None or not auth_header.startswith("Bearer "):
+        return False
+    token = auth_header.split(" ")[1]
+    os.urandom(32)
+    try:
+        payload = json.loads(base64.b64decode(token).decode())
+        return payload["exp"] >= int(time.time())
+    except Exception:
+        return False
+
+
+def per_call_us(fn, calls):
+    return round(timeit.timeit(fn, number=calls) / calls * 1e6, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=100000)
+    args = parser.parse_args()
+
+    legacy_token = base64.b64encode(json.dumps({"exp": int(time.time()) + 3600}).encode()).decode()
+    legacy_handler = BenchHandler(headers={"Authorization": f"Bearer {legacy_token}"})
+    handler = BenchHandler(headers={"Authorization": f"Bearer {auth.generate_token('bench')}"})
+    uncached = Auth(cache_size=0)
+    uncached_token = uncached.generate_token("bench")
+
+    print(json.dumps({
+        "legacy_us": per_call_us(lambda: legacy_authenticate(legacy_handler), args.calls),
+        "signed_cached_us": per_call_us(lambda: authenticate(handler), args.calls),
+        "signed_uncached_verify_us": per_call_us(lambda: uncached.verify_token(uncached_token), args.calls),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
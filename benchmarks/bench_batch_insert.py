@@ -0,0 +1,48 @@
+"""Items per second through create_item one at a time vs create_items.
+
+    python -m benchmarks.bench_batch_insert --items 20000
+"""
+import argparse
+import json
+import os
+import time
+
+from benchmarks.common import seed_database
+from models.models import Database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--single-items", type=int, default=2000, help="Rows for the slow per-item path")
+    args = parser.parse_args()
+
+    path = seed_database(categories=10, items=0)
+    db = Database(path)
+    try:
+        payload = [
+            {"category_id": index % 10 + 1, "name": f"item-{index}", "description": "Synced", "price": 9.99}
+            for index in range(max(args.items, args.single_items))
+        ]
+
+        start = time.perf_counter()
+        for item in payload[: args.single_items]:
+            db.create_item(item["category_id"], item["name"], item["description"], item["price"])
+        single = args.single_items / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        db.create_items(payload[: args.items])
+        batch = args.items / (time.perf_counter() - start)
+
+        print(json.dumps({
+            "create_item_per_second": round(single),
+            "create_items_per_second": round(batch),
+            "speedup": round(batch / single, 1),
+        }, indent=2))
+    finally:
+        db.close()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Throughput of GET /items/<id> with and without persistent connections.
+
+    python -m benchmarks.bench_keepalive --items 10000 --concurrency 4 --duration 5
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import threading
+import time
+
+from benchmarks.loadtest import percentile, prepare_database, serve
+
+
+def client(port, items, keepalive, deadline, seed, latencies):
+    rng = random.Random(seed)
+    conn = None
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        if conn is None:
+            conn = http.client.HTTPConnection("localhost", port, timeout=30)
+        headers = {} if keepalive else {"Connection": "close"}
+        conn.request("GET", f"/items/{rng.randint(1, items)}", headers=headers)
+        conn.getresponse().read()
+        if not keepalive:
+            conn.close()
+            conn = None
+        latencies.append(time.perf_counter() - start)
+    if conn is not None:
+        conn.close()
+
+
+def measure(port, args, keepalive):
+    deadline = time.perf_counter() + args.duration
+    per_client = [[] for _ in range(args.concurrency)]
+    threads = [
+        threading.Thread(target=client, args=(port, args.items, keepalive, deadline, index, per_client[index]))
+        for index in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies = sorted(value for values in per_client for value in values)
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / args.duration, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=4, help="Client threads (keep <= --threads)")
+    parser.add_argument("--threads", type=int, default=8, help="Server worker threads")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per mode")
+    args = parser.parse_args()
+
+    db_path = prepare_database(args.items, categories=10, seed=1)
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    process = context.Process(target=serve, args=(db_path, args.threads, ready))
+    process.start()
+    try:
+        port = ready.get(timeout=60)
+        close = measure(port, args, keepalive=False)
+        keepalive = measure(port, args, keepalive=True)
+    finally:
+        process.terminate()
+        process.join()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+    print(json.dumps({
+        "connection_per_request": close,
+        "keepalive": keepalive,
+        "speedup": round(keepalive["rps"] / close["rps"], 2) if close["rps"] else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
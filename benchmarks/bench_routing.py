@@ -0,0 +1,95 @@
+"""Dispatch cost per request: legacy if/elif chains vs the route table.
+
+    python -m benchmarks.bench_routing --calls 200000
+"""
+import argparse
+import json
+import timeit
+from urllib.parse import urlparse
+
+from server import router
+
+REQUESTS = [
+    ("GET", "/categories"),
+    ("GET", "/items?page=2&per_page=20"),
+    ("GET", "/items/search?q=laptop"),
+    ("GET", "/items/1234"),
+    ("POST", "/items/batch"),
+    ("PUT", "/items/1234"),
+    ("DELETE", "/items/1234"),
+    ("GET", "/diagnostics"),
+]
+
+
+def legacy_dispatch(method, path):
+    # The previous do_GET/do_POST/do_PUT/do_DELETE chains, returning the
+    # handler name instead of calling it
+    url = urlparse(path)
+    if method == "GET":
+        if url.path == "/categories":
+            return "get_all_categories"
+        elif url.path == "/categories/names":
+            return "get_categories"
+        elif url.path == "/categories/stats":
+            return "get_category_stats"
+        elif url.path == "/items":
+            return "get_items"
+        elif url.path == "/items/search":
+            return "search_items"
+        elif url.path == "/diagnostics":
+            return "get_diagnostics"
+        elif url.path.startswith("/items/"):
+            return "get_item", int(url.path.split("/")[-1])
+    elif method == "POST":
+        if url.path == "/categories":
+            return "create_category"
+        elif url.path == "/login":
+            return "login"
+        elif url.path == "/items":
+            return "create_item"
+        elif url.path == "/items/batch":
+            return "create_items_batch"
+        elif url.path == "/register":
+            return "register"
+    elif method == "PUT":
+        if url.path.startswith("/items/"):
+            return "update_item", int(url.path.split("/")[-1])
+    elif method == "PATCH":
+        if url.path == "/items":
+            return "update_items"
+    elif method == "DELETE":
+        if url.path == "/items":
+            return "delete_items"
+        elif url.path.startswith("/items/"):
+            return "delete_item", int(url.path.split("/")[-1])
+    return None
+
+
+def routed_dispatch(method, path):
+    return router.match(method, urlparse(path).path)
+
+
+def per_call_ns(fn, calls, requests=REQUESTS):
+    def run():
+        for method, path in requests:
+            fn(method, path)
+    return round(timeit.timeit(run, number=calls // len(REQUESTS)) / calls * 1e9, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200000)
+    args = parser.parse_args()
+    bare_paths = [(method, urlparse(path).path) for method, path in REQUESTS]
+
+    print(json.dumps({
+        "requests": [f"{method} {path}" for method, path in REQUESTS],
+        "legacy_ns": per_call_ns(legacy_dispatch, args.calls),
+        "router_ns": per_call_ns(routed_dispatch, args.calls),
+        # Lookup alone; both dispatchers above include one urlparse()
+        "router_match_only_ns": per_call_ns(router.match, args.calls, bare_paths),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""CPU time and memory per item: dicts + json.dumps vs the row encoders.
+
+    python -m benchmarks.bench_serializer --items 100000 --page 500
+
+Rows are fetched once up front, so only the encoding is measured: items
+in pages of --page rows (streamed like GET /items, buffered like GET
+/items/search, and one at a time like GET /items/<id>) and the whole
+catalogue like GET /categories. Both sides produce the same bytes
+(checked before timing). Peak bytes are the most memory traced while
+encoding one page (or the catalogue), divided by the items in it.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+import tracemalloc
+
+from benchmarks.common import seed_database
+from models.models import ITEM_COLUMNS, CATEGORY_COLUMNS, CATEGORY_ITEM_COLUMNS
+from utils.serializer import row_encoder, iter_grouped_array
+
+item_encoder = row_encoder(ITEM_COLUMNS)
+category_encoder = row_encoder(CATEGORY_COLUMNS)
+category_item_encoder = row_encoder(CATEGORY_ITEM_COLUMNS, skip=len(CATEGORY_COLUMNS))
+
+
+def iter_json_array(values):
+    # How streamed responses were encoded before the row encoders: the
+    # same bytes as json.dumps(list(values)), one element at a time
+    yield b"["
+    separator = b""
+    for value in values:
+        yield separator + json.dumps(value).encode()
+        separator = b", "
+    yield b"]"
+
+
+def item_to_dict(item):
+    # The per-handler conversion the encoders replaced
+    return {
+        "id": item[0],
+        "category_id": item[1],
+        "name": item[2],
+        "description": item[3],
+        "price": item[4],
+        "created_at": item[5],
+        "updated_at": item[6]
+    }
+
+
+def categories_to_dicts(rows):
+    current = None
+    for row in rows:
+        if current is None or current["id"] != row[0]:
+            if current is not None:
+                yield current
+            current = {"id": row[0], "name": row[1], "items": []}
+        if row[2] is not None:
+            current["items"].append({"id": row[2], "name": row[3], "description": row[4], "price": row[5]})
+    if current is not None:
+        yield current
+
+
+def cases(pages, category_rows):
+    # name -> (before, after, units); before and after encode one unit
+    return {
+        "items_streamed": (
+            lambda page: b"".join(iter_json_array(item_to_dict(item) for item in page)),
+            lambda page: b"".join(item_encoder.iter_array(page)),
+            pages,
+        ),
+        "items_buffered": (
+            lambda page: json.dumps([item_to_dict(item) for item in page]).encode(),
+            item_encoder.dumps_array,
+            pages,
+        ),
+        "single_item": (
+            lambda page: [json.dumps(item_to_dict(item)).encode() for item in page],
+            lambda page: [item_encoder.dumps(item) for item in page],
+            pages,
+        ),
+        "categories_streamed": (
+            lambda rows: b"".join(iter_json_array(categories_to_dicts(rows))),
+            lambda rows: b"".join(iter_grouped_array(rows, category_encoder, category_item_encoder, "items")),
+            [category_rows],
+        ),
+    }
+
+
+def cpu_per_item(before, after, units, repeat):
+    # Best of repeat runs, alternating sides so drift hits both alike. The
+    # garbage collector stays on, as in the server: the dicts are what
+    # trigger its collections.
+    count = sum(len(unit) for unit in units)
+    best = [None, None]
+    for _ in range(repeat):
+        for side, encode in enumerate((before, after)):
+            start = time.process_time()
+            for unit in units:
+                encode(unit)
+            elapsed = time.process_time() - start
+            best[side] = elapsed if best[side] is None else min(best[side], elapsed)
+    return [round(seconds / count * 1e6, 3) for seconds in best]
+
+
+def peak_per_item(encode, units):
+    # Each body is dropped before the next is made, so the peak is what
+    # encoding one unit takes, its output included
+    tracemalloc.start()
+    for unit in units:
+        encode(unit)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return round(peak / max(len(unit) for unit in units), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--categories", type=int, default=100)
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--page", type=int, default=500, help="Items per page")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    path = seed_database(args.categories, args.items)
+    try:
+        conn = sqlite3.connect(path)
+        items = conn.execute("SELECT * FROM items ORDER BY id").fetchall()
+        category_rows = conn.execute(
+            """
+            SELECT c.id, c.name, i.id, i.name, i.description, i.price
+            FROM categories c
+            LEFT JOIN items i ON i.category_id = c.id
+            ORDER BY c.id, i.id
+        """
+        ).fetchall()
+        conn.close()
+    finally:
+        os.remove(path)
+
+    pages = [items[start:start + args.page] for start in range(0, len(items), args.page)]
+    results = {}
+    for name, (before, after, units) in cases(pages, category_rows).items():
+        if any(before(unit) != after(unit) for unit in units):
+            raise SystemExit(f"{name}: encoders and json.dumps disagree")
+        cpu_before, cpu_after = cpu_per_item(before, after, units, args.repeat)
+        results[name] = {
+            "cpu_us_per_item": {"dicts": cpu_before, "encoder": cpu_after},
+            "peak_bytes_per_item": {"dicts": peak_per_item(before, units), "encoder": peak_per_item(after, units)},
+            "speedup": round(cpu_before / cpu_after, 2) if cpu_after else None,
+        }
+    print(json.dumps({"items": len(items), "page": args.page, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Peak memory of GET /categories and GET /items, buffered vs streamed.
+
+    python -m benchmarks.bench_streaming_memory --items 200000
+"""
+import argparse
+import json
+import os
+import tracemalloc
+
+from benchmarks.common import BenchHandler, seed_database
+from config import Config
+from handlers.handlers import handle_get_all_categories, handle_get_items
+from models.models import Database
+from utils.utils import send_json_response
+
+
+def measure(fn):
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def buffered_categories():
+    db = Database.from_pool()
+    send_json_response(BenchHandler(), 200, db.get_categories_with_items())
+    db.close()
+
+
+def buffered_items(per_page):
+    def run():
+        db = Database.from_pool()
+        items = [dict(zip(("id", "category_id", "name", "description", "price", "created_at", "updated_at"), row))
+                 for row in db.get_items(per_page, 0)]
+        send_json_response(BenchHandler(), 200, {"items": items, "pagination": {}})
+        db.close()
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--categories", type=int, default=100)
+    parser.add_argument("--items", type=int, default=100000)
+    args = parser.parse_args()
+
+    path = seed_database(args.categories, args.items)
+    Config.DATABASE = path
+    try:
+        per_page = args.items
+        results = {
+            "items_in_db": args.items,
+            "categories_buffered_peak_bytes": measure(buffered_categories),
+            "categories_streamed_peak_bytes": measure(
+                lambda: handle_get_all_categories(BenchHandler("/categories"))
+            ),
+            "items_page_buffered_peak_bytes": measure(buffered_items(per_page)),
+            "items_page_streamed_peak_bytes": measure(
+                lambda: handle_get_items(BenchHandler(f"/items?per_page={per_page}"))
+            ),
+        }
+        print(json.dumps(results, indent=2))
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
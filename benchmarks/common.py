@@ -0,0 +1,57 @@
+import os
+import sqlite3
+import tempfile
+
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "schema.sql")
+
+
+def seed_database(categories=100, items=10000, path=None):
+    # Builds a throwaway database for benchmarks; returns its path
+    if path is None:
+        handle, path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+    conn = sqlite3.connect(path)
+    with open(SCHEMA) as schema_file:
+        conn.executescript(schema_file.read())
+    conn.executemany(
+        "INSERT INTO categories (id, name) VALUES (?, ?)",
+        ((index + 1, f"category-{index}") for index in range(categories)),
+    )
+    conn.executemany(
+        "INSERT INTO items (category_id, name, description, price) VALUES (?, ?, ?, ?)",
+        (
+            (index % categories + 1, f"item-{index}", f"Description of item {index}", index % 1000 + 0.99)
+            for index in range(items)
+        ),
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+class NullWriter:
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+
+
+class BenchHandler:
+    # Just enough of BaseHTTPRequestHandler for the response helpers
+    def __init__(self, path="/", headers=None):
+        self.path = path
+        self.headers = headers or {}
+        self.request_version = "HTTP/1.1"
+        self.protocol_version = "HTTP/1.1"
+        self.close_connection = False
+        self.wfile = NullWriter()
+
+    def send_response(self, code):
+        self.status = code
+
+    def send_header(self, name, value):
+        pass
+
+    def end_headers(self):
+        pass
@@ -0,0 +1,344 @@
+"""Throughput and latency of the HTTP API under a concurrent request mix.
+
+    python -m benchmarks.loadtest --items 1000,100000 --concurrency 16 --duration 10
+    python -m benchmarks.loadtest --items 100000 --save-baseline benchmarks/baseline.json
+    python -m benchmarks.loadtest --items 100000 --baseline benchmarks/baseline.json
+
+For each scale a fresh database is seeded and migrated, the server runs in
+its own process (so the load generator does not share its GIL), and every
+worker thread drives a weighted mix of endpoints for --duration seconds.
+With --baseline, any endpoint whose throughput drops or whose p99 grows by
+more than --tolerance exits non-zero.
+"""
+import argparse
+import http.client
+import io
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stderr, redirect_stdout
+
+from migration import Migration, SEED_MATERIALS, SEED_PRODUCTS
+from utils.utils import encode_cursor
+
+DEFAULT_MIX = (
+    "item=4,items_page=2,items_cursor=2,items_filtered=2,search=1,categories=1,categories_names=1,"
+    "category_stats=1,create_item=1,create_items_batch=1,update_item=1,update_items=1,delete_items=1"
+)
+
+
+def build_requests(items, categories):
+    # name -> fn(rng) returning (method, path, body); ids stay within the
+    # seeded rows, except deletes, which only reach rows the run created
+    def item(rng):
+        return "GET", f"/items/{rng.randint(1, items)}", None
+
+    def items_page(rng):
+        return "GET", f"/items?page={rng.randint(1, 50)}&per_page=20", None
+
+    def items_cursor(rng):
+        # A page from anywhere in the listing, as a client following
+        # next_cursor would reach it
+        cursor = encode_cursor({"id": rng.randint(0, items)})
+        return "GET", f"/items?cursor={cursor}&per_page=20", None
+
+    def items_filtered(rng):
+        low = rng.choice((0, 10, 25, 50, 100))
+        return "GET", f"/items?category_id={rng.randint(1, categories)}&min_price={low}&max_price={low * 2 + 20}&sort=price&per_page=20", None
+
+    def search(rng):
+        return "GET", f"/items/search?q={rng.choice(SEED_MATERIALS)}+{rng.choice(SEED_PRODUCTS)}", None
+
+    def categories_all(rng):
+        return "GET", "/categories", None
+
+    def categories_names(rng):
+        return "GET", "/categories/names", None
+
+    def category_stats(rng):
+        return "GET", "/categories/stats", None
+
+    def new_item(rng):
+        return {"category_id": rng.randint(1, categories), "name": f"load-{rng.random():.8f}", "description": "Load test", "price": 9.99}
+
+    def create_item(rng):
+        return "POST", "/items", new_item(rng)
+
+    def create_items_batch(rng):
+        return "POST", "/items/batch", [new_item(rng) for _ in range(20)]
+
+    def update_item(rng):
+        body = {"name": f"load-{rng.random():.8f}", "description": "Updated", "price": round(rng.uniform(1, 999), 2)}
+        return "PUT", f"/items/{rng.randint(1, items)}", body
+
+    def update_items(rng):
+        ids = rng.sample(range(1, items + 1), min(20, items))
+        return "PATCH", "/items", {"ids": ids, "set": {"description": f"Bulk {rng.random():.8f}"}}
+
+    def delete_items(rng):
+        # Rows created during the run get ids above the seeded ones
+        start = items + rng.randint(1, 1000)
+        return "DELETE", "/items", {"ids": list(range(start, start + 20))}
+
+    return {
+        "item": item,
+        "items_page": items_page,
+        "items_cursor": items_cursor,
+        "items_filtered": items_filtered,
+        "search": search,
+        "categories": categories_all,
+        "categories_names": categories_names,
+        "category_stats": category_stats,
+        "create_item": create_item,
+        "create_items_batch": create_items_batch,
+        "update_item": update_item,
+        "update_items": update_items,
+        "delete_items": delete_items,
+    }
+
+
+def parse_mix(text, available):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in available:
+            raise SystemExit(f"Unknown endpoint {name!r}; choose from {', '.join(available)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def serve(db_path, threads, ready, workers=1):
+    # Runs in the server process; SIGTERM shuts it down cleanly, including
+    # the password-hashing workers and any --workers processes
+    from config import Config
+    Config.DATABASE = db_path
+    import server
+
+    # Silences the per-request access log, which would otherwise be
+    # part of what gets measured
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull), redirect_stderr(devnull):
+        server.run_server(port=0, threads=threads, on_ready=ready.put, workers=workers)
+
+
+def prepare_database(items, categories, seed):
+    # Same generator as `migration.py migrate seed`, so a given --seed
+    # always loads the same rows
+    handle, path = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    migration = Migration(path)
+    with redirect_stdout(io.StringIO()):
+        migration.connect()
+        try:
+            migration.load_seed_data(categories, items, users=0, seed=seed)
+        finally:
+            migration.close()
+    return path
+
+
+def login(port):
+    # Registers a throwaway user through the API and returns its token
+    conn = http.client.HTTPConnection("localhost", port, timeout=30)
+    credentials = json.dumps({"username": f"load-{os.getpid()}-{time.time_ns()}", "password": "load-test"})
+    headers = {"Content-Type": "application/json"}
+    for path in ("/register", "/login"):
+        conn.request("POST", path, credentials, headers)
+        response = conn.getresponse()
+        body = response.read()
+        if response.status >= 300:
+            raise SystemExit(f"POST {path} failed with {response.status}: {body[:200]!r}")
+    conn.close()
+    return json.loads(body)["token"]
+
+
+def worker(port, token, mix, requests, deadline, warmup_until, seed, results):
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    conn = http.client.HTTPConnection("localhost", port, timeout=30)
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        name = rng.choices(names, weights)[0]
+        method, path, body = requests[name](rng)
+        headers = {"Authorization": f"Bearer {token}"}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, payload, headers)
+            response = conn.getresponse()
+            response.read()
+            failed = response.status >= 400
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            failed = True
+        elapsed = time.perf_counter() - start
+        if start < warmup_until:
+            continue
+        if failed:
+            errors[name] += 1
+        else:
+            latencies[name].append(elapsed)
+    conn.close()
+    results.append((latencies, errors))
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, seconds):
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "rps": round(len(values) / seconds, 1),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3) if values else None,
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3) if values else None,
+    }
+
+
+def run_scale(items, args):
+    categories = max(1, min(args.categories, items))
+    db_path = prepare_database(items, categories, args.seed)
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    # Not a daemon: the server starts its own password-hashing processes
+    process = context.Process(target=serve, args=(db_path, args.threads, ready, args.workers))
+    process.start()
+    try:
+        port = ready.get(timeout=60)
+        token = login(port)
+        requests = build_requests(items, categories)
+        mix = parse_mix(args.mix, requests)
+
+        start = time.perf_counter()
+        warmup_until = start + args.warmup
+        deadline = warmup_until + args.duration
+        results = []
+        threads = [
+            threading.Thread(
+                target=worker,
+                args=(port, token, mix, requests, deadline, warmup_until, args.seed + index, results),
+            )
+            for index in range(args.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        process.terminate()
+        process.join()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+    endpoints = {}
+    all_latencies = []
+    all_errors = 0
+    for name in mix:
+        latencies = [value for worker_latencies, _ in results for value in worker_latencies[name]]
+        errors = sum(worker_errors[name] for _, worker_errors in results)
+        endpoints[name] = summarize(latencies, errors, args.duration)
+        all_latencies.extend(latencies)
+        all_errors += errors
+    return {"total": summarize(all_latencies, all_errors, args.duration), "endpoints": endpoints}
+
+
+def error_rate(row):
+    attempts = row["requests"] + row["errors"]
+    return row["errors"] / attempts if attempts else 0.0
+
+
+def compare(report, baseline, tolerance):
+    # Returns a message per regression; scales and endpoints missing from
+    # either side, or never exercised in the baseline, are skipped
+    regressions = []
+    for scale, result in report["scales"].items():
+        expected = baseline.get("scales", {}).get(scale)
+        if expected is None:
+            continue
+        rows = dict(result["endpoints"], total=result["total"])
+        expected_rows = dict(expected["endpoints"], total=expected["total"])
+        for name, row in rows.items():
+            before = expected_rows.get(name)
+            if before is None or not before["requests"]:
+                continue
+            label = f"{scale} items {name}"
+            if error_rate(row) > error_rate(before) * (1 + tolerance):
+                regressions.append(f"{label}: {error_rate(row):.2%} errors, baseline {error_rate(before):.2%}")
+            if not row["requests"]:
+                regressions.append(f"{label}: no successful requests, baseline {before['requests']}")
+                continue
+            if row["rps"] < before["rps"] * (1 - tolerance):
+                regressions.append(f"{label}: {row['rps']} req/s, baseline {before['rps']}")
+            if row["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+                regressions.append(f"{label}: p99 {row['p99_ms']} ms, baseline {before['p99_ms']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", default="1000", help="Comma-separated database sizes, e.g. 1000,100000,1000000")
+    parser.add_argument("--categories", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8, help="Client threads")
+    parser.add_argument("--threads", type=int, default=8, help="Server worker threads")
+    parser.add_argument("--workers", type=int, default=1, help="Server worker processes")
+    parser.add_argument("--duration", type=float, default=10.0, help="Measured seconds per scale")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Unmeasured seconds before each run")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint=weight pairs")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Also write the JSON report here")
+    parser.add_argument("--baseline", help="Report to compare against")
+    parser.add_argument("--save-baseline", help="Write this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed fractional regression")
+    args = parser.parse_args()
+
+    report = {
+        "config": {
+            "concurrency": args.concurrency,
+            "threads": args.threads,
+            "workers": args.workers,
+            "duration": args.duration,
+            "mix": args.mix,
+        },
+        "scales": {},
+    }
+    for items in (int(value) for value in args.items.split(",")):
+        report["scales"][str(items)] = run_scale(items, args)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as report_file:
+                report_file.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("REGRESSIONS:", file=sys.stderr)
+            for message in regressions:
+                print(f"  {message}", file=sys.stderr)
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of the baseline", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
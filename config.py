@@ -1,3 +1,114 @@
 class Config:
     SECRET_KEY = 'secret_key'
     DATABASE = 'inventory.db'
+
+    # Signed auth tokens; verified tokens are cached for TOKEN_CACHE_TTL seconds
+    TOKEN_TTL = 3600
+    TOKEN_CACHE_SIZE = 1024
+    TOKEN_CACHE_TTL = 60
+
+    # Process pool for password hashing (0 workers hashes inline)
+    PASSWORD_WORKERS = 2
+    PASSWORD_QUEUE_DEPTH = 32
+    PASSWORD_TIMEOUT = 10.0
+
+    # Threaded server; keep POOL_MAX_SIZE >= SERVER_THREADS
+    SERVER_THREADS = 8
+    SERVER_BACKLOG = 128
+
+    # Pre-fork mode: SERVER_WORKERS > 1 forks that many processes, each with
+    # SERVER_THREADS threads and its own connection pool, around one shared
+    # listening socket. A worker that exits is replaced, at most once per
+    # WORKER_RESTART_DELAY seconds if it keeps dying right after starting.
+    SERVER_WORKERS = 1
+    WORKER_RESTART_DELAY = 1.0
+
+    # HTTP/1.1 keep-alive: idle seconds before a connection is closed, and
+    # requests served per connection before the server asks to close it.
+    # Each open connection holds a worker thread, so keep the timeout short.
+    KEEPALIVE_TIMEOUT = 5.0
+    KEEPALIVE_MAX_REQUESTS = 100
+    # Unread request bodies up to this size are discarded to keep the
+    # connection usable; larger ones close it
+    KEEPALIVE_DRAIN_LIMIT = 65536
+
+    # PRAGMAs applied to every SQLite connection; pick one of SQLITE_PROFILES
+    SQLITE_PROFILE = 'balanced'
+    SQLITE_PROFILES = {
+        # Every commit is fsynced, even in WAL mode
+        'durable': {
+            'journal_mode': 'WAL',
+            'synchronous': 'FULL',
+            'cache_size': -16000,
+            'mmap_size': 0,
+            'temp_store': 'DEFAULT',
+            'busy_timeout': 5000,
+        },
+        # WAL + NORMAL only fsyncs at checkpoints; a power cut can lose the
+        # last commits but never corrupts the database
+        'balanced': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'cache_size': -64000,
+            'mmap_size': 268435456,
+            'temp_store': 'MEMORY',
+            'busy_timeout': 5000,
+        },
+        # No fsyncs at all; for bulk loads and disposable databases
+        'throughput': {
+            'journal_mode': 'WAL',
+            'synchronous': 'OFF',
+            'cache_size': -262144,
+            'mmap_size': 1073741824,
+            'temp_store': 'MEMORY',
+            'busy_timeout': 10000,
+        },
+    }
+
+    # Connection pool used by the request handlers
+    POOL_MAX_SIZE = 8
+    POOL_TIMEOUT = 5.0
+    POOL_HEALTH_CHECK_INTERVAL = 30.0
+
+    # Seconds a cached COUNT(*) of items may be served for GET /items
+    ITEM_COUNT_TTL = 30.0
+
+    # Streamed responses: rows per fetchmany() and bytes per written chunk
+    STREAM_FETCH_SIZE = 500
+    STREAM_CHUNK_SIZE = 16384
+
+    # JSON bodies of at least GZIP_MIN_BYTES are gzipped for clients that
+    # send Accept-Encoding: gzip. GZIP_LEVEL runs from 1 (fastest) to 9
+    # (smallest); 0 turns compression off.
+    GZIP_MIN_BYTES = 1024
+    GZIP_LEVEL = 6
+
+    # In-process cache of GET responses, revalidated with ETags
+    RESPONSE_CACHE_MAX_ENTRIES = 256
+    RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    RESPONSE_CACHE_MAX_BODY_BYTES = 4 * 1024 * 1024
+
+    # Group commit: single-item writes from the request handlers go through
+    # one writer thread, which commits everything that arrives within
+    # GROUP_COMMIT_WINDOW seconds (at most GROUP_COMMIT_MAX_BATCH writes)
+    # in a single transaction
+    GROUP_COMMIT = False
+    GROUP_COMMIT_WINDOW = 0.002
+    GROUP_COMMIT_MAX_BATCH = 64
+
+    # Statements slower than this many seconds are logged, with their
+    # parameter types and query plan, to SLOW_QUERY_LOG (None: keep the
+    # latest ones in memory only) and GET /diagnostics
+    SLOW_QUERY_THRESHOLD = 0.1
+    SLOW_QUERY_LOG = 'slow_queries.log'
+
+    # cProfile 1 in PROFILE_SAMPLE_EVERY requests (0: never), plus any
+    # request sending "X-Profile: <PROFILE_TOKEN>" (None: header ignored).
+    # Profiles go to PROFILE_DIR, which keeps the newest PROFILE_MAX_FILES.
+    PROFILE_SAMPLE_EVERY = 0
+    PROFILE_TOKEN = None
+    PROFILE_DIR = 'profiles'
+    PROFILE_MAX_FILES = 200
+
+    # Largest array accepted by POST /items/batch
+    BATCH_MAX_ITEMS = 50000
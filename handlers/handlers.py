@@ -1,85 +1,346 @@
-from models.models import Database
+from functools import wraps
+from models.models import (
+    Database,
+    table_version,
+    ITEM_COLUMNS,
+    ITEM_SORTS,
+    CATEGORY_COLUMNS,
+    CATEGORY_ITEM_COLUMNS,
+    CATEGORY_STATS_COLUMNS,
+    validate_item,
+    validate_item_changes,
+    is_price,
+)
+from models.pool import get_pool, sqlite_profile, PROFILE_PRAGMAS
+from models.writer import writer_snapshots
 from config import Config
-from utils.utils import Auth, send_json_response, authenticate
-from urllib.parse import urlparse, parse_qs
+from utils.cache import response_cache, etag_matches, gzip_etag, if_none_match_any
+from utils.passwords import hasher, HasherBusyError
+from utils.metrics import metrics
+from utils.profiler import profiler
+from utils.serializer import row_encoder, iter_grouped_array
+from models.querylog import slow_query_log
+from utils.utils import (
+    auth,
+    send_json_response,
+    send_json_bytes,
+    send_not_modified,
+    send_json_stream,
+    authenticate,
+    encode_cursor,
+    decode_cursor,
+    request_url,
+    count_response_bytes,
+)
+from urllib.parse import parse_qs
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+# Row tuples go straight to JSON through these, one per query shape
+item_encoder = row_encoder(ITEM_COLUMNS)
+category_encoder = row_encoder(CATEGORY_COLUMNS)
+category_item_encoder = row_encoder(CATEGORY_ITEM_COLUMNS, skip=len(CATEGORY_COLUMNS))
+category_stats_encoder = row_encoder(CATEGORY_STATS_COLUMNS)
 
 '''
 GET
 '''
+def cached_get(*tables):
+    # Serves repeat GETs from the response cache. The ETag is derived from
+    # the versions of the tables the response reads, so If-None-Match can
+    # be answered with 304 without touching SQLite; any write through
+    # Database bumps a version and retires the old tag. Gzipped responses
+    # carry the "-gzip" variant of the tag, which revalidates the same way.
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(self, *args):
+            key = self.path
+            versions = ",".join(f"{table}:{table_version(table)}" for table in tables)
+            etag = response_cache.etag_for(key, versions)
+            if_none_match = self.headers.get("If-None-Match")
+            for candidate in (etag, gzip_etag(etag)):
+                if etag_matches(if_none_match, candidate):
+                    response_cache.record_not_modified()
+                    return send_not_modified(self, candidate)
+            # "*" matches only if the handler finds something to send: a
+            # 200 becomes a 304, a 404 goes out as is
+            self.if_none_match_any = if_none_match_any(if_none_match)
+            self.response_cache_target = (key, etag)
+            try:
+                body = response_cache.get(key, etag)
+                if body is not None:
+                    return send_json_bytes(self, 200, body)
+                return handler(self, *args)
+            finally:
+                self.response_cache_target = None
+                self.if_none_match_any = False
+        return wrapper
+    return decorator
+
+@cached_get("categories")
 def handle_get_categories(self):
-    db = Database(Config.DATABASE)
+    db = Database.from_pool()
     categories = db.get_categories()
     db.close()
-    result = []
-    for category in categories:
-        result.append({
-            "id": category[0],
-            "name": category[1]
-        })
-    return send_json_response(self, 200, result)
+    return send_json_bytes(self, 200, category_encoder.dumps_array(categories))
 
+@cached_get("categories", "items")
 def handle_get_all_categories(self):
-        db = Database(Config.DATABASE)
-        categories_with_items = db.get_categories_with_items()
+        db = Database.from_pool()
+        return send_json_stream(self, 200, stream_categories(db))
+
+@cached_get("categories", "items")
+def handle_get_category_stats(self):
+    db = Database.from_pool()
+    try:
+        stats = db.get_category_stats()
+    except sqlite3.OperationalError:
+        db.close()
+        return send_json_response(self, 503, {"message": "Category stats missing, run migrations"})
+    db.close()
+    return send_json_bytes(self, 200, category_stats_encoder.dumps_array(stats))
+
+def stream_categories(db):
+    try:
+        yield from iter_grouped_array(
+            db.iter_category_item_rows(), category_encoder, category_item_encoder, "items"
+        )
+    finally:
+        db.close()
+
+def stream_items_page(db, rows, pagination):
+    # pagination is called once the rows are written, so cursor mode can
+    # build next_cursor from the last row it saw
+    try:
+        yield b'{"items": '
+        yield from item_encoder.iter_array(rows)
+        yield b', "pagination": ' + json.dumps(pagination()).encode() + b'}'
+    finally:
         db.close()
-        return send_json_response(self, 200, categories_with_items)
 
+def parse_item_filters(query_params):
+    filters = {}
+    if 'category_id' in query_params:
+        filters['category_id'] = int(query_params['category_id'][0])
+    for name in ('min_price', 'max_price'):
+        if name in query_params:
+            filters[name] = float(query_params[name][0])
+            if not is_price(filters[name]):
+                # float() accepts "nan" and "inf", which bind as NULL or
+                # match nothing useful
+                raise ValueError(f"{name} must be a finite number")
+    if 'updated_since' in query_params:
+        # Normalised to the stored "YYYY-MM-DD HH:MM:SS" form so the string
+        # comparison in SQL is also a time comparison
+        updated_since = datetime.fromisoformat(query_params['updated_since'][0])
+        filters['updated_since'] = updated_since.strftime("%Y-%m-%d %H:%M:%S")
+    return filters
+
+@cached_get("items")
 def handle_get_items(self):
-    db = Database(Config.DATABASE)
-    parsed_url = urlparse(self.path)
-    query_params = parse_qs(parsed_url.query)
+    query_params = parse_qs(request_url(self).query, keep_blank_values=True)
 
+    try:
+        page = int(query_params.get('page', [1])[0])
+        per_page = int(query_params.get('per_page', [10])[0])
+    except ValueError:
+        return send_json_response(self, 400, {"message": "page and per_page must be integers"})
+    if page < 1 or per_page < 1:
+        return send_json_response(self, 400, {"message": "page and per_page must be positive"})
 
-    page = int(query_params.get('page', [1])[0]) 
-    per_page = int(query_params.get('per_page', [10])[0]) 
+    sort = query_params.get('sort', ['id'])[0]
+    if sort not in ITEM_SORTS:
+        return send_json_response(self, 400, {"message": f"sort must be one of {', '.join(ITEM_SORTS)}"})
+    try:
+        filters = parse_item_filters(query_params)
+    except ValueError:
+        return send_json_response(self, 400, {"message": "Invalid category_id, min_price, max_price or updated_since"})
 
-    
-    offset = (page - 1) * per_page
+    if 'cursor' in query_params:
+        return handle_get_items_by_cursor(self, query_params, per_page, filters, sort)
 
-    items = db.get_items(per_page, offset)
-    
+    db = Database.from_pool()
+    offset = (page - 1) * per_page
 
-    total_items = db.get_total_items()
+    total_items = db.get_cached_total_items(filters)
     total_pages = -(-total_items // per_page)
 
-    result = {
-        'items': [],
-        'pagination': {
-            'total_items': total_items,
-            'total_pages': total_pages,
-            'current_page': page,
-        }
+    pagination = {
+        'total_items': total_items,
+        'total_pages': total_pages,
+        'current_page': page,
     }
+    items = db.iter_items(per_page, offset, filters, sort)
+    return send_json_stream(self, 200, stream_items_page(db, items, lambda: pagination))
+
+def is_id(value):
+    # JSON true and false decode to bool, which is an int subclass
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def valid_cursor_key(column, key):
+    # The key is bound into the page query, so it must be a value the sort
+    # column can hold; anything else would fail mid-stream
+    if column == "id":
+        return key is None
+    if column == "price":
+        return is_price(key)
+    return isinstance(key, str)
+
+def handle_get_items_by_cursor(self, query_params, per_page, filters, sort):
+    # An empty ?cursor= starts from the beginning; next_cursor is null on the last page.
+    # The cursor holds the sort key and id of the last row sent.
+    cursor = query_params['cursor'][0]
+    after = None
+    if cursor:
+        try:
+            position = decode_cursor(cursor)
+            if position.get("sort", "id") != sort:
+                raise ValueError("cursor was issued for a different sort")
+            key = position["key"] if sort != "id" else None
+            if not is_id(position["id"]) or not valid_cursor_key(ITEM_SORTS[sort][0], key):
+                raise ValueError("cursor key does not match the sort column")
+            after = (key, position["id"])
+        except (ValueError, KeyError, TypeError):
+            return send_json_response(self, 400, {"message": "Invalid cursor"})
+
+    include_total = query_params.get('include_total', ['0'])[0] in ('1', 'true')
+    sort_index = ITEM_COLUMNS.index(ITEM_SORTS[sort][0])
+    db = Database.from_pool()
+    page_state = {'last': None, 'has_more': False}
 
-    for item in items:
-        result['items'].append({
-            "id": item[0],
-            "category_id": item[1],
-            "name": item[2],
-            "description": item[3],
-            "price": item[4],
-            "created_at": item[5],
-            "updated_at": item[6]
-        })
+    def page_rows():
+        # One extra row tells us whether another page exists without counting
+        for index, item in enumerate(db.iter_items_after(after, per_page + 1, filters, sort)):
+            if index == per_page:
+                page_state['has_more'] = True
+                break
+            page_state['last'] = item
+            yield item
+
+    def pagination():
+        next_cursor = None
+        if page_state['has_more']:
+            last = page_state['last']
+            position = {"id": last[0]}
+            if sort != "id":
+                position.update(sort=sort, key=last[sort_index])
+            next_cursor = encode_cursor(position)
+        result = {
+            'per_page': per_page,
+            'next_cursor': next_cursor,
+        }
+        if include_total:
+            result['total_items'] = db.get_cached_total_items(filters)
+        return result
+
+    return send_json_stream(self, 200, stream_items_page(db, page_rows(), pagination))
+
+@cached_get("items")
+def handle_search_items(self):
+    query_params = parse_qs(request_url(self).query)
+    query = query_params.get('q', [''])[0].strip()
+    if not query:
+        return send_json_response(self, 400, {"message": "q is required"})
+    try:
+        per_page = int(query_params.get('per_page', [10])[0])
+        after = None
+        if 'cursor' in query_params:
+            position = decode_cursor(query_params['cursor'][0])
+            after = (float(position["score"]), int(position["id"]))
+    except (ValueError, KeyError, TypeError):
+        return send_json_response(self, 400, {"message": "Invalid per_page or cursor"})
+    if per_page < 1:
+        return send_json_response(self, 400, {"message": "per_page must be positive"})
+
+    db = Database.from_pool()
+    try:
+        rows = db.search_items(query, per_page + 1, after)
+    except sqlite3.OperationalError as e:
+        db.close()
+        if "no such table" in str(e):
+            return send_json_response(self, 503, {"message": "Search index missing, run migrations"})
+        return send_json_response(self, 400, {"message": str(e)})
     db.close()
-    return send_json_response(self, 200, result)
 
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor({"score": rows[-1][7], "id": rows[-1][0]})
+    pagination = {
+        'per_page': per_page,
+        'next_cursor': next_cursor,
+    }
+    return send_json_bytes(
+        self,
+        200,
+        b'{"items": ' + item_encoder.dumps_array(rows) + b', "pagination": ' + json.dumps(pagination).encode() + b'}',
+    )
+
+@cached_get("items")
 def handle_get_item(self, item_id):
-    db = Database(Config.DATABASE)
+    db = Database.from_pool()
     item = db.get_item(item_id)
     db.close()
     if item is None:
         return send_json_response(self, 404, {"message": "Item not found"})
-    result = {
-        "id": item[0],
-        "category_id": item[1],
-        "name": item[2],
-        "description": item[3],
-        "price": item[4],
-        "created_at": item[5],
-        "updated_at": item[6]
-    }
-    return send_json_response(self, 200, result)
+    return send_json_bytes(self, 200, item_encoder.dumps(item))
+
+def handle_get_metrics(self):
+    pool = get_pool().snapshot()
+    cache = response_cache.snapshot()
+    collected = [
+        ("inventory_pool_connections", "gauge", "Open pooled connections", {(): pool["size"]}),
+        ("inventory_pool_idle_connections", "gauge", "Idle pooled connections", {(): pool["idle"]}),
+        ("inventory_pool_events_total", "counter", "Connection pool events",
+         {(("event", event),): pool[event] for event in ("hits", "waits", "opens", "timeouts", "discarded")}),
+        ("inventory_response_cache_entries", "gauge", "Cached GET responses", {(): cache["entries"]}),
+        ("inventory_response_cache_bytes", "gauge", "Bytes held by the response cache", {(): cache["bytes"]}),
+        ("inventory_response_cache_events_total", "counter", "Response cache lookups",
+         {(("event", event),): cache[event] for event in ("hits", "misses", "not_modified", "evictions", "gzip_hits")}),
+        ("inventory_auth_cache_events_total", "counter", "Token verification cache lookups",
+         {(("event", event),): value for event, value in auth.stats.items()}),
+        ("inventory_password_hashes_total", "counter", "Password hashing calls",
+         {(("outcome", outcome),): value for outcome, value in hasher.stats.items()}),
+        ("inventory_group_commit_batches_total", "counter", "Group-commit transactions",
+         {(("database", db_name),): writer["batches"] for db_name, writer in writer_snapshots().items()}),
+        ("inventory_group_commit_operations_total", "counter", "Writes committed through group commit",
+         {(("database", db_name),): writer["operations"] for db_name, writer in writer_snapshots().items()}),
+    ]
+    body = metrics.render(collected)
+    self.send_response(200)
+    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+    count_response_bytes(self, len(body))
+
+def handle_get_diagnostics(self):
+    profile, _ = sqlite_profile()
+    db = Database.from_pool()
+    pragmas = db.get_pragmas(PROFILE_PRAGMAS)
+    db.close()
+    return send_json_response(self, 200, {
+        # Everything below is per process; with --workers each has its own
+        "pid": os.getpid(),
+        "sqlite": {
+            "version": sqlite3.sqlite_version,
+            "profile": profile,
+            "pragmas": pragmas,
+        },
+        "pool": get_pool().snapshot(),
+        "response_cache": response_cache.snapshot(),
+        "auth_cache": dict(auth.stats),
+        "password_hasher": dict(hasher.stats),
+        "group_commit": {
+            "enabled": Config.GROUP_COMMIT,
+            "writers": writer_snapshots(),
+        },
+        "slow_queries": slow_query_log.snapshot(),
+        "profiler": profiler.snapshot(),
+    })
 
 '''
 POST
@@ -89,7 +350,7 @@ def handle_create_category(self, data):
     if not authenticate(self):
         return
     
-    db = Database(Config.DATABASE)
+    db = Database.from_pool()
     try:
         db.create_category(data['name'])
         db.close()
@@ -99,31 +360,45 @@ def handle_create_category(self, data):
         return send_json_response(self, 400, {"message": str(e)})
 
 def handle_login(self, data):
-    db = Database(Config.DATABASE)
+    db = Database.from_pool()
     user = db.get_user(data["username"])
-    if user is None or not db.check_password(user[2], data["password"]):
-        db.close()
-        return send_json_response(self, 401, {"message": "Unauthorized"})
-    token = Auth().generate_token()
+    # Hand the connection back before hashing, which may queue
     db.close()
+    try:
+        if user is None or not hasher.verify(user[2], data["password"]):
+            return send_json_response(self, 401, {"message": "Unauthorized"})
+    except HasherBusyError:
+        return send_json_response(self, 503, {"message": "Login is busy, try again"})
+    token = auth.generate_token(user[1])
     return send_json_response(self, 200, {"token": token})
 
 def handle_register(self, data):
-    db = Database(Config.DATABASE)
     if not all(key in data for key in ["username", "password"]):
-        db.close()
         return send_json_response(self, 400, {"message": "Missing required fields"})
 
-    if db.get_user(data["username"]) is not None:
-        db.close()
+    db = Database.from_pool()
+    existing = db.get_user(data["username"])
+    db.close()
+    if existing is not None:
         return send_json_response(self, 400, {"message": "Username already exists"})
 
-    db.create_user(data["username"], data["password"])
-    db.close()
+    try:
+        hashed_password = hasher.hash(data["password"])
+    except HasherBusyError:
+        return send_json_response(self, 503, {"message": "Registration is busy, try again"})
+
+    db = Database.from_pool()
+    try:
+        db.create_user(data["username"], data["password"], hashed_password)
+        db.close()
+    except sqlite3.IntegrityError:
+        # Lost a race with a concurrent registration of the same name
+        db.close()
+        return send_json_response(self, 400, {"message": "Username already exists"})
     return send_json_response(self, 201, {"message": "User created successfully"})
 
 def handle_get_items_by_category(self, category_id):
-    db = Database(Config.DATABASE)
+    db = Database.from_pool()
     items = db.get_items_by_category(category_id)
     db.close()
     if not items:
@@ -133,8 +408,12 @@ def handle_get_items_by_category(self, category_id):
 def handle_create_item(self, data):
     if not authenticate(self):
         return
-    
-    db = Database(Config.DATABASE)
+
+    error = validate_item(data)
+    if error is not None:
+        return send_json_response(self, 400, {"message": error})
+
+    db = Database.from_pool()
     try:
         db.create_item(
             data["category_id"],
@@ -149,6 +428,33 @@ def handle_create_item(self, data):
         return send_json_response(self, 500, {"message": {e}})
     
 
+def handle_create_items_batch(self, data):
+    if not authenticate(self):
+        return
+
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return send_json_response(self, 400, {"message": "Expected a non-empty array of items"})
+    if len(items) > Config.BATCH_MAX_ITEMS:
+        return send_json_response(self, 400, {"message": f"At most {Config.BATCH_MAX_ITEMS} items per batch"})
+
+    db = Database.from_pool()
+    try:
+        results = db.create_items(items)
+        db.close()
+    except Exception as e:
+        db.close()
+        return send_json_response(self, 500, {"message": str(e)})
+
+    created = sum(1 for result in results if "id" in result)
+    status = 201 if created else 400
+    return send_json_response(self, status, {
+        "created": created,
+        "failed": len(results) - created,
+        "results": results,
+    })
+
+
 '''
 PUT
 '''
@@ -156,8 +462,14 @@ PUT
 def handle_update_item(self, item_id, data):
     if not authenticate(self):
         return
-    
-    db = Database(Config.DATABASE)
+
+    if not isinstance(data, dict) or "name" not in data or "price" not in data:
+        return send_json_response(self, 400, {"message": "Missing required fields: name, price"})
+    error = validate_item_changes({field: data.get(field) for field in ("name", "description", "price")})
+    if error is not None:
+        return send_json_response(self, 400, {"message": error})
+
+    db = Database.from_pool()
     item = db.get_item(item_id)
 
 
@@ -178,6 +490,43 @@ def handle_update_item(self, item_id, data):
         db.close()
         return send_json_response(self, 400, {"messagew": str(e)})
 
+def parse_item_selector(data):
+    ids = data.get("ids")
+    category_id = data.get("category_id")
+    if ids is None and category_id is None:
+        raise ValueError("Select items with ids or category_id")
+    if ids is not None and (
+        not isinstance(ids, list) or not all(is_id(item_id) for item_id in ids)
+    ):
+        raise ValueError("ids must be an array of integers")
+    if category_id is not None and not is_id(category_id):
+        raise ValueError("category_id must be an integer")
+    return ids, category_id
+
+def handle_update_items(self, data):
+    if not authenticate(self):
+        return
+
+    try:
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object")
+        ids, category_id = parse_item_selector(data)
+        changes = data.get("set", {})
+        error = validate_item_changes(changes, data.get("price_factor"))
+        if error is not None:
+            raise ValueError(error)
+    except ValueError as e:
+        return send_json_response(self, 400, {"message": str(e)})
+
+    db = Database.from_pool()
+    try:
+        updated = db.update_items(changes, ids, category_id, data.get("price_factor"))
+        db.close()
+        return send_json_response(self, 200, {"updated": updated})
+    except Exception as e:
+        db.close()
+        return send_json_response(self, 400, {"message": str(e)})
+
 '''
 DELETE
 '''
@@ -186,7 +535,7 @@ def handle_delete_item(self, item_id):
     if not authenticate(self):
         return
     
-    db = Database(Config.DATABASE)
+    db = Database.from_pool()
     item = db.get_item(item_id)
 
 
@@ -202,4 +551,24 @@ def handle_delete_item(self, item_id):
         return send_json_response(self, 201, {"message": "Item Deleted"})
     except Exception as e:
         db.close()
-        return send_json_response(self, 400, {"messagew": str(e)})
\ No newline at end of file
+        return send_json_response(self, 400, {"messagew": str(e)})
+
+def handle_delete_items(self, data):
+    if not authenticate(self):
+        return
+
+    try:
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object")
+        ids, category_id = parse_item_selector(data)
+    except ValueError as e:
+        return send_json_response(self, 400, {"message": str(e)})
+
+    db = Database.from_pool()
+    try:
+        deleted = db.delete_items(ids, category_id)
+        db.close()
+        return send_json_response(self, 200, {"deleted": deleted})
+    except Exception as e:
+        db.close()
+        return send_json_response(self, 400, {"message": str(e)})
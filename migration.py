@@ -1,6 +1,286 @@
+import os
+import random
 import sqlite3
 import argparse
+import time
 import unittest
+from datetime import datetime
+from config import Config
+from models.pool import PROFILE_PRAGMAS, sqlite_profile
+from utils.passwords import hash_password
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+
+
+def create_index(name, table, columns):
+    def step(migration):
+        migration.build_index(name, table, columns)
+
+    return step
+
+
+def drop_index(name):
+    return f"DROP INDEX IF EXISTS {name}"
+
+
+def backfill_items_fts(migration, batch_size=10000):
+    # Index existing rows in id order, a batch at a time; the triggers are
+    # already in place, and the step's transaction keeps writers out
+    migration.cursor.execute("SELECT COUNT(*) FROM items")
+    total = migration.cursor.fetchone()[0]
+    done = 0
+    last_id = 0
+    while True:
+        migration.cursor.execute(
+            "SELECT MAX(id), COUNT(*) FROM (SELECT id FROM items WHERE id > ? ORDER BY id LIMIT ?)",
+            (last_id, batch_size),
+        )
+        batch_last_id, count = migration.cursor.fetchone()
+        if not count:
+            break
+        migration.cursor.execute(
+            """
+            INSERT INTO items_fts (rowid, name, description)
+            SELECT id, name, description FROM items WHERE id > ? AND id <= ?
+        """,
+            (last_id, batch_last_id),
+        )
+        last_id = batch_last_id
+        done += count
+        print(f"    indexed {done}/{total} items")
+
+
+def rebuild_category_stats(migration):
+    # Recomputes category_stats from items inside the caller's transaction;
+    # returns how many categories had drifted
+    migration.cursor.execute("DROP TABLE IF EXISTS temp.fresh_category_stats")
+    migration.cursor.execute(
+        """
+        CREATE TEMP TABLE fresh_category_stats AS
+        SELECT category_id, COUNT(*) AS item_count, SUM(price) AS price_sum,
+               MIN(price) AS min_price, MAX(price) AS max_price
+        FROM items
+        GROUP BY category_id
+    """
+    )
+    # Sums are compared to the cent: float rounding from incremental
+    # updates is not drift
+    migration.cursor.execute(
+        """
+        WITH stored AS (
+            SELECT category_id, item_count, ROUND(price_sum, 2), min_price, max_price
+            FROM category_stats WHERE item_count > 0
+        ), fresh AS (
+            SELECT category_id, item_count, ROUND(price_sum, 2), min_price, max_price
+            FROM temp.fresh_category_stats
+        )
+        SELECT COUNT(DISTINCT category_id) FROM (
+            SELECT category_id FROM (SELECT * FROM stored EXCEPT SELECT * FROM fresh)
+            UNION ALL
+            SELECT category_id FROM (SELECT * FROM fresh EXCEPT SELECT * FROM stored)
+        )
+    """
+    )
+    drifted = migration.cursor.fetchone()[0]
+    migration.cursor.execute("DELETE FROM category_stats")
+    migration.cursor.execute("INSERT INTO category_stats SELECT * FROM temp.fresh_category_stats")
+    migration.cursor.execute("DROP TABLE temp.fresh_category_stats")
+    return drifted
+
+
+# Versioned schema changes, applied in order by `migrate to N`. Each step
+# lists its up and down actions: SQL strings or callables that take the
+# Migration. Never edit a released step; add a new one instead.
+MIGRATIONS = [
+    (
+        1,
+        "Index items by category_id",
+        [create_index("idx_items_category_id", "items", ["category_id"])],
+        [drop_index("idx_items_category_id")],
+    ),
+    (
+        2,
+        "Index items by updated_at",
+        [create_index("idx_items_updated_at", "items", ["updated_at"])],
+        [drop_index("idx_items_updated_at")],
+    ),
+    (
+        3,
+        "Full-text search over item name and description",
+        [
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS items_fts
+            USING fts5(name, description, content='items', content_rowid='id')
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN
+                INSERT INTO items_fts (rowid, name, description)
+                VALUES (new.id, new.name, new.description);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN
+                INSERT INTO items_fts (items_fts, rowid, name, description)
+                VALUES ('delete', old.id, old.name, old.description);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF name, description ON items BEGIN
+                INSERT INTO items_fts (items_fts, rowid, name, description)
+                VALUES ('delete', old.id, old.name, old.description);
+                INSERT INTO items_fts (rowid, name, description)
+                VALUES (new.id, new.name, new.description);
+            END
+            """,
+            backfill_items_fts,
+        ],
+        [
+            "DROP TRIGGER IF EXISTS items_fts_insert",
+            "DROP TRIGGER IF EXISTS items_fts_delete",
+            "DROP TRIGGER IF EXISTS items_fts_update",
+            "DROP TABLE IF EXISTS items_fts",
+        ],
+    ),
+    (
+        4,
+        "Indexes for filtered and sorted item listings",
+        [
+            create_index("idx_items_price", "items", ["price"]),
+            create_index("idx_items_name", "items", ["name"]),
+            create_index("idx_items_category_price", "items", ["category_id", "price"]),
+            create_index("idx_items_category_updated_at", "items", ["category_id", "updated_at"]),
+            create_index("idx_items_category_name", "items", ["category_id", "name"]),
+        ],
+        [
+            drop_index("idx_items_price"),
+            drop_index("idx_items_name"),
+            drop_index("idx_items_category_price"),
+            drop_index("idx_items_category_updated_at"),
+            drop_index("idx_items_category_name"),
+        ],
+    ),
+    (
+        5,
+        "Per-category item count and price aggregates",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS category_stats (
+                category_id INTEGER PRIMARY KEY,
+                item_count INTEGER NOT NULL DEFAULT 0,
+                price_sum REAL NOT NULL DEFAULT 0,
+                min_price REAL,
+                max_price REAL
+            )
+            """,
+            # Min/max only need a lookup when the removed price was the
+            # extreme; idx_items_category_price makes that lookup O(log n)
+            """
+            CREATE TRIGGER IF NOT EXISTS category_stats_insert AFTER INSERT ON items BEGIN
+                INSERT INTO category_stats (category_id, item_count, price_sum, min_price, max_price)
+                VALUES (new.category_id, 1, new.price, new.price, new.price)
+                ON CONFLICT (category_id) DO UPDATE SET
+                    item_count = item_count + 1,
+                    price_sum = price_sum + new.price,
+                    min_price = MIN(COALESCE(min_price, new.price), new.price),
+                    max_price = MAX(COALESCE(max_price, new.price), new.price);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS category_stats_delete AFTER DELETE ON items BEGIN
+                UPDATE category_stats SET
+                    item_count = item_count - 1,
+                    price_sum = CASE WHEN item_count = 1 THEN 0 ELSE price_sum - old.price END,
+                    min_price = CASE WHEN old.price <= min_price
+                        THEN (SELECT MIN(price) FROM items WHERE category_id = old.category_id)
+                        ELSE min_price END,
+                    max_price = CASE WHEN old.price >= max_price
+                        THEN (SELECT MAX(price) FROM items WHERE category_id = old.category_id)
+                        ELSE max_price END
+                WHERE category_id = old.category_id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS category_stats_update AFTER UPDATE OF category_id, price ON items BEGIN
+                UPDATE category_stats SET
+                    item_count = item_count - 1,
+                    price_sum = CASE WHEN item_count = 1 THEN 0 ELSE price_sum - old.price END,
+                    min_price = CASE WHEN old.price <= min_price
+                        THEN (SELECT MIN(price) FROM items WHERE category_id = old.category_id)
+                        ELSE min_price END,
+                    max_price = CASE WHEN old.price >= max_price
+                        THEN (SELECT MAX(price) FROM items WHERE category_id = old.category_id)
+                        ELSE max_price END
+                WHERE category_id = old.category_id;
+                INSERT INTO category_stats (category_id, item_count, price_sum, min_price, max_price)
+                VALUES (new.category_id, 1, new.price, new.price, new.price)
+                ON CONFLICT (category_id) DO UPDATE SET
+                    item_count = item_count + 1,
+                    price_sum = price_sum + new.price,
+                    min_price = MIN(COALESCE(min_price, new.price), new.price),
+                    max_price = MAX(COALESCE(max_price, new.price), new.price);
+            END
+            """,
+            rebuild_category_stats,
+        ],
+        [
+            "DROP TRIGGER IF EXISTS category_stats_insert",
+            "DROP TRIGGER IF EXISTS category_stats_delete",
+            "DROP TRIGGER IF EXISTS category_stats_update",
+            "DROP TABLE IF EXISTS category_stats",
+        ],
+    ),
+    (
+        6,
+        "Reject item prices that are not finite numbers",
+        [
+            # category_stats sums and compares prices, so a text price (or
+            # Infinity) would corrupt it; the API validates first, these
+            # catch every other writer
+            """
+            CREATE TRIGGER IF NOT EXISTS items_price_insert BEFORE INSERT ON items
+            WHEN typeof(new.price) NOT IN ('integer', 'real') OR abs(new.price) = 9e999 BEGIN
+                SELECT RAISE(ABORT, 'price must be a finite number');
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS items_price_update BEFORE UPDATE OF price ON items
+            WHEN typeof(new.price) NOT IN ('integer', 'real') OR abs(new.price) = 9e999 BEGIN
+                SELECT RAISE(ABORT, 'price must be a finite number');
+            END
+            """,
+        ],
+        [
+            "DROP TRIGGER IF EXISTS items_price_insert",
+            "DROP TRIGGER IF EXISTS items_price_update",
+        ],
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Vocabulary for `migrate seed`
+SEED_DEPARTMENTS = [
+    "Electronics", "Fashion", "Home", "Garden", "Toys", "Sports", "Books", "Beauty",
+    "Automotive", "Grocery", "Office", "Pets", "Music", "Health", "Tools", "Outdoors",
+]
+SEED_ADJECTIVES = [
+    "Compact", "Deluxe", "Classic", "Portable", "Wireless", "Vintage", "Smart", "Heavy-duty",
+    "Lightweight", "Premium", "Eco", "Ergonomic", "Rugged", "Slim", "Modular", "Foldable",
+]
+SEED_MATERIALS = [
+    "Steel", "Cotton", "Oak", "Leather", "Bamboo", "Ceramic", "Glass", "Aluminium",
+    "Wool", "Carbon", "Silicone", "Linen", "Copper", "Walnut", "Nylon", "Marble",
+]
+SEED_PRODUCTS = [
+    "Lamp", "Backpack", "Chair", "Speaker", "Kettle", "Jacket", "Notebook", "Headphones",
+    "Table", "Bottle", "Watch", "Blender", "Tent", "Keyboard", "Sofa", "Camera",
+    "Drill", "Scarf", "Monitor", "Pan", "Bicycle", "Blanket", "Router", "Shelf",
+]
+SEED_PHRASES = [
+    "built to last", "with a two-year warranty", "easy to clean", "ships flat-packed",
+    "ideal for small spaces", "in three colours", "with fast charging", "hand finished",
+    "water resistant", "energy efficient", "for everyday use", "backed by thousands of reviews",
+]
 
 
 class Migration:
@@ -20,7 +300,7 @@ class Migration:
         self.connect()
         try:
             # Read the schema.sql file
-            with open("schema.sql", "r") as schema_file:
+            with open(SCHEMA_FILE, "r") as schema_file:
                 schema_script = schema_file.read()
 
             # Execute the schema script
@@ -30,6 +310,9 @@ class Migration:
             self.insert_dummy_data()
 
             self.conn.commit()
+
+            # Bring the new schema up to the latest version
+            self.apply_migrations(LATEST_VERSION)
             print("Migration up successful")
         except sqlite3.Error as e:
             print(f"Error migrating up: {e}")
@@ -38,6 +321,236 @@ class Migration:
         finally:
             self.close()
 
+    def ensure_version_table(self):
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        """
+        )
+        self.conn.commit()
+
+    def current_version(self):
+        self.ensure_version_table()
+        self.cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return self.cursor.fetchone()[0]
+
+    def migrate_to(self, target):
+        self.connect()
+        try:
+            self.apply_migrations(target)
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Error migrating to version {target}: {e}")
+        finally:
+            self.close()
+
+    def apply_migrations(self, target):
+        if not 0 <= target <= LATEST_VERSION:
+            raise ValueError(f"Version must be between 0 and {LATEST_VERSION}")
+        current = self.current_version()
+        if target == current:
+            print(f"Already at version {current}")
+            return
+
+        # Each step runs in its own transaction, so a failure leaves the
+        # database at the last version that completed
+        if target > current:
+            steps = [m for m in MIGRATIONS if current < m[0] <= target]
+        else:
+            steps = [m for m in reversed(MIGRATIONS) if target < m[0] <= current]
+        for version, description, up, down in steps:
+            upgrading = target > current
+            print(f"{'Applying' if upgrading else 'Reverting'} {version}: {description}")
+            self.cursor.execute("BEGIN")
+            try:
+                for action in up if upgrading else down:
+                    if callable(action):
+                        action(self)
+                    else:
+                        self.cursor.execute(action)
+                if upgrading:
+                    self.cursor.execute(
+                        "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                        (version, description, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+                    )
+                else:
+                    self.cursor.execute("DELETE FROM schema_version WHERE version = ?", (version,))
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        print(f"Now at version {self.current_version()}")
+
+    def seed(self, categories=100, items=100000, users=10, seed=42, batch_size=100000):
+        self.connect()
+        try:
+            self.load_seed_data(categories, items, users, seed, batch_size)
+        except (sqlite3.Error, IOError, ValueError) as e:
+            print(f"Error seeding: {e}")
+        finally:
+            self.close()
+
+    def load_seed_data(self, categories, items, users, seed=42, batch_size=100000):
+        # Bulk-loads generated rows; the same seed always produces the same
+        # data. Indexes, the FTS table and category_stats are dropped first
+        # (by reverting to version 0) and rebuilt in bulk afterwards, which
+        # is much faster than maintaining them row by row.
+        rng = random.Random(seed)
+        with open(SCHEMA_FILE, "r") as schema_file:
+            self.cursor.executescript(schema_file.read())
+        _, pragmas = sqlite_profile("throughput")
+        for pragma in PROFILE_PRAGMAS:
+            self.cursor.execute(f"PRAGMA {pragma} = {pragmas[pragma]}").fetchall()
+        # Lets the index rebuilds sort on several cores
+        self.cursor.execute(f"PRAGMA threads = {min(4, os.cpu_count() or 1)}")
+
+        # Checked before the schema is reverted, so bad input leaves the
+        # database untouched
+        self.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM categories")
+        first_category = self.cursor.fetchone()[0] + 1
+        self.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM users")
+        first_user = self.cursor.fetchone()[0] + 1
+        category_ids = list(range(first_category, first_category + categories))
+        if items and not category_ids:
+            self.cursor.execute("SELECT id FROM categories")
+            category_ids = [row[0] for row in self.cursor.fetchall()]
+            if not category_ids:
+                raise ValueError("Items need at least one category")
+
+        def category_rows():
+            for index in range(first_category, first_category + categories):
+                department = SEED_DEPARTMENTS[index % len(SEED_DEPARTMENTS)]
+                yield (index, f"{department} {index}")
+
+        def user_rows():
+            for index in range(first_user, first_user + users):
+                # Log in as userNNNNNN with password passwordNNNNNN
+                yield (f"user{index:06d}", hash_password(f"password{index:06d}", Config.SECRET_KEY))
+
+        # Strings are built once up front: per-row formatting, not SQLite,
+        # is what limits the load rate
+        names = [
+            f"{adjective} {material} {product}"
+            for adjective in SEED_ADJECTIVES
+            for material in SEED_MATERIALS
+            for product in SEED_PRODUCTS
+        ]
+        phrases = [f", {first}, {second}" for first in SEED_PHRASES for second in SEED_PHRASES if first != second]
+        # Minute-resolution timestamps over the last two years, oldest first
+        now = int(time.time()) // 60 * 60
+        timestamps = [
+            time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - minutes * 60))
+            for minutes in range(2 * 365 * 24 * 60, -1, -1)
+        ]
+
+        def item_rows(count):
+            # A few large categories and a long tail, log-normal prices, and
+            # updated_at never before created_at
+            random_value = rng.random
+            for _ in range(count):
+                name = names[int(random_value() * len(names))]
+                created = int(random_value() * len(timestamps))
+                updated = created + int(random_value() * (len(timestamps) - created))
+                yield (
+                    category_ids[int(len(category_ids) * random_value() ** 2)],
+                    name,
+                    name + phrases[int(random_value() * len(phrases))],
+                    min(round(rng.lognormvariate(3.5, 1.0), 2) + 0.99, 99999.99),
+                    timestamps[created],
+                    timestamps[updated],
+                )
+
+        self.apply_migrations(0)
+        start = time.monotonic()
+        try:
+            self.cursor.executemany("INSERT INTO categories (id, name) VALUES (?, ?)", category_rows())
+            self.cursor.executemany("INSERT INTO users (username, password_hash) VALUES (?, ?)", user_rows())
+            self.conn.commit()
+            loaded = 0
+            while loaded < items:
+                count = min(batch_size, items - loaded)
+                self.cursor.executemany(
+                    "INSERT INTO items (category_id, name, description, price, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    item_rows(count),
+                )
+                self.conn.commit()
+                loaded += count
+                elapsed = time.monotonic() - start
+                print(f"  loaded {loaded}/{items} items ({loaded / elapsed:,.0f} rows/s)")
+        finally:
+            # A failed or interrupted load keeps the batches it committed,
+            # but never leaves search, stats and indexes missing
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            load_seconds = time.monotonic() - start
+            self.apply_migrations(LATEST_VERSION)
+
+        total_seconds = time.monotonic() - start
+        rows = categories + users + items
+        print(
+            f"Seeded {categories} categories, {items} items and {users} users in {total_seconds:.1f}s "
+            f"(load {rows / max(load_seconds, 1e-9):,.0f} rows/s, indexes and stats "
+            f"{total_seconds - load_seconds:.1f}s)"
+        )
+        return rows
+
+    def rebuild_stats(self):
+        self.connect()
+        try:
+            self.cursor.execute("BEGIN")
+            drifted = rebuild_category_stats(self)
+            self.conn.commit()
+            print(f"Rebuilt category_stats ({drifted} categories had drifted)")
+            return drifted
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            print(f"Error rebuilding category_stats: {e}")
+        finally:
+            self.close()
+
+    def status(self):
+        self.connect()
+        try:
+            self.ensure_version_table()
+            self.cursor.execute("SELECT version, applied_at FROM schema_version")
+            applied = dict(self.cursor.fetchall())
+        finally:
+            self.close()
+        current = max(applied, default=0)
+        print(f"Current version: {current} (latest {LATEST_VERSION})")
+        for version, description, _, _ in MIGRATIONS:
+            state = f"applied {applied[version]}" if version in applied else "pending"
+            print(f"  {version:>3}  {description:<40} {state}")
+        return current, applied
+
+    def build_index(self, name, table, columns):
+        # CREATE INDEX is one statement, so report progress from SQLite's
+        # progress handler while it runs
+        self.cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        rows = self.cursor.fetchone()[0]
+        print(f"  Building {name} on {table}({', '.join(columns)}) over {rows} rows")
+        start = time.monotonic()
+        last_report = [start]
+
+        def report():
+            now = time.monotonic()
+            if now - last_report[0] >= 1.0:
+                last_report[0] = now
+                print(f"    ... {now - start:.0f}s")
+            return 0
+
+        self.conn.set_progress_handler(report, 100000)
+        try:
+            self.cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+            )
+        finally:
+            self.conn.set_progress_handler(None, 0)
+        print(f"  Built {name} in {time.monotonic() - start:.2f}s")
+
     def insert_dummy_data(self):
         # Insert dummy categories
         self.cursor.executemany(
@@ -76,9 +589,12 @@ class Migration:
             # Drop all tables
             self.cursor.executescript(
                 """
+                DROP TABLE IF EXISTS items_fts;
+                DROP TABLE IF EXISTS category_stats;
                 DROP TABLE IF EXISTS items;
                 DROP TABLE IF EXISTS categories;
                 DROP TABLE IF EXISTS users;
+                DROP TABLE IF EXISTS schema_version;
             """
             )
 
@@ -96,8 +612,15 @@ if __name__ == "__main__":
 
     migrate_parser = subparsers.add_parser("migrate", help="Migration actions")
     migrate_parser.add_argument(
-        "migration_action", choices=["up", "down"], help="Migration action"
+        "migration_action", choices=["up", "down", "status", "to", "rebuild-stats", "seed"], help="Migration action"
+    )
+    migrate_parser.add_argument(
+        "target", nargs="?", type=int, help="Schema version for 'to' (defaults to latest)"
     )
+    migrate_parser.add_argument("--categories", type=int, default=100, help="Categories to seed")
+    migrate_parser.add_argument("--items", type=int, default=100000, help="Items to seed")
+    migrate_parser.add_argument("--users", type=int, default=10, help="Users to seed")
+    migrate_parser.add_argument("--seed", type=int, default=42, help="Random seed for 'seed'")
 
     test_parser = subparsers.add_parser("test", help="Run unit tests")
     test_parser.add_argument("test_file", help="Test file to run")
@@ -113,6 +636,14 @@ if __name__ == "__main__":
             migration.migrate_up()
         elif args.migration_action == "down":
             migration.migrate_down()
+        elif args.migration_action == "status":
+            migration.status()
+        elif args.migration_action == "to":
+            migration.migrate_to(LATEST_VERSION if args.target is None else args.target)
+        elif args.migration_action == "rebuild-stats":
+            migration.rebuild_stats()
+        elif args.migration_action == "seed":
+            migration.seed(args.categories, args.items, args.users, args.seed)
     elif args.action == "test":
         test_file = args.test_file
         if test_file == "tests/testing.py":
@@ -1,118 +1,559 @@
 import sqlite3
+import json
+import math
+import multiprocessing
+import threading
+import time
 from datetime import datetime
-import hashlib
 from config import Config
+from models.pool import connect, get_pool
+from models.writer import get_writer
+from utils.metrics import timed_query
+from utils.passwords import hash_password, verify_password
+
+
+# Bumped by every write so in-process caches can tell when a table changed;
+# _TABLES maps each table to its slot in _table_versions
+_TABLES = {"categories": 0, "items": 1, "users": 2}
+_table_versions = [0] * len(_TABLES)
+_versions_lock = threading.Lock()
+
+# (db_name, filters) -> (items version, counted at, total)
+_item_counts = {}
+
+ITEM_COLUMNS = ("id", "category_id", "name", "description", "price", "created_at", "updated_at")
+CATEGORY_COLUMNS = ("id", "name")
+# Item columns that follow the category's in iter_category_item_rows()
+CATEGORY_ITEM_COLUMNS = ("id", "name", "description", "price")
+CATEGORY_STATS_COLUMNS = ("id", "name", "item_count", "min_price", "max_price", "avg_price")
+
+# GET /items sort keys -> (column, direction); ties always break on id
+ITEM_SORTS = {
+    "id": ("id", "ASC"),
+    "price": ("price", "ASC"),
+    "-price": ("price", "DESC"),
+    "updated_at": ("updated_at", "ASC"),
+    "-updated_at": ("updated_at", "DESC"),
+    "name": ("name", "ASC"),
+}
+
+
+def table_version(name):
+    return _table_versions[_TABLES[name]]
+
+
+def bump_table_version(*names):
+    with _versions_lock:
+        for name in names:
+            _table_versions[_TABLES[name]] += 1
+
+
+def share_table_versions():
+    # Moves the versions into shared memory, so processes forked after this
+    # (server.py --workers) see each other's writes and retire cached
+    # responses and ETags together
+    global _table_versions, _versions_lock
+    with _versions_lock:
+        shared = multiprocessing.RawArray("q", _table_versions)
+    _table_versions = shared
+    _versions_lock = multiprocessing.Lock()
+
+
+def is_price(value):
+    # json.loads accepts NaN and Infinity, which SQLite stores as NULL
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def validate_item(item, existing_category_ids=None):
+    # existing_category_ids=None leaves the category check to the write,
+    # as create_item() does it in the same transaction
+    if not isinstance(item, dict):
+        return "Item must be an object"
+    missing = [key for key in ("category_id", "name", "price") if key not in item]
+    if missing:
+        return f"Missing required fields: {', '.join(missing)}"
+    if not isinstance(item["name"], str) or not item["name"]:
+        return "name must be a non-empty string"
+    if not is_price(item["price"]):
+        return "price must be a finite number"
+    if not isinstance(item.get("description"), (str, type(None))):
+        return "description must be a string or null"
+    if existing_category_ids is not None and item["category_id"] not in existing_category_ids:
+        return "Category does not exist"
+    return None
+
+
+def validate_item_changes(changes, price_factor=None):
+    # The fields a bulk update may set, checked as validate_item checks a
+    # new item; price_factor must keep prices positive
+    if not isinstance(changes, dict) or set(changes) - {"name", "description", "price"}:
+        return "set may only contain name, description and price"
+    if "name" in changes and (not isinstance(changes["name"], str) or not changes["name"]):
+        return "name must be a non-empty string"
+    if "price" in changes and not is_price(changes["price"]):
+        return "price must be a finite number"
+    if not isinstance(changes.get("description"), (str, type(None))):
+        return "description must be a string or null"
+    if price_factor is not None and not (is_price(price_factor) and price_factor > 0):
+        return "price_factor must be a finite positive number"
+    return None
+
+
+def item_filter_clauses(filters):
+    # Each filter has a matching index (see the migrations), alone or as the
+    # leading column of a composite with the sort column
+    clauses = []
+    params = []
+    filters = filters or {}
+    if filters.get("category_id") is not None:
+        clauses.append("category_id = ?")
+        params.append(filters["category_id"])
+    if filters.get("min_price") is not None:
+        clauses.append("price >= ?")
+        params.append(filters["min_price"])
+    if filters.get("max_price") is not None:
+        clauses.append("price <= ?")
+        params.append(filters["max_price"])
+    if filters.get("updated_since") is not None:
+        clauses.append("updated_at >= ?")
+        params.append(filters["updated_since"])
+    return clauses, params
+
+
+def item_query(filters=None, sort="id", after=None):
+    column, direction = ITEM_SORTS[sort]
+    clauses, params = item_filter_clauses(filters)
+    if after is not None:
+        operator = ">" if direction == "ASC" else "<"
+        if column == "id":
+            clauses.append(f"id {operator} ?")
+            params.append(after[1])
+        else:
+            # Row-value comparison lets SQLite seek the (column, id) index
+            clauses.append(f"({column}, id) {operator} (?, ?)")
+            params.extend(after)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    ranges = range_filter_columns(filters)
+    # With only range filters on other columns SQLite would walk the whole
+    # table (or the sort column's index) in order, testing every row; the
+    # unary + makes it seek the filter's index and sort the matches instead
+    prefix = "+" if after is None and ranges and column not in ranges else ""
+    if column != "id":
+        order = f"{prefix}{column} {direction}, id {direction}"
+    else:
+        order = f"{prefix}id {direction}"
+    return f"SELECT * FROM items{where} ORDER BY {order}", params
+
+
+def range_filter_columns(filters):
+    # Columns that item_filter_clauses() compares with a range; empty when
+    # category_id is set, as its composite indexes already cover every sort
+    filters = filters or {}
+    if filters.get("category_id") is not None:
+        return ()
+    columns = []
+    if filters.get("min_price") is not None or filters.get("max_price") is not None:
+        columns.append("price")
+    if filters.get("updated_since") is not None:
+        columns.append("updated_at")
+    return columns
+
+
+def fts_query(text):
+    # Quote every term so user input can't inject FTS5 syntax; the last term
+    # also matches as a prefix for search-as-you-type
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def item_selector(ids=None, category_id=None):
+    # WHERE clause for the bulk item operations. The ids travel as one JSON
+    # parameter, so the list can be any length without hitting SQLite's
+    # bound-variable limit.
+    clauses = []
+    params = []
+    if ids is not None:
+        clauses.append("id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(list(ids)))
+    if category_id is not None:
+        clauses.append("category_id = ?")
+        params.append(category_id)
+    if not clauses:
+        raise ValueError("Select items by ids or category_id")
+    return " AND ".join(clauses), params
 
 
 class Database:
-    def __init__(self, db_name):
-        self.conn = sqlite3.connect(db_name)
+    def __init__(self, db_name, conn=None, pool=None, group_commit=False):
+        self.db_name = db_name
+        self.pool = pool
+        self.group_commit = group_commit
+        self.conn = conn if conn is not None else connect(db_name)
         self.cursor = self.conn.cursor()
 
+    @classmethod
+    def from_pool(cls, pool=None):
+        pool = pool or get_pool()
+        return cls(pool.db_name, conn=pool.acquire(), pool=pool, group_commit=Config.GROUP_COMMIT)
+
+    def _write(self, operation, *tables):
+        # operation(cursor) performs one logical write. With group commit on
+        # it runs on the shared writer thread and shares a transaction with
+        # concurrent writes; otherwise it commits on this connection.
+        if self.group_commit:
+            result = get_writer(self.db_name).submit(operation)
+        else:
+            try:
+                result = operation(self.cursor)
+                self.conn.commit()
+            except Exception:
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                raise
+        bump_table_version(*tables)
+        return result
+
+    @timed_query
     def get_user(self, username):
         self.cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
         return self.cursor.fetchone()
 
     def check_password(self, hashed_password, password):
-        new_hashed_password = hashlib.sha256(
-            (password + Config.SECRET_KEY).encode()
-        ).hexdigest()
-        return new_hashed_password == hashed_password
-
-    def create_user(self, username, password):
-        hashed_password = hashlib.sha256(
-            (password + Config.SECRET_KEY).encode()
-        ).hexdigest()
-        self.cursor.execute(
-            "INSERT INTO users (username, password_hash) VALUES (?, ?)",
-            (username, hashed_password),
+        return verify_password(hashed_password, password, Config.SECRET_KEY)
+
+    @timed_query
+    def create_user(self, username, password, hashed_password=None):
+        # Pass hashed_password when the hash was computed elsewhere (the
+        # request handlers hash on utils.passwords.hasher)
+        if hashed_password is None:
+            hashed_password = hash_password(password, Config.SECRET_KEY)
+        self._write(
+            lambda cursor: cursor.execute(
+                "INSERT INTO users (username, password_hash) VALUES (?, ?)",
+                (username, hashed_password),
+            ),
+            "users",
         )
-        self.conn.commit()
 
+    @timed_query
     def get_categories(self):
         self.cursor.execute("SELECT * FROM categories")
         return self.cursor.fetchall()
 
     def get_categories_with_items(self):
+        return list(self.iter_categories_with_items())
+
+    def iter_categories_with_items(self, batch_size=None):
+        # Each category is yielded as soon as it is complete, so only one
+        # category is held in memory
+        current = None
+        for row in self.iter_category_item_rows(batch_size):
+            if current is None or current["id"] != row[0]:
+                if current is not None:
+                    yield current
+                current = dict(zip(CATEGORY_COLUMNS, row), items=[])
+            if row[2] is not None:
+                current["items"].append(dict(zip(CATEGORY_ITEM_COLUMNS, row[2:])))
+        if current is not None:
+            yield current
+
+    @timed_query
+    def iter_category_item_rows(self, batch_size=None):
+        # One joined query, fetched in batches: CATEGORY_COLUMNS followed by
+        # CATEGORY_ITEM_COLUMNS, ordered by category. The LEFT JOIN keeps
+        # categories without items (their item columns come back NULL).
+        return self.iter_rows(
+            """
+            SELECT c.id, c.name, i.id, i.name, i.description, i.price
+            FROM categories c
+            LEFT JOIN items i ON i.category_id = c.id
+            ORDER BY c.id, i.id
+        """,
+            batch_size=batch_size,
+        )
+
+    @timed_query
+    def get_category_stats(self):
+        # Reads the trigger-maintained category_stats table: one row per
+        # category, however many items there are. The running sum picks up
+        # float noise, so the average is rounded to cents.
         self.cursor.execute(
             """
-            SELECT c.id, c.name
+            SELECT c.id, c.name, COALESCE(s.item_count, 0), s.min_price, s.max_price,
+                   CASE WHEN s.item_count > 0 THEN ROUND(s.price_sum / s.item_count, 2) END
             FROM categories c
+            LEFT JOIN category_stats s ON s.category_id = c.id
+            ORDER BY c.id
         """
         )
-        categories = self.cursor.fetchall()
-        result = []
-        for category in categories:
-            self.cursor.execute(
-                """
-                SELECT i.id, i.name, i.description, i.price
-                FROM items i
-                WHERE i.category_id = ?
-            """,
-                (category[0],),
-            )
-            items = self.cursor.fetchall()
-            result.append(
-                {
-                    "id": category[0],
-                    "name": category[1],
-                    "items": [
-                        {
-                            "id": item[0],
-                            "name": item[1],
-                            "description": item[2],
-                            "price": item[3],
-                        }
-                        for item in items
-                    ],
-                }
-            )
-        return result
+        return self.cursor.fetchall()
 
+    @timed_query
     def create_category(self, name):
-        self.cursor.execute("INSERT INTO categories (name) VALUES (?)", (name,))
-        self.conn.commit()
-        return self.cursor.lastrowid  # Return the ID of the newly created category
+        def insert(cursor):
+            cursor.execute("INSERT INTO categories (name) VALUES (?)", (name,))
+            return cursor.lastrowid  # Return the ID of the newly created category
 
+        return self._write(insert, "categories")
+
+    @timed_query
     def get_items(self, limit=10, offset=0):
         self.cursor.execute("SELECT * FROM items LIMIT ? OFFSET ?", (limit, offset))
         return self.cursor.fetchall()
 
+    def iter_rows(self, sql, params=(), batch_size=None):
+        cursor = self.conn.cursor()
+        cursor.execute(sql, params)
+        batch_size = batch_size or Config.STREAM_FETCH_SIZE
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+    @timed_query
+    def iter_items(self, limit=10, offset=0, filters=None, sort="id"):
+        sql, params = item_query(filters, sort)
+        return self.iter_rows(f"{sql} LIMIT ? OFFSET ?", params + [limit, offset])
+
+    @timed_query
+    def iter_items_after(self, after, limit=10, filters=None, sort="id"):
+        # Keyset pagination: after is the (sort key, id) of the last row on
+        # the previous page, or None for the first page. Each page seeks the
+        # sort index, so it costs the same no matter how deep it is.
+        sql, params = item_query(filters, sort, after)
+        return self.iter_rows(f"{sql} LIMIT ?", params + [limit])
+
+    @timed_query
     def get_total_items(self):
         self.cursor.execute("SELECT COUNT(*) FROM items")
         return self.cursor.fetchone()[0]
 
+    @timed_query
+    def count_items(self, filters=None):
+        clauses, params = item_filter_clauses(filters)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        self.cursor.execute(f"SELECT COUNT(*) FROM items{where}", params)
+        return self.cursor.fetchone()[0]
+
+    def get_cached_total_items(self, filters=None):
+        # Reused until this process writes to items or ITEM_COUNT_TTL passes
+        # (the TTL covers writers in other processes)
+        key = (self.db_name, tuple(sorted((filters or {}).items())))
+        version = table_version("items")
+        cached = _item_counts.get(key)
+        if (
+            cached is not None
+            and cached[0] == version
+            and time.monotonic() - cached[1] < Config.ITEM_COUNT_TTL
+        ):
+            return cached[2]
+        total = self.count_items(filters)
+        if len(_item_counts) >= 1024:
+            _item_counts.clear()
+        _item_counts[key] = (version, time.monotonic(), total)
+        return total
+
+    @timed_query
+    def search_items(self, query, limit=10, after=None):
+        # Ranked by bm25 (name matches weigh more than description), then id.
+        # after is the (score, id) of the last row on the previous page.
+        score, last_id = after if after is not None else (float("-inf"), 0)
+        self.cursor.execute(
+            """
+            SELECT * FROM (
+                SELECT i.*, bm25(items_fts, 10.0, 1.0) AS score
+                FROM items_fts
+                JOIN items i ON i.id = items_fts.rowid
+                WHERE items_fts MATCH ?
+            )
+            WHERE score > ? OR (score = ? AND id > ?)
+            ORDER BY score, id
+            LIMIT ?
+        """,
+            (fts_query(query), score, score, last_id, limit),
+        )
+        return self.cursor.fetchall()
+
+    @timed_query
     def get_item(self, item_id):
         self.cursor.execute("SELECT * FROM items WHERE id = ?", (item_id,))
         return self.cursor.fetchone()
 
+    @timed_query
     def create_item(self, category_id, name, description, price):
-        if not self.category_exists(category_id):
-            raise ValueError("Category does not exist")
         created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        def insert(cursor):
+            # Checked inside the write so it sees the same snapshot as the insert
+            cursor.execute("SELECT 1 FROM categories WHERE id = ?", (category_id,))
+            if cursor.fetchone() is None:
+                raise ValueError("Category does not exist")
+            cursor.execute(
+                "INSERT INTO items (category_id, name, description, price, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (category_id, name, description, price, created_at, updated_at),
+            )
+            return cursor.lastrowid
+
+        return self._write(insert, "items")
+
+    @timed_query
+    def create_items(self, items):
+        # Bulk version of create_item: one query validates every referenced
+        # category, then the valid rows go in with executemany under a
+        # single commit. Returns one result per input row, in order.
+        category_ids = {
+            item.get("category_id") for item in items if isinstance(item, dict)
+        }
+        existing = self.existing_category_ids(category_ids)
+
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        results = []
+        rows = []
+        for index, item in enumerate(items):
+            error = validate_item(item, existing)
+            if error is not None:
+                results.append({"index": index, "error": error})
+                continue
+            results.append({"index": index})
+            rows.append(
+                (
+                    item["category_id"],
+                    item["name"],
+                    item.get("description"),
+                    item["price"],
+                    now,
+                    now,
+                )
+            )
+
+        if not rows:
+            return results
+        try:
+            self.cursor.executemany(
+                "INSERT INTO items (category_id, name, description, price, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.cursor.execute("SELECT last_insert_rowid()")
+            last_id = self.cursor.fetchone()[0]
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        bump_table_version("items")
+
+        # The transaction held the write lock, so the new rowids are the
+        # contiguous run ending at last_insert_rowid()
+        next_id = last_id - len(rows) + 1
+        for result in results:
+            if "error" not in result:
+                result["id"] = next_id
+                next_id += 1
+        return results
+
+    @timed_query
+    def existing_category_ids(self, category_ids):
+        ids = [
+            category_id
+            for category_id in category_ids
+            if isinstance(category_id, int) and not isinstance(category_id, bool)
+        ]
+        if not ids:
+            return set()
         self.cursor.execute(
-            "INSERT INTO items (category_id, name, description, price, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
-            (category_id, name, description, price, created_at, updated_at),
+            "SELECT id FROM categories WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(ids),),
         )
-        self.conn.commit()
-        return self.cursor.lastrowid
+        return {row[0] for row in self.cursor.fetchall()}
 
+    @timed_query
     def update_item(self, item_id, name, description, price):
         updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._write(
+            lambda cursor: cursor.execute(
+                "UPDATE items SET name = ?, description = ?, price = ?, updated_at =? WHERE id = ?",
+                (name, description, price, updated_at, item_id),
+            ),
+            "items",
+        )
+
+    @timed_query
+    def delete_item(self, item_id):
+        self._write(
+            lambda cursor: cursor.execute("DELETE FROM items WHERE id = ?", (item_id,)),
+            "items",
+        )
+
+    @timed_query
+    def update_items(self, changes, ids=None, category_id=None, price_factor=None):
+        # Set-based bulk update; a single statement is a single transaction.
+        # price_factor reprices relative to the current price (rounded to cents).
+        error = validate_item_changes(changes, price_factor)
+        if error is not None:
+            raise ValueError(error)
+        where, params = item_selector(ids, category_id)
+        assignments = []
+        values = []
+        for column in ("name", "description", "price"):
+            if column in changes:
+                assignments.append(f"{column} = ?")
+                values.append(changes[column])
+        if price_factor is not None:
+            if "price" in changes:
+                raise ValueError("Use either price or price_factor, not both")
+            assignments.append("price = ROUND(price * ?, 2)")
+            values.append(price_factor)
+        if not assignments:
+            raise ValueError("Nothing to update")
+        assignments.append("updated_at = ?")
+        values.append(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
         self.cursor.execute(
-            "UPDATE items SET name = ?, description = ?, price = ?, updated_at =? WHERE id = ?",
-            (name, description, price, updated_at, item_id),
+            f"UPDATE items SET {', '.join(assignments)} WHERE {where}",
+            values + params,
         )
         self.conn.commit()
+        bump_table_version("items")
+        return self.cursor.rowcount
 
-    def delete_item(self, item_id):
-        self.cursor.execute("DELETE FROM items WHERE id = ?", (item_id,))
+    @timed_query
+    def delete_items(self, ids=None, category_id=None):
+        where, params = item_selector(ids, category_id)
+        self.cursor.execute(f"DELETE FROM items WHERE {where}", params)
         self.conn.commit()
+        bump_table_version("items")
+        return self.cursor.rowcount
+
+    def get_pragmas(self, names):
+        result = {}
+        for name in names:
+            self.cursor.execute(f"PRAGMA {name}")
+            row = self.cursor.fetchone()
+            result[name] = row[0] if row else None
+        return result
 
     def close(self):
-        self.conn.close()
+        self.cursor.close()
+        if self.pool is not None:
+            # Pooled connections go back to the pool instead of being closed
+            self.pool.release(self.conn)
+            self.pool = None
+        else:
+            self.conn.close()
+
+    def __del__(self):
+        # A handler that raised before close() must not leak its pool slot
+        if getattr(self, "pool", None) is not None:
+            self.pool.release(self.conn)
+            self.pool = None
 
+    @timed_query
     def category_exists(self, category_id):
         self.cursor.execute("SELECT * FROM categories WHERE id = ?", (category_id,))
         return self.cursor.fetchone() is not None
@@ -0,0 +1,190 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from config import Config
+from models.querylog import TimedConnection
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+# Applied in this order; journal_mode goes first so the rest see WAL
+PROFILE_PRAGMAS = ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout")
+
+
+def sqlite_profile(name=None):
+    name = name or Config.SQLITE_PROFILE
+    try:
+        return name, Config.SQLITE_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown SQLite profile: {name}")
+
+
+def connect(db_name, profile=None):
+    # Pooled connections are handed between worker threads, so the
+    # same-thread check has to be off; the pool guarantees one user at a time.
+    conn = sqlite3.connect(db_name, check_same_thread=False, factory=TimedConnection)
+    _, pragmas = sqlite_profile(profile)
+    for pragma in PROFILE_PRAGMAS:
+        if pragma in pragmas:
+            conn.execute(f"PRAGMA {pragma} = {pragmas[pragma]}").fetchall()
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, db_name, max_size=8, timeout=5.0, health_check_interval=30.0):
+        self.db_name = db_name
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = deque()
+        self._size = 0
+        self._cond = threading.Condition()
+        self.stats = {
+            "hits": 0,
+            "waits": 0,
+            "opens": 0,
+            "timeouts": 0,
+            "discarded": 0,
+        }
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            waited = False
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    self.stats["hits"] += 1
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    self.stats["opens"] += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats["timeouts"] += 1
+                    raise PoolTimeoutError(
+                        f"Timed out after {self.timeout}s waiting for a database connection"
+                    )
+                if not waited:
+                    self.stats["waits"] += 1
+                    waited = True
+                self._cond.wait(remaining)
+
+        if conn is None:
+            return self._open()
+        if time.monotonic() - last_used >= self.health_check_interval and not self._healthy(conn):
+            # Replace the dead connection in its slot so the pool size holds.
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            with self._cond:
+                self.stats["discarded"] += 1
+                self.stats["opens"] += 1
+            return self._open()
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                self._discard(conn)
+                return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                conn.close()
+                self._size -= 1
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return dict(
+                self.stats,
+                size=self._size,
+                idle=len(self._idle),
+                max_size=self.max_size,
+            )
+
+    def _open(self):
+        try:
+            return connect(self.db_name)
+        except sqlite3.Error:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self.stats["discarded"] += 1
+            self._cond.notify()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None or _pool.db_name != Config.DATABASE:
+        with _pool_lock:
+            if _pool is None or _pool.db_name != Config.DATABASE:
+                if _pool is not None:
+                    _pool.close()
+                _pool = ConnectionPool(
+                    Config.DATABASE,
+                    max_size=Config.POOL_MAX_SIZE,
+                    timeout=Config.POOL_TIMEOUT,
+                    health_check_interval=Config.POOL_HEALTH_CHECK_INTERVAL,
+                )
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+# Connections opened before a fork belong to the parent: closing one in the
+# child could checkpoint and remove the WAL under the parent's feet, so the
+# child only drops them (kept referenced, never closed) and opens its own
+_inherited = []
+
+
+def _forget_pool_after_fork():
+    global _pool, _pool_lock
+    if _pool is not None:
+        _inherited.append(_pool)
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_pool_after_fork)
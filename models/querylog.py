@@ -0,0 +1,153 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+from config import Config
+
+
+def params_shape(params):
+    # Types (and lengths of strings and blobs) only: values can be
+    # passwords, tokens or customer data and must not reach the log
+    def shape(value):
+        if isinstance(value, (str, bytes)):
+            return f"{type(value).__name__}[{len(value)}]"
+        return type(value).__name__
+
+    if isinstance(params, dict):
+        return {name: shape(value) for name, value in params.items()}
+    return [shape(value) for value in params]
+
+
+def _many_shape(seq_of_parameters):
+    if hasattr(seq_of_parameters, "__len__"):
+        return f"{len(seq_of_parameters)} rows"
+    return "iterator"
+
+
+class SlowQueryLog:
+    # Statements slower than threshold seconds are appended to path as JSON
+    # lines and kept in memory for GET /diagnostics. threshold=None disables.
+    def __init__(self, threshold=0.1, path=None, keep=50):
+        self.threshold = threshold
+        self.path = path
+        self.recent = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self.logged = 0
+
+    def record(self, conn, sql, params, seconds, many=False):
+        entry = {
+            "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "seconds": round(seconds, 6),
+            "sql": " ".join(sql.split()),
+            "params": _many_shape(params) if many else params_shape(params),
+            "plan": None if many else explain(conn, sql, params),
+        }
+        with self._lock:
+            self.logged += 1
+            self.recent.append(entry)
+            if self.path:
+                with open(self.path, "a") as log_file:
+                    log_file.write(json.dumps(entry) + "\n")
+
+    def snapshot(self):
+        with self._lock:
+            return {"threshold": self.threshold, "logged": self.logged, "recent": list(self.recent)}
+
+
+def explain(conn, sql, params):
+    statement = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+    if statement not in ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE"):
+        return None
+    try:
+        # A plain cursor, so explaining is never itself timed or logged
+        cursor = sqlite3.Cursor(conn)
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[3] for row in cursor.fetchall()]
+    except sqlite3.Error:
+        return None
+
+
+class TimedCursor(sqlite3.Cursor):
+    # Times each statement from execute() until its rows are exhausted, the
+    # cursor runs another statement or is closed, so the time SQLite spends
+    # stepping through results in fetch*() counts too.
+    _statement = None
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._statement = [sql, parameters, time.perf_counter() - start, False]
+            if self.description is None:
+                # Writes and DDL are complete once execute() returns
+                self._finish()
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._statement = [sql, seq_of_parameters, time.perf_counter() - start, True]
+            self._finish()
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed(super().fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def _timed(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            if self._statement is not None:
+                self._statement[2] += time.perf_counter() - start
+
+    def _finish(self):
+        statement, self._statement = self._statement, None
+        if statement is None:
+            return
+        sql, params, seconds, many = statement
+        threshold = slow_query_log.threshold
+        if threshold is not None and seconds >= threshold:
+            slow_query_log.record(self.connection, sql, params, seconds, many)
+
+
+class TimedConnection(sqlite3.Connection):
+    # Connection.execute() builds a plain cursor internally, so the
+    # shortcuts are routed through TimedCursor as well
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+slow_query_log = SlowQueryLog(
+    threshold=Config.SLOW_QUERY_THRESHOLD,
+    path=Config.SLOW_QUERY_LOG,
+)
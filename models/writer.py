@@ -0,0 +1,169 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from config import Config
+from models.pool import connect
+
+# Upper bounds of the batch-size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    # Single writer thread that owns one connection. Operations submitted
+    # within `window` seconds of each other (up to max_batch of them) share
+    # one transaction and one commit; every caller is answered after that
+    # commit. Each operation runs in its own SAVEPOINT, so one failing
+    # operation is rolled back and reported without sinking the batch.
+    def __init__(self, db_name, window=0.002, max_batch=64):
+        self.db_name = db_name
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._conn = connect(db_name)
+        # Transactions are managed explicitly below
+        self._conn.isolation_level = None
+        self._lock = threading.Lock()
+        self.stats = {
+            "batches": 0,
+            "operations": 0,
+            "failed": 0,
+            "commit_errors": 0,
+            "max_batch": 0,
+        }
+        self._histogram = dict.fromkeys(BATCH_SIZE_BUCKETS, 0)
+        self._histogram["inf"] = 0
+        self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, operation):
+        # operation(cursor) runs on the writer thread; its return value (or
+        # exception) is handed back here once the batch has committed
+        future = Future()
+        self._queue.put((operation, future))
+        return future.result()
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._conn.close()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(
+                self.stats,
+                window=self.window,
+                max_batch_size=self.max_batch,
+                batch_sizes=dict(self._histogram),
+            )
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stopping = True
+                    break
+                batch.append(entry)
+            self._commit(batch)
+
+    def _commit(self, batch):
+        cursor = self._conn.cursor()
+        outcomes = []
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for operation, future in batch:
+                cursor.execute("SAVEPOINT operation")
+                try:
+                    outcomes.append((future, operation(cursor), None))
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO operation")
+                    outcomes.append((future, None, e))
+                cursor.execute("RELEASE operation")
+            cursor.execute("COMMIT")
+        except Exception as e:
+            if self._conn.in_transaction:
+                self._conn.rollback()
+            with self._lock:
+                self.stats["commit_errors"] += 1
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        failed = sum(1 for _, _, error in outcomes if error is not None)
+        self._record(len(batch), failed)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _record(self, size, failed):
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["operations"] += size
+            self.stats["failed"] += failed
+            self.stats["max_batch"] = max(self.stats["max_batch"], size)
+            for bound in BATCH_SIZE_BUCKETS:
+                if size <= bound:
+                    self._histogram[bound] += 1
+                    break
+            else:
+                self._histogram["inf"] += 1
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(db_name):
+    with _writers_lock:
+        writer = _writers.get(db_name)
+        if writer is None:
+            writer = _writers[db_name] = GroupCommitWriter(
+                db_name,
+                window=Config.GROUP_COMMIT_WINDOW,
+                max_batch=Config.GROUP_COMMIT_MAX_BATCH,
+            )
+        return writer
+
+
+def writer_snapshots():
+    with _writers_lock:
+        return {db_name: writer.snapshot() for db_name, writer in _writers.items()}
+
+
+def close_writers():
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+_inherited = []
+
+
+def _forget_writers_after_fork():
+    # The writer threads did not survive the fork; their connections stay
+    # with the parent (see models.pool), so they are dropped unclosed
+    global _writers_lock
+    _inherited.extend(_writers.values())
+    _writers.clear()
+    _writers_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_writers_after_fork)
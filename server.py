@@ -1,76 +1,401 @@
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import urlparse
-from models.models import Database
-from utils.utils import parse_json_body
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from models.models import Database, share_table_versions
+from models.pool import PoolTimeoutError, close_pool
+from models.writer import close_writers
+from utils.utils import parse_json_body, send_json_response
+from utils.router import Router, RouteError
+from utils.metrics import metrics
+from utils.profiler import profiler
+from utils.passwords import hasher
 from config import Config
 from handlers.handlers import (
     handle_get_all_categories,
     handle_get_categories,
+    handle_get_category_stats,
     handle_get_items,
     handle_get_item,
+    handle_search_items,
+    handle_get_diagnostics,
+    handle_get_metrics,
     handle_create_category,
     handle_login,
     handle_create_item,
+    handle_create_items_batch,
     handle_register,
     handle_update_item,
+    handle_update_items,
     handle_delete_item,
+    handle_delete_items,
 )
 
+def pool_guard(method):
+    @wraps(method)
+    def wrapper(self):
+        try:
+            return method(self)
+        except PoolTimeoutError:
+            return send_json_response(self, 503, {"message": "Service busy, try again"})
+
+    return wrapper
+
+
+router = Router()
+router.add("GET", "/categories", handle_get_all_categories)
+router.add("GET", "/categories/names", handle_get_categories)
+router.add("GET", "/categories/stats", handle_get_category_stats)
+router.add("GET", "/items", handle_get_items)
+router.add("GET", "/items/search", handle_search_items)
+router.add("GET", "/items/<int:item_id>", handle_get_item)
+router.add("GET", "/diagnostics", handle_get_diagnostics)
+router.add("GET", "/metrics", handle_get_metrics)
+router.add("POST", "/categories", handle_create_category, body="required")
+router.add("POST", "/login", handle_login, body="required")
+router.add("POST", "/register", handle_register, body="required")
+router.add("POST", "/items", handle_create_item, body="required")
+router.add("POST", "/items/batch", handle_create_items_batch, body="required")
+router.add("PATCH", "/items", handle_update_items, body="required")
+router.add("DELETE", "/items", handle_delete_items, body="optional")
+router.add("PUT", "/items/<int:item_id>", handle_update_item, body="required")
+router.add("DELETE", "/items/<int:item_id>", handle_delete_item)
+
+
 class RequestHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        url = urlparse(self.path)
-        if url.path == "/categories":
-            handle_get_all_categories(self)
-        elif url.path == ("/categories/names"):
-            handle_get_categories(self)
-        elif url.path == ("/items"):
-            handle_get_items(self)
-        elif url.path.startswith("/items/"):
-            item_id = int(url.path.split("/")[-1])
-            handle_get_item(self, item_id)
-        else:
-            self.send_error(404, "Not Found")
-
-    def do_POST(self):
-        url = urlparse(self.path)
-        data = parse_json_body(self)
-
-        if url.path == "/categories":
-            handle_create_category(self, data)
-        elif url.path == "/login":
-            handle_login(self, data)
-        elif url.path == "/items":
-            handle_create_item(self, data)
-        elif url.path == "/register":
-            handle_register(self, data)
+    # Persistent connections: every response carries Content-Length or is
+    # chunked. timeout is applied to the socket, so a connection idle for
+    # that long between requests is closed.
+    protocol_version = "HTTP/1.1"
+    timeout = Config.KEEPALIVE_TIMEOUT
+    # Headers and body go out as separate writes; with Nagle on, the body
+    # of each reused-connection response waits on the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.requests_handled = 0
+
+    def parse_request(self):
+        # Reset before the "100 Continue" that parse_request may send
+        self.response_started = False
+        self.connection_header_sent = False
+        return super().parse_request()
+
+    def dispatch(self):
+        start = time.perf_counter()
+        self.status_code = None
+        self.response_bytes = 0
+        self.route = None
+        self.body_read = False
+        self.requests_handled += 1
+        if self.requests_handled >= Config.KEEPALIVE_MAX_REQUESTS:
+            self.close_connection = True
+        profile = profiler.start(self)
+        try:
+            self.route_request()
+        except Exception:
+            # Answer instead of leaving a keep-alive client waiting, then let
+            # the server log the traceback and drop the connection
+            self.close_connection = True
+            if not self.response_started:
+                send_json_response(self, 500, {"message": "Internal server error"})
+            raise
+        finally:
+            self.drain_request_body()
+            elapsed = time.perf_counter() - start
+            # Unmatched paths share one label so scanners can't blow up the
+            # number of series
+            route = self.route.pattern if self.route is not None else "unmatched"
+            metrics.observe_request(self.command, route, str(self.status_code), elapsed, self.response_bytes)
+            if profile is not None:
+                profiler.finish(profile, self.command, route, elapsed)
+
+    @pool_guard
+    def route_request(self):
+        self.url = urlparse(self.path)
+        try:
+            route, params = router.match(self.command, self.url.path)
+        except RouteError as e:
+            headers = {"Allow": ", ".join(e.allow)} if e.allow else None
+            return send_json_response(self, e.status, {"message": e.message}, headers)
+
+        self.route = route
+        if route.body is None:
+            return route.handler(self, *params)
+        if route.body == "optional" and not self.headers["Content-Length"]:
+            data = {}
         else:
-            self.send_error(404, "Not Found")
+            try:
+                data = parse_json_body(self)
+            except (TypeError, ValueError):
+                return send_json_response(self, 400, {"message": "Invalid JSON body"})
+        return route.handler(self, *params, data)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = dispatch
+
+    def drain_request_body(self):
+        # A body the handler never read would be parsed as the next request
+        if self.body_read or self.close_connection:
+            return
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            self.close_connection = True
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0 or length > Config.KEEPALIVE_DRAIN_LIMIT:
+            self.close_connection = True
+        elif length:
+            self.rfile.read(length)
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        self.response_started = True
+        super().send_response(code, message)
+
+    def end_headers(self):
+        # Only for final responses (send_response), not "100 Continue"
+        if self.response_started and not self.connection_header_sent:
+            self.connection_header_sent = True
+            if self.close_connection:
+                self.send_header("Connection", "close")
+            elif self.request_version == "HTTP/1.1":
+                remaining = Config.KEEPALIVE_MAX_REQUESTS - self.requests_handled
+                self.send_header("Keep-Alive", f"timeout={self.timeout:g}, max={remaining}")
+        super().end_headers()
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == "connection":
+            self.connection_header_sent = True
+        super().send_header(keyword, value)
+
+
+class SerialRequestHandler(RequestHandler):
+    # The serial server handles one connection at a time, so a kept-alive
+    # client would lock everyone else out until it went idle
+    protocol_version = "HTTP/1.0"
 
-    def do_PUT(self):
-        url = urlparse(self.path)
-        data = parse_json_body(self)
 
-        if url.path.startswith("/items/"):
-            item_id = int(url.path.split("/")[-1])
-            handle_update_item(self, item_id, data)
+class WorkerPoolHTTPServer(HTTPServer):
+    def __init__(self, server_address, handler_class, workers=8, backlog=128):
+        # request_queue_size is the listen() backlog, so it must be set
+        # before HTTPServer.__init__ activates the socket
+        self.request_queue_size = backlog
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="http-worker"
+        )
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+        super().__init__(server_address, handler_class)
 
+    def process_request(self, request, client_address):
+        # Block the accept loop while every worker is busy, so extra
+        # connections wait in the kernel backlog instead of piling up here
+        self._slots.acquire()
+        try:
+            self._executor.submit(self._process_request_worker, request, client_address)
+        except RuntimeError:
+            self._slots.release()
+            self.shutdown_request(request)
 
-    def do_DELETE(self):
-        url = urlparse(self.path)
+    def _process_request_worker(self, request, client_address):
+        with self._connections_lock:
+            self._connections.add(request)
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self._connections_lock:
+                self._connections.discard(request)
+            self.shutdown_request(request)
+            self._slots.release()
 
-        if url.path.startswith("/items/"):
-            item_id = int(url.path.split("/")[-1])
-            handle_delete_item(self, item_id)
+    def server_close(self):
+        super().server_close()
+        # Kept-alive connections waiting for their next request see EOF and
+        # close; a request already being handled can still send its response
+        with self._connections_lock:
+            for request in self._connections:
+                try:
+                    request.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+        # Drain: wait for in-flight requests to finish before returning
+        self._executor.shutdown(wait=True)
 
 
-def run_server():
-    server_address = ("", 8000)
-    httpd = HTTPServer(server_address, RequestHandler)
-    print("Server running on port 8000...")
-    httpd.serve_forever()
+def make_server(port=8000, threads=None, backlog=None):
+    threads = Config.SERVER_THREADS if threads is None else threads
+    backlog = Config.SERVER_BACKLOG if backlog is None else backlog
+    server_address = ("", port)
+    if threads <= 0:
+        return HTTPServer(server_address, SerialRequestHandler)
+    return WorkerPoolHTTPServer(
+        server_address, RequestHandler, workers=threads, backlog=backlog
+    )
+
+
+# Both ask for a graceful shutdown: stop accepting, finish in-flight requests
+SHUTDOWN_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+def handle_shutdown_signals(httpd):
+    def request_shutdown(signum, frame):
+        # shutdown() blocks until serve_forever exits, so it cannot run
+        # on the thread that is inside serve_forever
+        threading.Thread(target=httpd.shutdown).start()
+
+    for signum in SHUTDOWN_SIGNALS:
+        signal.signal(signum, request_shutdown)
+
+
+def serve(httpd):
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        close_writers()
+        hasher.shutdown()
+
+
+class PreforkSupervisor:
+    # Forks `workers` processes that all accept from httpd's socket, bound
+    # once here, and run its handler with their own threads, connection
+    # pool and caches. A worker that exits is replaced; SIGTERM or SIGINT
+    # is passed on to every worker, and run() returns once they have all
+    # drained and exited.
+    def __init__(self, httpd, workers, restart_delay=1.0):
+        self.httpd = httpd
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self.children = {}  # pid -> monotonic start time
+        self.stopping = False
+
+    def run(self, on_ready=None):
+        # Every worker wakes for each new connection and one wins accept();
+        # the others get EAGAIN and go back to waiting instead of blocking
+        self.httpd.socket.setblocking(False)
+        share_table_versions()
+        # Nothing that holds a SQLite connection may cross the fork
+        close_pool()
+        close_writers()
+        for signum in SHUTDOWN_SIGNALS:
+            signal.signal(signum, self._stop)
+        try:
+            for _ in range(self.workers):
+                self._spawn()
+            if on_ready is not None:
+                on_ready(self.httpd.server_port)
+            while self.children:
+                pid, status = os.wait()
+                started = self.children.pop(pid, None)
+                if started is None or self.stopping:
+                    continue
+                print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, starting another")
+                if time.monotonic() - started < self.restart_delay:
+                    # Crashing on startup; don't spin
+                    time.sleep(self.restart_delay)
+                if not self.stopping:
+                    self._spawn()
+        finally:
+            self._stop(signal.SIGTERM, None)
+            self.httpd.server_close()
+
+    def _spawn(self):
+        # Signals stay blocked until the child has installed its own
+        # handlers, so it never runs the supervisor's
+        signal.pthread_sigmask(signal.SIG_BLOCK, SHUTDOWN_SIGNALS)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                self._run_worker()
+            self.children[pid] = time.monotonic()
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, SHUTDOWN_SIGNALS)
+
+    def _run_worker(self):
+        # Runs in the child and never returns into the supervisor's code
+        status = 1
+        try:
+            handle_shutdown_signals(self.httpd)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, SHUTDOWN_SIGNALS)
+            serve(self.httpd)
+            status = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+
+def run_server(port=8000, threads=None, backlog=None, on_ready=None, workers=None):
+    # on_ready(port) is called once the socket is listening (and, with
+    # workers > 1, the workers are forked); port=0 binds an ephemeral port
+    workers = Config.SERVER_WORKERS if workers is None else workers
+    httpd = make_server(port, threads, backlog)
+
+    mode = f"{httpd.workers} worker threads" if isinstance(httpd, WorkerPoolHTTPServer) else "serial"
+    if workers > 1:
+        print(f"Server running on port {httpd.server_port} ({workers} worker processes, {mode} each)...")
+        supervisor = PreforkSupervisor(httpd, workers, Config.WORKER_RESTART_DELAY)
+        try:
+            supervisor.run(on_ready)
+        finally:
+            print("Server stopped")
+        return
+
+    handle_shutdown_signals(httpd)
+    print(f"Server running on port {httpd.server_port} ({mode})...")
+    if on_ready is not None:
+        on_ready(httpd.server_port)
+    try:
+        serve(httpd)
+    finally:
+        print("Server stopped")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inventory API server")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=Config.SERVER_THREADS,
+        help="Worker threads (0 runs the serial single-threaded server)",
+    )
+    parser.add_argument(
+        "--backlog", type=int, default=Config.SERVER_BACKLOG, help="Accept backlog"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=Config.SERVER_WORKERS,
+        help="Worker processes sharing the port (1 serves from this process)",
+    )
+    args = parser.parse_args()
+
     db = Database(Config.DATABASE)
     db.close()
-    run_server()
+    run_server(args.port, args.threads, args.backlog, workers=args.workers)
@@ -1,11 +1,33 @@
 import unittest
-from models.models import Database
-from server import RequestHandler
+from models.models import Database, ITEM_SORTS, item_query
+from models.pool import ConnectionPool, PoolTimeoutError, close_pool, connect
+import os
+import sqlite3
+import tempfile
+from server import RequestHandler, WorkerPoolHTTPServer
 import requests
 from config import Config
-from http.server import ThreadingHTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import gzip
+import http.client
+import io
+import json
+import multiprocessing
+import signal
 import threading
+import time
 import utils.utils as utils
+from migration import Migration, LATEST_VERSION
+from contextlib import redirect_stderr, redirect_stdout
+from utils.cache import ResponseCache, etag_matches, response_cache
+from utils.passwords import PasswordHasher, HasherBusyError
+from utils.router import Router, RouteError
+from utils.metrics import Histogram, Metrics, metrics, timed_query
+from utils.profiler import RequestProfiler
+from utils.serializer import RowEncoder, row_encoder, iter_grouped_array
+from models.querylog import slow_query_log
+from models.writer import GroupCommitWriter, close_writers, writer_snapshots
+from benchmarks.loadtest import compare
 
 
 class TestDatabase(unittest.TestCase):
@@ -62,6 +84,43 @@ class TestDatabase(unittest.TestCase):
 
         self.assertEqual(len(categories), len(init_categories) + 1)
 
+    def test_get_categories_with_items(self):
+        self.db.create_category("Electronics")
+        self.db.create_category("Empty")
+        self.db.create_item(1, "Laptop", "A powerful laptop", 1000)
+        self.db.create_item(1, "Phone", None, 500)
+        self.assertEqual(
+            self.db.get_categories_with_items(),
+            [
+                {
+                    "id": 1,
+                    "name": "Electronics",
+                    "items": [
+                        {"id": 1, "name": "Laptop", "description": "A powerful laptop", "price": 1000},
+                        {"id": 2, "name": "Phone", "description": None, "price": 500},
+                    ],
+                },
+                {"id": 2, "name": "Empty", "items": []},
+            ],
+        )
+
+    def test_get_categories_with_items_query_count(self):
+        statements = []
+        self.db.conn.set_trace_callback(statements.append)
+
+        def count_queries():
+            statements.clear()
+            self.db.get_categories_with_items()
+            return len(statements)
+
+        for index in range(5):
+            self.db.create_category(f"category-{index}")
+            self.db.create_item(index + 1, "item", None, 1)
+        small = count_queries()
+        for index in range(5, 200):
+            self.db.create_category(f"category-{index}")
+        self.assertEqual(count_queries(), small)
+
     def test_create_and_get_items(self):
         self.db.create_category("Electronics")
         self.db.create_item(1, "Laptop", "A powerful laptop", 1000)
@@ -71,6 +130,22 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(items[0][3], "A powerful laptop")
         self.assertEqual(items[0][4], 1000)
 
+    def test_iter_items_after(self):
+        self.db.create_category("Electronics")
+        for index in range(5):
+            self.db.create_item(1, f"item-{index}", None, index)
+        page = list(self.db.iter_items_after((None, 2), limit=2))
+        self.assertEqual([item[0] for item in page], [3, 4])
+        self.assertEqual(list(self.db.iter_items_after((None, 5))), [])
+        self.assertEqual([item[0] for item in self.db.iter_items_after(None, limit=2)], [1, 2])
+
+    def test_cached_total_items_tracks_writes(self):
+        self.db.create_category("Electronics")
+        self.db.create_item(1, "Laptop", None, 1)
+        self.assertEqual(self.db.get_cached_total_items(), 1)
+        self.db.create_item(1, "Phone", None, 1)
+        self.assertEqual(self.db.get_cached_total_items(), 2)
+
     def test_get_item(self):
         self.db.create_category("Electronics")
         self.db.create_item(1, "Laptop", "A powerful laptop", 999.99)
@@ -78,6 +153,40 @@ class TestDatabase(unittest.TestCase):
         self.assertIsNotNone(item)
         self.assertEqual(item[2], "Laptop")
 
+    def test_create_items(self):
+        self.db.create_category("Electronics")
+        results = self.db.create_items(
+            [
+                {"category_id": 1, "name": "Laptop", "price": 999.99},
+                {"category_id": 2, "name": "Orphan", "price": 1},
+                {"category_id": 1, "name": "Phone", "description": "Smart", "price": 599},
+                {"category_id": 1, "price": 5},
+            ]
+        )
+        self.assertEqual([result.get("id") for result in results], [1, None, 2, None])
+        self.assertEqual(results[1]["error"], "Category does not exist")
+        self.assertIn("name", results[3]["error"])
+        self.assertEqual(self.db.get_item(2)[2:5], ("Phone", "Smart", 599))
+        self.assertEqual(len(self.db.get_items()), 2)
+
+    def test_create_items_rejects_unbindable_rows(self):
+        # Rows SQLite would refuse get their own error instead of failing
+        # the whole batch
+        self.db.create_category("Electronics")
+        results = self.db.create_items(
+            [
+                {"category_id": 1, "name": "Cable", "description": ["x"], "price": 5},
+                {"category_id": 1, "name": "Charger", "price": float("nan")},
+                {"category_id": 1, "name": "Battery", "price": float("inf")},
+                {"category_id": 1, "name": "Mouse", "price": 25},
+            ]
+        )
+        self.assertIn("description", results[0]["error"])
+        self.assertIn("finite", results[1]["error"])
+        self.assertIn("finite", results[2]["error"])
+        self.assertEqual(results[3], {"index": 3, "id": 1})
+        self.assertEqual([item[2] for item in self.db.get_items()], ["Mouse"])
+
     def test_update_item(self):
         self.db.create_category("Electronics")
         self.db.create_item(1, "Laptop", "A powerful laptop", 999.99)
@@ -89,6 +198,41 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(updated_item[3], "An even more powerful laptop")
         self.assertEqual(updated_item[4], 1099.99)
 
+    def test_update_items(self):
+        self.db.create_category("Electronics")
+        self.db.create_category("Fashion")
+        self.db.create_items(
+            [
+                {"category_id": 1, "name": "Laptop", "price": 1000},
+                {"category_id": 1, "name": "Phone", "price": 500},
+                {"category_id": 2, "name": "Shirt", "price": 20},
+            ]
+        )
+        self.assertEqual(self.db.update_items({}, category_id=1, price_factor=1.1), 2)
+        self.assertEqual([item[4] for item in self.db.get_items()], [1100.0, 550.0, 20])
+        self.assertEqual(self.db.update_items({"description": "Sale"}, ids=[1, 3, 99]), 2)
+        self.assertEqual(self.db.get_item(3)[3], "Sale")
+        with self.assertRaises(ValueError):
+            self.db.update_items({"price": 1})
+        with self.assertRaises(ValueError):
+            self.db.update_items({"price": "abc"}, ids=[1])
+        with self.assertRaises(ValueError):
+            self.db.update_items({}, category_id=1, price_factor=float("inf"))
+
+    def test_delete_items(self):
+        self.db.create_category("Electronics")
+        self.db.create_category("Fashion")
+        self.db.create_items(
+            [
+                {"category_id": 1, "name": "Laptop", "price": 1000},
+                {"category_id": 2, "name": "Shirt", "price": 20},
+                {"category_id": 2, "name": "Jeans", "price": 40},
+            ]
+        )
+        self.assertEqual(self.db.delete_items(category_id=2), 2)
+        self.assertEqual(self.db.delete_items(ids=[1]), 1)
+        self.assertEqual(self.db.get_items(), [])
+
     def test_delete_item(self):
         self.db.create_category("Electronics")
         self.db.create_item(1, "Laptop", "A powerful laptop", 999.99)
@@ -97,10 +241,1061 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(len(items), 0)
 
 
-class TestRequestHandler(unittest.TestCase):
+class TestConnectionPool(unittest.TestCase):
 
     def setUp(self):
+        self.pool = ConnectionPool(":memory:", max_size=2, timeout=0.05)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_reuses_connections(self):
+        db = Database.from_pool(self.pool)
+        conn = db.conn
+        db.close()
+        db = Database.from_pool(self.pool)
+        self.assertIs(db.conn, conn)
+        db.close()
+        stats = self.pool.snapshot()
+        self.assertEqual(stats["opens"], 1)
+        self.assertEqual(stats["hits"], 1)
+
+    def test_checkout_timeout(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        with self.assertRaises(PoolTimeoutError):
+            self.pool.acquire()
+        self.assertEqual(self.pool.snapshot()["waits"], 1)
+        self.assertEqual(self.pool.snapshot()["timeouts"], 1)
+        self.pool.release(first)
+        self.pool.release(second)
+
+    def test_unhealthy_connection_is_replaced(self):
+        self.pool.health_check_interval = 0
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        conn.close()
+        replacement = self.pool.acquire()
+        self.assertIsNot(replacement, conn)
+        self.assertEqual(self.pool.snapshot()["discarded"], 1)
+        self.pool.release(replacement)
+
+
+class StubHandler:
+    def __init__(self, request_version="HTTP/1.1", protocol_version="HTTP/1.1"):
+        self.request_version = request_version
+        self.protocol_version = protocol_version
+        self.headers = {}
+        self.sent_headers = {}
+        self.status = None
+        self.close_connection = False
+        self.wfile = io.BytesIO()
+
+    def send_response(self, code):
+        self.status = code
+
+    def send_header(self, name, value):
+        self.sent_headers[name] = value
+
+    def end_headers(self):
+        pass
+
+
+class TestStreaming(unittest.TestCase):
+
+    def test_send_json_stream_chunked(self):
+        handler = StubHandler()
+        utils.send_json_stream(handler, 200, iter([b"[1", b", 2]"]))
+        self.assertEqual(handler.sent_headers["Transfer-Encoding"], "chunked")
+        self.assertEqual(handler.wfile.getvalue(), b"6\r\n[1, 2]\r\n0\r\n\r\n")
+
+    def test_send_json_stream_http10(self):
+        handler = StubHandler(request_version="HTTP/1.0")
+        utils.send_json_stream(handler, 200, iter([b"[1", b", 2]"]))
+        self.assertNotIn("Transfer-Encoding", handler.sent_headers)
+        self.assertTrue(handler.close_connection)
+        self.assertEqual(handler.wfile.getvalue(), b"[1, 2]")
+
+    def test_iter_categories_with_items_batches(self):
+        db = Database(":memory:")
+        with open("schema.sql") as schema_file:
+            db.cursor.executescript(schema_file.read())
+        db.create_category("Electronics")
+        db.create_category("Empty")
+        for index in range(5):
+            db.create_item(1, f"item-{index}", None, index)
+        self.assertEqual(list(db.iter_categories_with_items(batch_size=2)), db.get_categories_with_items())
+        self.assertEqual(len(db.get_categories_with_items()[0]["items"]), 5)
+        db.close()
+
+
+class TestSerializer(unittest.TestCase):
+
+    def test_matches_json_dumps(self):
+        encoder = RowEncoder(("id", "name", "price", "flag", "note", 'k"%s\u00e9'))
+        rows = [
+            (1, "Laptop", 999.99, True, None, "x"),
+            (2 ** 70, 'quote " \\ back\nslash', 1e20, False, "caf\u00e9 \u2603 \U0001f600", -0.0),
+            (-3, "100% %s %d", float("nan"), 0, "", float("inf")),
+            (4, "ratio: inf", 0.5, True, "information", 2),
+        ]
+        for row in rows:
+            self.assertEqual(encoder.dumps(row), json.dumps(dict(zip(encoder.keys, row))).encode())
+        self.assertEqual(encoder.dumps_array(rows), json.dumps([dict(zip(encoder.keys, row)) for row in rows]).encode())
+        with self.assertRaises(TypeError):
+            encoder.dumps((1, b"blob", 1.0, True, None, 1))
+
+    def test_iter_array_matches_dumps_array(self):
+        encoder = row_encoder(("id", "name"))
+        self.assertIs(encoder, row_encoder(("id", "name")))
+        for count in (0, 1, 4, 5):
+            rows = [(index, f"item-{index}", "extra column") for index in range(count)]
+            expected = json.dumps([{"id": index, "name": f"item-{index}"} for index in range(count)]).encode()
+            self.assertEqual(b"".join(encoder.iter_array(iter(rows), batch_size=2)), expected)
+            self.assertEqual(encoder.dumps_array(rows), expected)
+
+    def test_grouped_array_matches_categories_with_items(self):
+        db = Database(":memory:")
+        with open("schema.sql") as schema_file:
+            db.cursor.executescript(schema_file.read())
+        parent = row_encoder(("id", "name"))
+        child = row_encoder(("id", "name", "description", "price"), skip=2)
+        self.assertEqual(b"".join(iter_grouped_array(db.iter_category_item_rows(), parent, child, "items")), b"[]")
+        for name in ("Electronics", "Empty", "Books"):
+            db.create_category(name)
+        for index in range(5):
+            db.create_item(index % 2 * 2 + 1, f"item-{index}", None if index % 2 else "desc", index + 0.5)
+        expected = json.dumps(db.get_categories_with_items()).encode()
+        for batch_size in (1, 2, 10):
+            rows = db.iter_category_item_rows(batch_size=batch_size)
+            self.assertEqual(b"".join(iter_grouped_array(rows, parent, child, "items", batch_size)), expected)
+        db.close()
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        response_cache.clear()
+        self.body = json.dumps([{"id": index, "name": f"item-{index}"} for index in range(200)]).encode()
+
+    def gzip_handler(self, accept="gzip, deflate"):
+        handler = StubHandler()
+        handler.headers = {"Accept-Encoding": accept}
+        return handler
+
+    def test_accept_encoding(self):
+        for header, expected in (
+            ("gzip", True),
+            ("deflate, GZIP;q=0.5", True),
+            ("*", True),
+            ("gzip;q=0", False),
+            ("*;q=0.1, gzip;q=0", False),
+            ("br, identity", False),
+            ("", False),
+        ):
+            self.assertEqual(utils.accepts_gzip(self.gzip_handler(header)), expected, header)
+
+    def test_large_body_is_gzipped(self):
+        handler = self.gzip_handler()
+        utils.send_json_bytes(handler, 200, self.body, '"v1"')
+        compressed = handler.wfile.getvalue()
+        self.assertEqual(gzip.decompress(compressed), self.body)
+        self.assertEqual(handler.sent_headers["Content-Encoding"], "gzip")
+        self.assertEqual(handler.sent_headers["Content-Length"], str(len(compressed)))
+        self.assertEqual(handler.sent_headers["Vary"], "Accept-Encoding")
+        self.assertEqual(handler.sent_headers["ETag"], '"v1-gzip"')
+        # No timestamp in the gzip header, so the bytes are reproducible
+        self.assertEqual(compressed, utils.gzip_compress(self.body))
+
+    def test_identity_and_small_bodies(self):
+        identity = StubHandler()
+        utils.send_json_bytes(identity, 200, self.body, '"v1"')
+        self.assertEqual(identity.wfile.getvalue(), self.body)
+        self.assertNotIn("Content-Encoding", identity.sent_headers)
+        self.assertEqual(identity.sent_headers["Vary"], "Accept-Encoding")
+        self.assertEqual(identity.sent_headers["ETag"], '"v1"')
+
+        small = self.gzip_handler()
+        utils.send_json_bytes(small, 200, b'{"ok": true}')
+        self.assertEqual(small.wfile.getvalue(), b'{"ok": true}')
+        self.assertNotIn("Content-Encoding", small.sent_headers)
+        self.assertNotIn("Vary", small.sent_headers)
+
+    def test_cached_body_is_compressed_once(self):
+        for _ in range(2):
+            handler = self.gzip_handler()
+            handler.response_cache_target = ("/items", '"v1"')
+            utils.send_json_bytes(handler, 200, self.body)
+            self.assertEqual(gzip.decompress(handler.wfile.getvalue()), self.body)
+        self.assertEqual(response_cache.get("/items", '"v1"'), self.body)
+        self.assertEqual(response_cache.snapshot()["gzip_hits"], 1)
+
+    def test_stream_is_gzipped(self):
+        chunks = [self.body[index:index + 100] for index in range(0, len(self.body), 100)]
+        handler = self.gzip_handler()
+        handler.response_cache_target = ("/categories", '"v1"')
+        utils.send_json_stream(handler, 200, iter(chunks))
+        self.assertEqual(handler.sent_headers["Transfer-Encoding"], "chunked")
+        self.assertEqual(handler.sent_headers["ETag"], '"v1-gzip"')
+        decoded = http.client.HTTPResponse(FakeSocket(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n" + handler.wfile.getvalue()))
+        decoded.begin()
+        compressed = decoded.read()
+        self.assertEqual(gzip.decompress(compressed), self.body)
+        self.assertEqual(response_cache.get("/categories", '"v1"'), self.body)
+        self.assertEqual(response_cache.get_gzip("/categories", '"v1"'), utils.gzip_compress(self.body))
+
+    def test_short_stream_is_sent_whole(self):
+        handler = self.gzip_handler()
+        utils.send_json_stream(handler, 200, iter([b"[1", b", 2]"]))
+        self.assertNotIn("Transfer-Encoding", handler.sent_headers)
+        self.assertNotIn("Content-Encoding", handler.sent_headers)
+        self.assertEqual(handler.wfile.getvalue(), b"[1, 2]")
+
+
+class FakeSocket:
+    def __init__(self, data):
+        self.data = data
+
+    def makefile(self, mode):
+        return io.BytesIO(self.data)
+
+
+class TestAuth(unittest.TestCase):
+
+    def setUp(self):
+        self.auth = utils.Auth(secret_key="test-key", cache_size=2, cache_ttl=60)
+
+    def test_signed_token_round_trip(self):
+        token = self.auth.generate_token("alice")
+        self.assertTrue(self.auth.verify_token(token))
+        self.assertTrue(self.auth.verify_token(token))
+        self.assertEqual(self.auth.stats, {"hits": 1, "misses": 1})
+
+    def test_rejects_tampered_and_foreign_tokens(self):
+        token = self.auth.generate_token("alice")
+        body, _, signature = token.partition(".")
+        forged_body = utils.encode_cursor({"exp": 9999999999, "sub": "admin"})
+        self.assertFalse(self.auth.verify_token(f"{forged_body}.{signature}"))
+        self.assertFalse(utils.Auth(secret_key="other-key").verify_token(token))
+        self.assertFalse(self.auth.verify_token("not-a-token"))
+
+    def test_rejects_expired_token(self):
+        body = utils.encode_cursor({"exp": int(time.time()) - 1})
+        self.assertFalse(self.auth.verify_token(f"{body}.{self.auth._sign(body)}"))
+
+    def test_cache_is_bounded(self):
+        tokens = [self.auth.generate_token(name) for name in ("a", "b", "c")]
+        for token in tokens:
+            self.auth.verify_token(token)
+        self.assertEqual(len(self.auth._verified), 2)
+        self.assertNotIn(tokens[0], self.auth._verified)
+
+
+class TestPasswordHasher(unittest.TestCase):
+
+    def test_pool_matches_inline_hashing(self):
+        pooled = PasswordHasher(workers=1)
+        inline = PasswordHasher(workers=0)
+        try:
+            hashed = pooled.hash("secret")
+            self.assertEqual(hashed, inline.hash("secret"))
+            self.assertTrue(pooled.verify(hashed, "secret"))
+            self.assertFalse(pooled.verify(hashed, "wrong"))
+        finally:
+            pooled.shutdown()
+
+    def test_saturated_pool_fails_fast(self):
+        hasher = PasswordHasher(workers=1, queue_depth=1)
+        busy = threading.Thread(target=hasher._run, args=(time.sleep, 1.0))
+        busy.start()
+        try:
+            time.sleep(0.1)
+            start = time.monotonic()
+            with self.assertRaises(HasherBusyError):
+                hasher.hash("secret")
+            self.assertLess(time.monotonic() - start, 0.1)
+            self.assertEqual(hasher.stats["rejected"], 1)
+        finally:
+            busy.join()
+            hasher.shutdown()
+
+
+    def test_timed_out_job_keeps_its_slot(self):
+        hasher = PasswordHasher(workers=1, queue_depth=1, timeout=0.2)
+        try:
+            with self.assertRaises(HasherBusyError):
+                hasher._run(time.sleep, 1.5)
+            # Still running in the pool, so still counted against queue_depth
+            with self.assertRaisesRegex(HasherBusyError, "queue is full"):
+                hasher._run(time.sleep, 0)
+            hasher.timeout = 10.0
+            deadline = time.monotonic() + 10
+            while True:
+                try:
+                    hasher.hash("secret")
+                    break
+                except HasherBusyError:
+                    self.assertLess(time.monotonic(), deadline)
+                    time.sleep(0.05)
+        finally:
+            hasher.shutdown()
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_entries=2)
+        cache.store("/a", '"1"', b"a")
+        cache.store("/b", '"1"', b"b")
+        self.assertEqual(cache.get("/a", '"1"'), b"a")
+        cache.store("/c", '"1"', b"c")
+        self.assertIsNone(cache.get("/b", '"1"'))
+        self.assertEqual(cache.get("/a", '"1"'), b"a")
+        self.assertEqual(cache.snapshot()["evictions"], 1)
+
+    def test_byte_bound(self):
+        cache = ResponseCache(max_bytes=10, max_body_bytes=8)
+        cache.store("/big", '"1"', b"x" * 9)
+        self.assertIsNone(cache.get("/big", '"1"'))
+        cache.store("/a", '"1"', b"x" * 6)
+        cache.store("/b", '"1"', b"x" * 6)
+        self.assertIsNone(cache.get("/a", '"1"'))
+        self.assertEqual(cache.snapshot()["bytes"], 6)
+
+    def test_stale_etag_misses(self):
+        cache = ResponseCache()
+        old_etag = cache.etag_for("/items", "items:1")
+        new_etag = cache.etag_for("/items", "items:2")
+        self.assertNotEqual(old_etag, new_etag)
+        cache.store("/items", old_etag, b"[]")
+        self.assertIsNone(cache.get("/items", new_etag))
+        self.assertEqual(cache.snapshot()["misses"], 1)
+
+    def test_gzip_copy_shares_the_entry(self):
+        cache = ResponseCache(max_bytes=20)
+        cache.store("/a", '"1"', b"x" * 8)
+        cache.store_gzip("/a", '"1"', b"z" * 4)
+        self.assertEqual(cache.get_gzip("/a", '"1"'), b"z" * 4)
+        self.assertIsNone(cache.get_gzip("/a", '"2"'))
+        self.assertEqual(cache.snapshot()["bytes"], 12)
+        cache.store("/a", '"2"', b"y" * 8)
+        self.assertIsNone(cache.get_gzip("/a", '"2"'))
+        self.assertEqual(cache.snapshot()["bytes"], 8)
+
+    def test_etag_matches(self):
+        self.assertTrue(etag_matches('"a", W/"b"', '"b"'))
+        # "*" depends on the resource existing, which cached_get decides
+        self.assertFalse(etag_matches("*", '"b"'))
+        self.assertFalse(etag_matches('"a"', '"b"'))
+        self.assertFalse(etag_matches(None, '"b"'))
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(0.2)
+        utils.send_json_response(self, 200, {"ok": True})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestGroupCommitWriter(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        conn = connect(self.path)
+        conn.executescript(
+            """
+    CREATE TABLE categories (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+    CREATE TABLE items (
+        id INTEGER PRIMARY KEY,
+        category_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        description TEXT,
+        price REAL NOT NULL,
+        created_at TEXT,
+        updated_at TEXT
+    );
+    INSERT INTO categories (name) VALUES ('Electronics');
+    """
+        )
+        conn.close()
+        self.writer = GroupCommitWriter(self.path, window=0.05, max_batch=8)
+
+    def tearDown(self):
+        self.writer.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def insert(self, name):
+        def operation(cursor):
+            cursor.execute(
+                "INSERT INTO items (category_id, name, price) VALUES (1, ?, 1)", (name,)
+            )
+            return cursor.lastrowid
+        return operation
+
+    def test_batches_concurrent_writes(self):
+        ids = []
+        threads = [
+            threading.Thread(target=lambda i=i: ids.append(self.writer.submit(self.insert(f"item-{i}"))))
+            for i in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(ids), list(range(1, 21)))
+        stats = self.writer.snapshot()
+        self.assertEqual(stats["operations"], 20)
+        self.assertLess(stats["batches"], 20)
+        self.assertLessEqual(stats["max_batch"], 8)
+        self.assertEqual(sum(stats["batch_sizes"].values()), stats["batches"])
+
+    def test_failed_operation_does_not_sink_batch(self):
+        def failing(cursor):
+            cursor.execute("INSERT INTO categories (name) VALUES ('Electronics')")
+
+        results = {}
+
+        def run(name, operation):
+            try:
+                results[name] = self.writer.submit(operation)
+            except Exception as e:
+                results[name] = e
+
+        threads = [
+            threading.Thread(target=run, args=("first", self.insert("first"))),
+            threading.Thread(target=run, args=("failing", failing)),
+            threading.Thread(target=run, args=("second", self.insert("second"))),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIsInstance(results["failing"], sqlite3.IntegrityError)
+        db = Database(self.path)
+        self.assertEqual(db.get_total_items(), 2)
+        db.close()
+        self.assertEqual(self.writer.snapshot()["failed"], 1)
+
+    def test_database_routes_writes_through_writer(self):
+        db = Database(self.path, group_commit=True)
+        with self.assertRaises(ValueError):
+            db.create_item(99, "Orphan", None, 1)
+        item_id = db.create_item(1, "Laptop", None, 1000)
+        db.update_item(item_id, "Laptop Pro", None, 1500)
+        self.assertEqual(db.get_item(item_id)[2], "Laptop Pro")
+        db.delete_item(item_id)
+        self.assertIsNone(db.get_item(item_id))
+        db.close()
+        self.assertEqual(writer_snapshots()[self.path]["operations"], 4)
+        close_writers()
+
+
+class TestRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.router = Router()
+        self.router.add("GET", "/items", "list")
+        self.router.add("GET", "/items/search", "search")
+        self.router.add("GET", "/items/<int:item_id>", "get")
+        self.router.add("DELETE", "/items/<int:item_id>", "delete")
+
+    def test_static_and_typed_routes(self):
+        route, params = self.router.match("GET", "/items/search")
+        self.assertEqual((route.handler, params), ("search", ()))
+        route, params = self.router.match("DELETE", "/items/42")
+        self.assertEqual((route.handler, params), ("delete", (42,)))
+
+    def test_errors(self):
+        cases = [
+            ("GET", "/nope", 404),
+            ("GET", "/items/", 404),
+            ("GET", "/items/1/extra", 404),
+            ("GET", "/items/abc", 400),
+            ("GET", "/items/+5", 400),
+            ("PUT", "/items/abc", 405),
+        ]
+        for method, path, status in cases:
+            with self.subTest(path=path, method=method):
+                with self.assertRaises(RouteError) as caught:
+                    self.router.match(method, path)
+                self.assertEqual(caught.exception.status, status)
+
+        with self.assertRaises(RouteError) as caught:
+            self.router.match("POST", "/items/1")
+        self.assertEqual(caught.exception.allow, ["DELETE", "GET"])
+
+    def test_rejects_duplicates(self):
+        with self.assertRaises(ValueError):
+            self.router.add("GET", "/items", "again")
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram_quantiles(self):
+        histogram = Histogram()
+        for _ in range(90):
+            histogram.observe(0.0007)
+        for _ in range(10):
+            histogram.observe(0.2)
+        self.assertLessEqual(histogram.quantile(0.5), 0.001)
+        self.assertGreater(histogram.quantile(0.99), 0.1)
+        self.assertLessEqual(histogram.quantile(0.99), 0.25)
+        self.assertEqual(Histogram().quantile(0.5), 0.0)
+
+    def test_render_prometheus_text(self):
+        registry = Metrics()
+        registry.observe_request("GET", "/items/<int:item_id>", "200", 0.004, 120)
+        registry.observe_request("GET", "/items/<int:item_id>", "404", 0.001, 30)
+        text = registry.render([("inventory_pool_connections", "gauge", "Open", {(): 3})]).decode()
+        self.assertIn('inventory_http_requests_total{method="GET",route="/items/<int:item_id>",status="404"} 1', text)
+        self.assertIn('inventory_http_request_duration_seconds_bucket{method="GET",route="/items/<int:item_id>",le="+Inf"} 2', text)
+        self.assertIn('inventory_http_request_duration_seconds_count{method="GET",route="/items/<int:item_id>"} 2', text)
+        self.assertIn('quantile="0.99"', text)
+        self.assertIn('inventory_http_response_bytes_total{method="GET",route="/items/<int:item_id>"} 150', text)
+        self.assertIn("# TYPE inventory_pool_connections gauge\ninventory_pool_connections 3", text)
+
+    def test_timed_query_counts_rows(self):
+        class Source:
+            @timed_query
+            def fetch_rows(self):
+                return [(1,), (2,)]
+
+            @timed_query
+            def stream_rows(self):
+                yield from [(1,), (2,), (3,)]
+
+        metrics.reset()
+        Source().fetch_rows()
+        rows = Source().stream_rows()
+        self.assertNotIn("stream_rows", metrics.query_rows)
+        self.assertEqual(len(list(rows)), 3)
+        self.assertEqual(metrics.query_rows["fetch_rows"], 2)
+        self.assertEqual(metrics.query_rows["stream_rows"], 3)
+        self.assertEqual(metrics.query_latency["stream_rows"].count, 1)
+
+
+class TestSlowQueryLog(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.log_path = tempfile.mkstemp(suffix=".log")
+        os.close(handle)
+        self.saved = (slow_query_log.threshold, slow_query_log.path)
+        slow_query_log.threshold = 0
+        slow_query_log.path = self.log_path
+        slow_query_log.recent.clear()
+
+    def tearDown(self):
+        slow_query_log.threshold, slow_query_log.path = self.saved
+        slow_query_log.recent.clear()
+        os.remove(self.log_path)
+
+    def test_logs_shape_and_plan_not_values(self):
+        conn = connect(":memory:")
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, password_hash TEXT)")
+        conn.execute("CREATE INDEX idx_users_username ON users (username)")
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM users WHERE username = ? AND id > ?", ("hunter2", 5))
+        cursor.fetchall()
+        conn.close()
+
+        entry = slow_query_log.recent[-1]
+        self.assertEqual(entry["params"], ["str[7]", "int"])
+        self.assertTrue(any("idx_users_username" in step for step in entry["plan"]))
+        with open(self.log_path) as log_file:
+            logged = [json.loads(line) for line in log_file]
+        self.assertEqual(logged[-1]["sql"], "SELECT * FROM users WHERE username = ? AND id > ?")
+        self.assertNotIn("hunter2", json.dumps(logged))
+
+    def test_threshold(self):
+        slow_query_log.threshold = 60
+        conn = connect(":memory:")
+        conn.execute("SELECT 1").fetchall()
+        conn.close()
+        self.assertEqual(len(slow_query_log.recent), 0)
+
+
+class TestRequestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def test_header_and_sampling(self):
+        profiler = RequestProfiler(sample_every=3, token="s3cret", directory=self.directory, max_files=2)
+        plain = StubHandler()
+        debug = StubHandler()
+        debug.headers = {"X-Profile": "s3cret"}
+        wrong = StubHandler()
+        wrong.headers = {"X-Profile": "guess"}
+
+        self.assertIsNone(profiler.start(plain))
+        self.assertIsNone(profiler.start(wrong))
+        profile = profiler.start(plain)  # third request is sampled
+        self.assertIsNotNone(profile)
+        # Only one profile runs at a time
+        self.assertIsNone(profiler.start(debug))
+        profiler.finish(profile, "GET", "/items/<int:item_id>", 0.012)
+
+        for _ in range(2):
+            profiler.finish(profiler.start(debug), "GET", "/items", 0.001)
+        files = os.listdir(self.directory)
+        self.assertEqual(len(files), 2)
+        self.assertTrue(all(name.endswith(".prof") for name in files))
+        self.assertEqual(profiler.stats, {"profiled": 3, "skipped_busy": 1})
+
+
+class TestSqliteProfiles(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+
+    def tearDown(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_profile_pragmas_applied(self):
+        for name, expected_sync in (("durable", 2), ("balanced", 1), ("throughput", 0)):
+            conn = connect(self.path, profile=name)
+            pragmas = Config.SQLITE_PROFILES[name]
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], expected_sync)
+            self.assertEqual(conn.execute("PRAGMA cache_size").fetchone()[0], pragmas["cache_size"])
+            self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], pragmas["busy_timeout"])
+            conn.close()
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            connect(self.path, profile="turbo")
+
+
+class TestLoadtestCompare(unittest.TestCase):
+
+    def report(self, **endpoints):
+        rows = {
+            name: {"requests": requests, "errors": errors, "rps": requests / 10, "p99_ms": None if not requests else 5.0}
+            for name, (requests, errors) in endpoints.items()
+        }
+        total = {"requests": 1, "errors": 0, "rps": 0.1, "p99_ms": 5.0}
+        return {"scales": {"1000": {"total": total, "endpoints": rows}}}
+
+    def test_steady_run_passes(self):
+        baseline = self.report(item=(1000, 0), search=(100, 2))
+        self.assertEqual(compare(self.report(item=(990, 0), search=(100, 2)), baseline, 0.2), [])
+
+    def test_errors_and_lost_endpoints_are_regressions(self):
+        baseline = self.report(item=(1000, 0), search=(100, 0), categories=(50, 0))
+        current = self.report(item=(1000, 3), search=(0, 250), categories=(0, 0))
+        regressions = compare(current, baseline, 0.2)
+        self.assertTrue(any("item" in message and "errors" in message for message in regressions))
+        self.assertTrue(any("search" in message and "no successful requests" in message for message in regressions))
+        self.assertTrue(any("categories" in message and "no successful requests" in message for message in regressions))
 
+
+class TestMigration(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.migration = Migration(self.path)
+        with redirect_stdout(io.StringIO()):
+            self.migration.migrate_up()
+        self.db = Database(self.path)
+
+    def tearDown(self):
+        self.db.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def indexes(self):
+        self.db.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'")
+        return {row[0] for row in self.db.cursor.fetchall()}
+
+    def test_up_applies_all_versions(self):
+        with redirect_stdout(io.StringIO()):
+            current, applied = self.migration.status()
+        self.assertEqual(current, LATEST_VERSION)
+        self.assertEqual(sorted(applied), list(range(1, LATEST_VERSION + 1)))
+        self.assertTrue({"idx_items_category_id", "idx_items_updated_at"} <= self.indexes())
+
+    def test_migrate_down_to_zero_keeps_data(self):
+        items_before = self.db.get_total_items()
+        with redirect_stdout(io.StringIO()):
+            self.migration.migrate_to(0)
+            current, _ = self.migration.status()
+        self.assertEqual(current, 0)
+        self.assertEqual(self.indexes(), set())
+        self.assertEqual(self.db.get_total_items(), items_before)
+
+        with redirect_stdout(io.StringIO()):
+            self.migration.migrate_to(LATEST_VERSION)
+        self.assertIn("idx_items_category_id", self.indexes())
+
+
+    def test_item_listing_plans_use_indexes(self):
+        filter_sets = [
+            {},
+            {"category_id": 1},
+            {"min_price": 10, "max_price": 100},
+            {"updated_since": "2024-01-01 00:00:00"},
+            {"category_id": 1, "min_price": 10},
+            {"category_id": 1, "updated_since": "2024-01-01 00:00:00"},
+            {"min_price": 10, "updated_since": "2024-01-01 00:00:00"},
+        ]
+        for filters in filter_sets:
+            for sort in ITEM_SORTS:
+                for after in (None, ("m", 5)):
+                    if not filters and after is None:
+                        # The unfiltered first page walks the primary key or
+                        # the sort column's index and stops at LIMIT; that is
+                        # the cheapest possible plan
+                        continue
+                    sql, params = item_query(filters, sort, after)
+                    self.db.cursor.execute(f"EXPLAIN QUERY PLAN {sql} LIMIT 10", params)
+                    plan = [row[3] for row in self.db.cursor.fetchall()]
+                    with self.subTest(filters=filters, sort=sort, cursor=after is not None):
+                        # Walking a whole index and testing the filter row by
+                        # row is a full scan too
+                        scans = [step for step in plan if step.startswith(("SCAN items", "SCAN TABLE items"))]
+                        self.assertEqual(scans, [], plan)
+
+    def test_filtered_sorted_keyset_walk(self):
+        self.db.create_items(
+            [{"category_id": 1, "name": f"item-{index}", "price": index % 4} for index in range(10)]
+        )
+        filters = {"category_id": 1, "min_price": 1}
+        expected = sorted(
+            (row for row in self.db.iter_items(100, 0, filters) if row[4] >= 1),
+            key=lambda row: (row[4], row[0]),
+            reverse=True,
+        )
+        seen = []
+        after = None
+        while True:
+            page = list(self.db.iter_items_after(after, 3, filters, "-price"))
+            if not page:
+                break
+            seen.extend(page)
+            after = (page[-1][4], page[-1][0])
+        self.assertEqual(seen, expected)
+        self.assertEqual(self.db.count_items(filters), len(expected))
+
+    def test_category_stats_follow_writes(self):
+        def stats(category_id):
+            row = next(row for row in self.db.get_category_stats() if row[0] == category_id)
+            return row[2:5], row[5]
+
+        # Dummy data: Electronics holds 999.99 and 599.99
+        self.assertEqual(stats(1)[0], (2, 599.99, 999.99))
+        ids = [result["id"] for result in self.db.create_items(
+            [{"category_id": 1, "name": "Cable", "price": 9.99},
+             {"category_id": 1, "name": "TV", "price": 1999.99}]
+        )]
+        self.assertEqual(stats(1)[0], (4, 9.99, 1999.99))
+        self.db.update_items({}, ids=[ids[1]], price_factor=0.25)
+        self.assertEqual(stats(1)[0], (4, 9.99, 999.99))
+        self.db.delete_item(ids[0])
+        self.assertEqual(stats(1)[0], (3, 500.0, 999.99))
+        self.db.update_items({"price": 10}, category_id=1)
+        self.assertEqual(stats(1), ((3, 10, 10), 10))
+        self.db.delete_items(category_id=1)
+        self.assertEqual(stats(1), ((0, None, None), None))
+
+        category_id = self.db.create_category("Empty")
+        self.assertEqual(stats(category_id), ((0, None, None), None))
+
+    def test_rebuild_stats_repairs_drift(self):
+        self.db.cursor.execute("UPDATE category_stats SET item_count = 42 WHERE category_id = 2")
+        self.db.conn.commit()
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(self.migration.rebuild_stats(), 1)
+        self.db.cursor.execute("SELECT item_count FROM category_stats WHERE category_id = 2")
+        self.assertEqual(self.db.cursor.fetchone()[0], 2)
+
+    def test_items_reject_non_numeric_prices(self):
+        for price in ("abc", float("inf"), None):
+            with self.subTest(price=price), self.assertRaises(sqlite3.IntegrityError):
+                self.db.cursor.execute(
+                    "INSERT INTO items (category_id, name, price) VALUES (1, 'Bad', ?)", (price,)
+                )
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.cursor.execute("UPDATE items SET price = 'abc' WHERE id = 1")
+        self.db.conn.rollback()
+
+    def test_failed_seed_keeps_schema_current(self):
+        indexes = self.indexes()
+        # Bad input is rejected before anything changes
+        self.db.cursor.execute("DELETE FROM items")
+        self.db.cursor.execute("DELETE FROM categories")
+        self.db.conn.commit()
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.migration.seed(categories=0, items=10, users=0)
+        self.assertIn("Items need at least one category", output.getvalue())
+        self.assertEqual(self.migration_version(), LATEST_VERSION)
+
+        # A load that fails partway still gets its indexes, search and
+        # stats back
+        self.db.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM users")
+        taken = f"user{self.db.cursor.fetchone()[0] + 2:06d}"
+        self.db.create_user(taken, "secret")
+        with redirect_stdout(io.StringIO()):
+            self.migration.seed(categories=2, items=10, users=3)
+        self.assertEqual(self.migration_version(), LATEST_VERSION)
+        self.assertEqual(self.indexes(), indexes)
+        self.assertEqual(self.db.search_items("Lamp"), [])
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(self.migration.rebuild_stats(), 0)
+
+    def test_seed_appends_reproducible_rows(self):
+        self.db.close()
+        with redirect_stdout(io.StringIO()):
+            self.migration.seed(categories=5, items=2000, users=3, seed=7, batch_size=700)
+        self.db = Database(self.path)
+        self.assertEqual(len(self.db.get_categories()), 3 + 5)
+        self.assertEqual(self.db.get_total_items(), 6 + 2000)
+        self.assertIsNotNone(self.db.get_user("user000003"))
+        self.assertEqual(self.migration_version(), LATEST_VERSION)
+        # Derived tables were rebuilt to match the loaded rows
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(self.migration.rebuild_stats(), 0)
+        self.assertTrue(self.db.search_items("Lamp", limit=1))
+
+        handle, other = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        try:
+            with redirect_stdout(io.StringIO()):
+                Migration(other).seed(categories=5, items=2000, users=3, seed=7, batch_size=2000)
+            conn = connect(other)
+            seeded = conn.execute("SELECT category_id, name, description, price FROM items").fetchall()
+            conn.close()
+        finally:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(other + suffix):
+                    os.remove(other + suffix)
+        self.db.cursor.execute(
+            "SELECT category_id - 3, name, description, price FROM items WHERE id > 6 ORDER BY id"
+        )
+        self.assertEqual(self.db.cursor.fetchall(), seeded)
+
+    def migration_version(self):
+        self.db.cursor.execute("SELECT MAX(version) FROM schema_version")
+        return self.db.cursor.fetchone()[0]
+
+    def test_search_items_follows_writes(self):
+        self.assertEqual([row[2] for row in self.db.search_items("laptop")], ["Laptop"])
+        results = self.db.create_items([{"category_id": 1, "name": "Gaming Laptop", "price": 1500}])
+        new_id = results[0]["id"]
+        # The name match outranks the description-only match
+        self.assertEqual([row[2] for row in self.db.search_items("laptop")], ["Gaming Laptop", "Laptop"])
+        self.db.update_item(new_id, "Desktop", None, 1500)
+        self.assertEqual([row[2] for row in self.db.search_items("laptop")], ["Laptop"])
+        self.db.delete_item(1)
+        self.assertEqual(self.db.search_items("laptop"), [])
+        self.assertEqual([row[2] for row in self.db.search_items("desk")], ["Desktop"])
+
+    def test_search_items_pages_by_rank(self):
+        first = self.db.search_items("stylish", limit=1)
+        second = self.db.search_items("stylish", limit=1, after=(first[0][7], first[0][0]))
+        rest = self.db.search_items("stylish", after=(second[0][7], second[0][0]))
+        self.assertEqual({first[0][2], second[0][2]}, {"Jeans", "Table"})
+        self.assertEqual(rest, [])
+
+    def test_search_query_is_quoted(self):
+        self.assertEqual(self.db.search_items('laptop" OR name:*'), [])
+
+
+class TestWorkerPoolHTTPServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = WorkerPoolHTTPServer(("localhost", 0), SlowHandler, workers=4)
+        self.port = self.server.server_port
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+    def test_serves_requests_concurrently(self):
+        responses = []
+
+        def fetch():
+            responses.append(requests.get(f"http://localhost:{self.port}/").status_code)
+
+        clients = [threading.Thread(target=fetch) for _ in range(4)]
+        start = time.monotonic()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.monotonic() - start
+        self.server.shutdown()
+        self.server.server_close()
+
+        self.assertEqual(responses, [200] * 4)
+        self.assertLess(elapsed, 0.6)
+
+    def test_shutdown_drains_in_flight_requests(self):
+        responses = []
+        client = threading.Thread(
+            target=lambda: responses.append(
+                requests.get(f"http://localhost:{self.port}/").status_code
+            )
+        )
+        client.start()
+        time.sleep(0.05)
+        self.server.shutdown()
+        self.server.server_close()
+        client.join()
+        self.assertEqual(responses, [200])
+
+    def test_close_releases_idle_keepalive_connections(self):
+        server = WorkerPoolHTTPServer(("localhost", 0), RequestHandler, workers=2)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        conn = http.client.HTTPConnection("localhost", server.server_port, timeout=5)
+        conn.request("GET", "/nowhere")
+        self.assertEqual(conn.getresponse().read(), b'{"message": "Not Found"}')
+
+        start = time.monotonic()
+        server.shutdown()
+        server.server_close()
+        # The idle connection is closed rather than waited out
+        self.assertLess(time.monotonic() - start, Config.KEEPALIVE_TIMEOUT / 2)
+        conn.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def serve_prefork(db_path, ready):
+    # Runs in a spawned process, which becomes the supervisor
+    Config.DATABASE = db_path
+    import server
+    with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+        server.run_server(port=0, threads=2, workers=2, on_ready=ready.put)
+
+
+class TestPreforkServer(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        with redirect_stdout(io.StringIO()):
+            Migration(self.path).migrate_up()
+        context = multiprocessing.get_context("spawn")
+        ready = context.Queue()
+        self.process = context.Process(target=serve_prefork, args=(self.path, ready))
+        self.process.start()
+        self.port = ready.get(timeout=60)
+
+    def tearDown(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def request(self, conn, method, path, body=None, headers=None):
+        conn.request(method, path, body, headers or {})
+        response = conn.getresponse()
+        return response, response.read()
+
+    def connections_per_worker(self):
+        # Kept-alive connections stay with the worker that accepted them
+        conns = {}
+        for _ in range(50):
+            conn = http.client.HTTPConnection("localhost", self.port, timeout=10)
+            pid = json.loads(self.request(conn, "GET", "/diagnostics")[1])["pid"]
+            if pid in conns:
+                conn.close()
+            else:
+                conns[pid] = conn
+            if len(conns) == 2:
+                return conns
+        self.fail(f"Only reached workers {sorted(conns)}")
+
+    def test_workers_share_table_versions(self):
+        first, second = self.connections_per_worker().values()
+        response, body = self.request(first, "GET", "/categories/names")
+        etag = response.getheader("ETag")
+        names = [category["name"] for category in json.loads(body)]
+
+        credentials = json.dumps({"username": "prefork", "password": "secret"})
+        headers = {"Content-Type": "application/json"}
+        self.request(second, "POST", "/register", credentials, headers)
+        token = json.loads(self.request(second, "POST", "/login", credentials, headers)[1])["token"]
+        headers["Authorization"] = f"Bearer {token}"
+        response, _ = self.request(second, "POST", "/categories", json.dumps({"name": "Tools"}), headers)
+        self.assertEqual(response.status, 201)
+
+        # The write on one worker retires the other worker's cached copy
+        response, body = self.request(first, "GET", "/categories/names", headers={"If-None-Match": etag})
+        self.assertEqual(response.status, 200)
+        self.assertEqual([category["name"] for category in json.loads(body)], names + ["Tools"])
+        first.close()
+        second.close()
+
+    def test_crashed_worker_is_replaced_and_sigterm_stops_all(self):
+        conns = self.connections_per_worker()
+        crashed = next(iter(conns))
+        os.kill(crashed, signal.SIGKILL)
+        for conn in conns.values():
+            conn.close()
+
+        pids = set()
+        deadline = time.monotonic() + 10
+        while len(pids - {crashed}) < 2 and time.monotonic() < deadline:
+            conn = http.client.HTTPConnection("localhost", self.port, timeout=10)
+            pids.add(json.loads(self.request(conn, "GET", "/diagnostics")[1])["pid"])
+            conn.close()
+        self.assertNotIn(crashed, pids)
+        self.assertEqual(len(pids), 2)
+
+        os.kill(self.process.pid, signal.SIGTERM)
+        self.process.join(timeout=Config.KEEPALIVE_TIMEOUT * 2)
+        self.assertEqual(self.process.exitcode, 0)
+        for pid in pids:
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+
+
+class TestRequestHandler(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # A migrated throwaway database (with the migrations' sample rows),
+        # served through the pool that Config.DATABASE selects
+        handle, cls.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        with redirect_stdout(io.StringIO()):
+            Migration(cls.path).migrate_up()
+        cls.previous_database = Config.DATABASE
+        Config.DATABASE = cls.path
+        response_cache.clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        Config.DATABASE = cls.previous_database
+        close_pool()
+        close_writers()
+        response_cache.clear()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(cls.path + suffix):
+                os.remove(cls.path + suffix)
+
+    def setUp(self):
         self.server = ThreadingHTTPServer(("localhost", 0), RequestHandler)
         self.port = self.server.server_port
         self.db = Database(Config.DATABASE)
@@ -172,6 +1367,163 @@ class TestRequestHandler(unittest.TestCase):
         item = tuple(response.json().values())
         self.assertEqual(item, existing_item)
 
+    def test_get_items_cursor_pagination(self):
+        self.db.create_category(utils.generate_random_char(5))
+        for _ in range(3):
+            self.db.create_item(1, utils.generate_random_char(5), None, 1)
+        expected_ids = [item[0] for item in self.db.iter_items_after(None, -1)]
+
+        seen_ids = []
+        cursor = ""
+        while cursor is not None:
+            response = requests.get(
+                f"http://localhost:{self.port}/items",
+                params={"cursor": cursor, "per_page": 50, "include_total": 1},
+            )
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertEqual(body["pagination"]["total_items"], len(expected_ids))
+            seen_ids.extend(item["id"] for item in body["items"])
+            cursor = body["pagination"]["next_cursor"]
+
+        self.assertEqual(seen_ids, expected_ids)
+
+    def test_get_items_invalid_cursor(self):
+        response = requests.get(f"http://localhost:{self.port}/items?cursor=bogus")
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_items_cursor_key_must_match_sort(self):
+        # Decodes fine but cannot be bound as the sort column's value
+        for sort, position in (
+            ("price", {"sort": "price", "key": {"a": 1}, "id": 1}),
+            ("price", {"sort": "price", "key": [1], "id": 1}),
+            ("price", {"sort": "price", "key": "cheap", "id": 1}),
+            ("name", {"sort": "name", "key": 5, "id": 1}),
+            ("id", {"id": True}),
+            ("id", {"id": "1"}),
+        ):
+            with self.subTest(position=position):
+                response = requests.get(
+                    f"http://localhost:{self.port}/items",
+                    params={"cursor": utils.encode_cursor(position), "sort": sort},
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {"message": "Invalid cursor"})
+
+    def test_get_items_page_form(self):
+        response = requests.get(f"http://localhost:{self.port}/items?page=1&per_page=2")
+        self.assertEqual(response.status_code, 200)
+        pagination = response.json()["pagination"]
+        self.assertEqual(pagination["total_items"], self.db.get_total_items())
+        self.assertEqual(pagination["current_page"], 1)
+
+    def test_get_categories_etag(self):
+        url = f"http://localhost:{self.port}/categories/names"
+        first = requests.get(url)
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers["ETag"]
+
+        cached = requests.get(url)
+        self.assertEqual(cached.headers["ETag"], etag)
+        self.assertEqual(cached.json(), first.json())
+
+        not_modified = requests.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+
+        self.db.create_category(utils.generate_random_char(5))
+        changed = requests.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["ETag"], etag)
+        self.assertEqual(len(changed.json()), len(first.json()) + 1)
+
+    def test_if_none_match_any_needs_an_existing_resource(self):
+        headers = {"If-None-Match": "*"}
+        missing = requests.get(f"http://localhost:{self.port}/items/999999", headers=headers)
+        self.assertEqual(missing.status_code, 404)
+        for path in ("/items/1", "/categories", "/categories/names", "/categories/names"):
+            with self.subTest(path=path):
+                response = requests.get(f"http://localhost:{self.port}{path}", headers=headers)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b"")
+                self.assertIn("ETag", response.headers)
+
+    def test_get_categories_gzip(self):
+        for index in range(30):
+            self.db.create_category(f"gzip-{index}-{utils.generate_random_char(20)}")
+        url = f"http://localhost:{self.port}/categories"
+        plain = requests.get(url, headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(plain.headers["Vary"], "Accept-Encoding")
+
+        for _ in range(2):
+            compressed = requests.get(url, headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(compressed.headers["Content-Encoding"], "gzip")
+            self.assertEqual(compressed.content, plain.content)
+            self.assertEqual(compressed.headers["ETag"], plain.headers["ETag"][:-1] + '-gzip"')
+
+        not_modified = requests.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": compressed.headers["ETag"]})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.headers["ETag"], compressed.headers["ETag"])
+
+    def test_diagnostics(self):
+        response = requests.get(f"http://localhost:{self.port}/diagnostics")
+        self.assertEqual(response.status_code, 200)
+        sqlite_info = response.json()["sqlite"]
+        self.assertEqual(sqlite_info["profile"], Config.SQLITE_PROFILE)
+        self.assertEqual(sqlite_info["pragmas"]["journal_mode"], "wal")
+        self.assertIn("hits", response.json()["pool"])
+
+    def test_get_items_filtered_and_sorted(self):
+        category_name = utils.generate_random_char(5)
+        category_id = self.db.create_category(category_name)
+        self.db.create_items(
+            [{"category_id": category_id, "name": f"item-{price}", "price": price} for price in (5, 1, 3, 9)]
+        )
+        response = requests.get(
+            f"http://localhost:{self.port}/items",
+            params={"category_id": category_id, "min_price": 2, "sort": "-price", "per_page": 2, "cursor": ""},
+        )
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([item["price"] for item in body["items"]], [9, 5])
+
+        response = requests.get(
+            f"http://localhost:{self.port}/items",
+            params={"category_id": category_id, "min_price": 2, "sort": "-price", "per_page": 2,
+                    "cursor": body["pagination"]["next_cursor"]},
+        )
+        self.assertEqual([item["price"] for item in response.json()["items"]], [3])
+
+        response = requests.get(
+            f"http://localhost:{self.port}/items",
+            params={"sort": "price", "cursor": body["pagination"]["next_cursor"]},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_items_rejects_bad_filters(self):
+        for query in ("min_price=nan", "max_price=inf", "min_price=-Infinity", "min_price=cheap", "category_id=x"):
+            with self.subTest(query=query):
+                response = requests.get(f"http://localhost:{self.port}/items?{query}")
+                self.assertEqual(response.status_code, 400)
+
+    def test_get_items_rejects_unknown_sort(self):
+        response = requests.get(f"http://localhost:{self.port}/items?sort=color")
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_category_stats(self):
+        response = requests.get(f"http://localhost:{self.port}/categories/stats")
+        self.assertEqual(response.status_code, 200)
+        categories = response.json()
+        self.assertEqual(len(categories), len(self.db.get_categories()))
+        self.assertEqual(
+            sum(category["item_count"] for category in categories), self.db.get_total_items()
+        )
+
+    def test_search_items_requires_query(self):
+        response = requests.get(f"http://localhost:{self.port}/items/search?q=")
+        self.assertEqual(response.status_code, 400)
+
     def test_get_item_not_found(self):
         # Send a GET request to /items/1
         response = requests.get(f"http://localhost:{self.port}/items/0")
@@ -179,6 +1531,94 @@ class TestRequestHandler(unittest.TestCase):
         # Check the response
         self.assertEqual(response.status_code, 404)
 
+    def test_routing_errors(self):
+        base = f"http://localhost:{self.port}"
+        response = requests.get(f"{base}/items/abc")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["message"], "Invalid item_id")
+
+        response = requests.post(f"{base}/items/1", json={})
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response.headers["Allow"], "DELETE, GET, PUT")
+
+        response = requests.put(f"{base}/nowhere", json={}, timeout=5)
+        self.assertEqual(response.status_code, 404)
+
+        response = requests.post(
+            f"{base}/categories", data="{not json", headers={"Content-Type": "application/json"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_metrics(self):
+        requests.get(f"http://localhost:{self.port}/items/0")
+        response = requests.get(f"http://localhost:{self.port}/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+        self.assertIn('route="/items/<int:item_id>",status="404"', response.text)
+        self.assertIn('inventory_db_query_duration_seconds_count{method="get_item"}', response.text)
+        self.assertIn("inventory_pool_connections", response.text)
+
+    def test_keepalive(self):
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request("GET", "/categories/names")
+        response = conn.getresponse()
+        body = response.read()
+        self.assertEqual(response.version, 11)
+        self.assertEqual(int(response.headers["Content-Length"]), len(body))
+        sock = conn.sock
+
+        # Error responses are framed too, and an unread request body is
+        # discarded rather than parsed as the next request
+        conn.request("PUT", "/nowhere", body=b'{"a": 1}')
+        response = conn.getresponse()
+        self.assertEqual(response.status, 404)
+        response.read()
+        conn.request("GET", "/items/0", body=b"ignored body")
+        self.assertEqual(conn.getresponse().read(), b'{"message": "Item not found"}')
+
+        # Streamed responses are chunked
+        conn.request("GET", "/categories")
+        response = conn.getresponse()
+        self.assertEqual(response.headers["Transfer-Encoding"], "chunked")
+        self.assertIsInstance(json.loads(response.read()), list)
+        self.assertIs(conn.sock, sock)
+        conn.close()
+
+    def test_keepalive_max_requests(self):
+        saved = Config.KEEPALIVE_MAX_REQUESTS
+        Config.KEEPALIVE_MAX_REQUESTS = 2
+        try:
+            conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+            conn.request("GET", "/items/0")
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.headers["Keep-Alive"], f"timeout={Config.KEEPALIVE_TIMEOUT:g}, max=1")
+            conn.request("GET", "/items/0")
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.headers["Connection"], "close")
+            self.assertIsNone(conn.sock)
+            conn.close()
+        finally:
+            Config.KEEPALIVE_MAX_REQUESTS = saved
+
+    def test_keepalive_idle_timeout(self):
+        class ShortTimeoutHandler(RequestHandler):
+            timeout = 0.2
+
+        server = ThreadingHTTPServer(("localhost", 0), ShortTimeoutHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            conn = http.client.HTTPConnection("localhost", server.server_port, timeout=5)
+            conn.request("GET", "/items/0")
+            conn.getresponse().read()
+            time.sleep(0.5)
+            self.assertEqual(conn.sock.recv(1), b"")
+            conn.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
     def test_create_category(self):
         # Get the existing categories
         existing_categories = self.db.get_categories()
@@ -241,6 +1681,101 @@ class TestRequestHandler(unittest.TestCase):
         response_json = response.json()
         self.assertEqual(response_json["message"], "Item created")
 
+    def test_create_items_batch(self):
+        items = [
+            {"category_id": 1, "name": utils.generate_random_char(5), "price": 1.5},
+            {"category_id": 0, "name": utils.generate_random_char(5), "price": 2},
+        ]
+        headers = {"Authorization": f"Bearer {self.token}"}
+        response = requests.post(
+            f"http://localhost:{self.port}/items/batch", json={"items": items}, headers=headers
+        )
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual((body["created"], body["failed"]), (1, 1))
+        created = self.db.get_item(body["results"][0]["id"])
+        self.assertEqual(created[2], items[0]["name"])
+
+    def test_create_items_batch_unauthorized(self):
+        response = requests.post(f"http://localhost:{self.port}/items/batch", json=[])
+        self.assertEqual(response.status_code, 401)
+
+    def test_bulk_update_and_delete_items(self):
+        headers = {"Authorization": f"Bearer {self.token}"}
+        items = [{"category_id": 1, "name": utils.generate_random_char(5), "price": 10} for _ in range(3)]
+        response = requests.post(
+            f"http://localhost:{self.port}/items/batch", json=items, headers=headers
+        )
+        ids = [result["id"] for result in response.json()["results"]]
+
+        response = requests.patch(
+            f"http://localhost:{self.port}/items",
+            json={"ids": ids, "set": {"price": 12.5}},
+            headers=headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"updated": 3})
+        self.assertEqual(self.db.get_item(ids[0])[4], 12.5)
+
+        response = requests.delete(
+            f"http://localhost:{self.port}/items", json={"ids": ids}, headers=headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"deleted": 3})
+        self.assertIsNone(self.db.get_item(ids[0]))
+
+    def test_bulk_update_and_delete_validate_input(self):
+        headers = {"Authorization": f"Bearer {self.token}"}
+        item_id = self.db.create_items([{"category_id": 1, "name": utils.generate_random_char(5), "price": 10}])[0]["id"]
+        for body in (
+            {"category_id": 1, "price_factor": "x"},
+            {"category_id": 1, "price_factor": 0},
+            {"category_id": 1, "price_factor": -1.5},
+            {"ids": [item_id], "set": {"price": "abc"}},
+            {"ids": [item_id], "set": {"price": True}},
+            {"ids": [item_id], "set": {"name": ""}},
+            {"ids": [item_id], "set": {"description": 5}},
+            {"ids": [True], "set": {"description": "Sale"}},
+            {"category_id": True, "set": {"description": "Sale"}},
+        ):
+            with self.subTest(body=body):
+                response = requests.patch(f"http://localhost:{self.port}/items", json=body, headers=headers)
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.db.get_item(item_id)[3:5], (None, 10))
+
+        response = requests.delete(f"http://localhost:{self.port}/items", json={"ids": [True]}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNotNone(self.db.get_item(1))
+
+    def test_single_item_writes_validate_input(self):
+        headers = {"Authorization": f"Bearer {self.token}"}
+        url = f"http://localhost:{self.port}/items"
+        for body in (
+            {"category_id": 1, "name": "x", "price": "abc"},
+            {"category_id": 1, "name": "x", "price": True},
+            {"category_id": 1, "name": "", "price": 1},
+            {"category_id": 1, "name": "x", "description": 5, "price": 1},
+            {"name": "x", "price": 1},
+        ):
+            with self.subTest(method="POST", body=body):
+                self.assertEqual(requests.post(url, json=body, headers=headers).status_code, 400)
+        # json.dumps writes NaN and Infinity, which json.loads accepts
+        for price in ("NaN", "Infinity"):
+            body = f'{{"category_id": 1, "name": "x", "price": {price}}}'
+            with self.subTest(method="POST", price=price):
+                response = requests.post(url, data=body, headers=dict(headers, **{"Content-Type": "application/json"}))
+                self.assertEqual(response.status_code, 400)
+
+        for body in ({"name": "x", "price": "abc"}, {"name": "x"}, {"name": 5, "price": 1}):
+            with self.subTest(method="PUT", body=body):
+                self.assertEqual(requests.put(f"{url}/1", json=body, headers=headers).status_code, 400)
+        self.assertTrue(all(isinstance(item[4], (int, float)) for item in self.db.get_items()))
+
+    def test_bulk_delete_requires_selector(self):
+        headers = {"Authorization": f"Bearer {self.token}"}
+        response = requests.delete(f"http://localhost:{self.port}/items", json={}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
     def test_update_item(self):
         # Create a new item
         item_name = utils.generate_random_char(5)
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from config import Config
+
+# Mixed into every ETag so tags issued before a restart never validate
+_instance = os.urandom(8).hex()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024, max_body_bytes=4 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_body_bytes = max_body_bytes
+        self._entries = OrderedDict()  # key -> (etag, body, gzipped body or None)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0, "evictions": 0, "gzip_hits": 0}
+
+    def etag_for(self, key, versions):
+        # versions identifies the data the response was built from, so the
+        # tag can be checked without rebuilding (or even reading) the body
+        digest = hashlib.sha1(f"{_instance}|{key}|{versions}".encode()).hexdigest()
+        return f'"{digest}"'
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == etag:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+            return None
+
+    def store(self, key, etag, body):
+        if len(body) > self.max_body_bytes:
+            return
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None and previous[0] == etag:
+                # Same tag, same data: keep the entry and its gzipped copy
+                self._entries.move_to_end(key)
+                return
+            if previous is not None:
+                del self._entries[key]
+                self._bytes -= _entry_bytes(previous)
+            self._entries[key] = (etag, body, None)
+            self._bytes += len(body)
+            self._evict()
+
+    def get_gzip(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag or entry[2] is None:
+                return None
+            self.stats["gzip_hits"] += 1
+            return entry[2]
+
+    def store_gzip(self, key, etag, gzipped):
+        # Attached to the identity entry, so both are evicted together
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag or entry[2] is not None:
+                return
+            self._entries[key] = (etag, entry[1], gzipped)
+            self._bytes += len(gzipped)
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= _entry_bytes(evicted)
+            self.stats["evictions"] += 1
+
+    def record_not_modified(self):
+        with self._lock:
+            self.stats["not_modified"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self._bytes)
+
+
+def _entry_bytes(entry):
+    return len(entry[1]) + (len(entry[2]) if entry[2] is not None else 0)
+
+
+def gzip_etag(etag):
+    # The gzipped representation is a different sequence of bytes, so it
+    # gets its own strong tag
+    return etag[:-1] + '-gzip"'
+
+
+def etag_matches(if_none_match, etag):
+    # "*" is not a tag: whether it matches depends on the resource existing
+    # (see if_none_match_any)
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        # If-None-Match uses the weak comparison
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def if_none_match_any(if_none_match):
+    return bool(if_none_match) and any(candidate.strip() == "*" for candidate in if_none_match.split(","))
+
+
+response_cache = ResponseCache(
+    max_entries=Config.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=Config.RESPONSE_CACHE_MAX_BYTES,
+    max_body_bytes=Config.RESPONSE_CACHE_MAX_BODY_BYTES,
+)
@@ -0,0 +1,181 @@
+import bisect
+import inspect
+import threading
+import time
+from functools import wraps
+
+# Upper bounds in seconds; the +Inf bucket is implicit
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Interpolated within the bucket holding the q-th observation, the
+        # same estimate Prometheus' histogram_quantile() makes
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if index == len(LATENCY_BUCKETS):
+                    return LATENCY_BUCKETS[-1]
+                lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+                upper = LATENCY_BUCKETS[index]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return LATENCY_BUCKETS[-1]
+
+
+class Metrics:
+    # Process-wide counters. Recording is a lock plus a few dict updates,
+    # cheap enough to leave on for every request.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}  # (method, route, status) -> count
+        self.request_latency = {}  # (method, route) -> Histogram
+        self.response_bytes = {}  # (method, route) -> bytes
+        self.query_latency = {}  # Database method -> Histogram
+        self.query_rows = {}  # Database method -> rows
+
+    def observe_request(self, method, route, status, seconds, response_bytes):
+        with self._lock:
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            key = (method, route)
+            histogram = self.request_latency.get(key)
+            if histogram is None:
+                histogram = self.request_latency[key] = Histogram()
+            histogram.observe(seconds)
+            self.response_bytes[key] = self.response_bytes.get(key, 0) + response_bytes
+
+    def observe_query(self, name, seconds, rows):
+        with self._lock:
+            histogram = self.query_latency.get(name)
+            if histogram is None:
+                histogram = self.query_latency[name] = Histogram()
+            histogram.observe(seconds)
+            self.query_rows[name] = self.query_rows.get(name, 0) + rows
+
+    def reset(self):
+        with self._lock:
+            for table in (self.requests, self.request_latency, self.response_bytes, self.query_latency, self.query_rows):
+                table.clear()
+
+    def render(self, collected=()):
+        # Prometheus text exposition format. collected holds families read
+        # at scrape time: (name, kind, help, {label pairs tuple: value}).
+        lines = []
+        with self._lock:
+            _family(lines, "inventory_http_requests_total", "counter", "Requests served",
+                    {_labels(method=m, route=r, status=s): v for (m, r, s), v in self.requests.items()})
+            _histograms(lines, "inventory_http_request_duration_seconds", "Request latency",
+                        {_labels(method=m, route=r): h for (m, r), h in self.request_latency.items()})
+            _family(lines, "inventory_http_response_bytes_total", "counter", "Response body bytes written",
+                    {_labels(method=m, route=r): v for (m, r), v in self.response_bytes.items()})
+            _histograms(lines, "inventory_db_query_duration_seconds", "Time spent in Database methods",
+                        {_labels(method=name): h for name, h in self.query_latency.items()})
+            _family(lines, "inventory_db_rows_total", "counter", "Rows returned by Database methods",
+                    {_labels(method=name): v for name, v in self.query_rows.items()})
+        for name, kind, help_text, samples in collected:
+            _family(lines, name, kind, help_text,
+                    {_labels(**dict(labels)): value for labels, value in samples.items()})
+        return ("\n".join(lines) + "\n").encode()
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _family(lines, name, kind, help_text, samples):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in sorted(samples.items()):
+        lines.append(f"{name}{labels} {value}")
+
+
+def _histograms(lines, name, help_text, histograms):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    quantiles = []
+    for labels, histogram in sorted(histograms.items()):
+        inner = labels[1:-1] + "," if labels else ""
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS + ("+Inf",), histogram.counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{inner}le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{labels} {histogram.total:.6f}")
+        lines.append(f"{name}_count{labels} {histogram.count}")
+        for q in QUANTILES:
+            quantiles.append(f'{name}_quantile{{{inner}quantile="{q}"}} {histogram.quantile(q):.6f}')
+    # Pre-computed p50/p95/p99 for dashboards without histogram_quantile()
+    lines.append(f"# HELP {name}_quantile {help_text}, estimated from the histogram buckets")
+    lines.append(f"# TYPE {name}_quantile gauge")
+    lines.extend(quantiles)
+
+
+def timed_query(method):
+    # Records time spent in a Database method and the rows it returned.
+    # Methods returning generators are timed across iteration and counted
+    # per row, once the generator finishes or is closed.
+    name = method.__name__
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = method(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        if inspect.isgenerator(result):
+            return _timed_rows(name, result, elapsed)
+        metrics.observe_query(name, elapsed, _row_count(result))
+        return result
+    return wrapper
+
+
+def _timed_rows(name, rows, elapsed):
+    count = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            count += 1
+            yield row
+    finally:
+        rows.close()
+        metrics.observe_query(name, elapsed, count)
+
+
+def _row_count(result):
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple):
+        return 1
+    return 0
+
+
+metrics = Metrics()
@@ -0,0 +1,110 @@
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from config import Config
+
+
+class HasherBusyError(Exception):
+    pass
+
+
+# Module-level so they can be pickled into the worker processes; the key is
+# passed in rather than read from Config inside the worker.
+def hash_password(password, secret_key):
+    return hashlib.sha256((password + secret_key).encode()).hexdigest()
+
+
+def verify_password(hashed_password, password, secret_key):
+    return hmac.compare_digest(hash_password(password, secret_key), hashed_password)
+
+
+class PasswordHasher:
+    # Runs password hashing on a small process pool so CPU-heavy logins
+    # cannot hold the GIL against inventory requests. At most queue_depth
+    # calls may be waiting or running; the rest fail fast with
+    # HasherBusyError. workers=0 hashes inline on the calling thread.
+    def __init__(self, workers=2, queue_depth=32, timeout=10.0):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_depth)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.stats = {"completed": 0, "rejected": 0}
+
+    def hash(self, password):
+        return self._run(hash_password, password, Config.SECRET_KEY)
+
+    def verify(self, hashed_password, password):
+        return self._run(verify_password, hashed_password, password, Config.SECRET_KEY)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def _forget_after_fork(self):
+        # The parent's pool processes and their manager thread are not the
+        # child's to use; the child starts its own on first use
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self.stats["rejected"] += 1
+            raise HasherBusyError("Password hashing queue is full")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._reset_executor()
+            raise HasherBusyError("Password hashing pool restarted")
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until the job is finished or cancelled, not just
+        # until the caller stops waiting, so timed-out jobs still count
+        # against queue_depth
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            result = future.result(timeout=self.timeout)
+            self.stats["completed"] += 1
+            return result
+        except TimeoutError:
+            # Drops the job if no worker has started it yet
+            future.cancel()
+            self.stats["rejected"] += 1
+            raise HasherBusyError("Password hashing timed out")
+        except BrokenProcessPool:
+            self._reset_executor()
+            raise HasherBusyError("Password hashing pool restarted")
+
+    def _reset_executor(self):
+        # A worker died; start a fresh pool for the next caller
+        with self._lock:
+            self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the server process is multi-threaded
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+
+hasher = PasswordHasher(
+    workers=Config.PASSWORD_WORKERS,
+    queue_depth=Config.PASSWORD_QUEUE_DEPTH,
+    timeout=Config.PASSWORD_TIMEOUT,
+)
+
+os.register_at_fork(after_in_child=hasher._forget_after_fork)
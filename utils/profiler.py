@@ -0,0 +1,97 @@
+import cProfile
+import hmac
+import itertools
+import os
+import re
+import threading
+import time
+from collections import deque
+from config import Config
+
+
+class RequestProfiler:
+    # Runs cProfile around 1 in sample_every requests, and around any
+    # request whose `header` matches token. One request is profiled at a
+    # time; the rest go unprofiled rather than wait. Each profile is a
+    # pstats file in directory (open with `python -m pstats <file>`).
+    def __init__(self, sample_every=0, token=None, directory="profiles", max_files=200, header="X-Profile"):
+        self.sample_every = sample_every
+        self.token = token
+        self.directory = directory
+        self.max_files = max_files
+        self.header = header
+        self._counter = itertools.count(1)
+        self._sequence = itertools.count(1)
+        self._busy = threading.Lock()
+        self.recent = deque(maxlen=20)
+        self.stats = {"profiled": 0, "skipped_busy": 0}
+
+    def start(self, handler):
+        if not (self._requested(handler) or self._sampled()):
+            return None
+        if not self._busy.acquire(blocking=False):
+            self.stats["skipped_busy"] += 1
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile, method, route, seconds):
+        profile.disable()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+            name = (
+                f"{time.strftime('%Y%m%d-%H%M%S')}-{next(self._sequence):04d}"
+                f"-{method}-{slug}-{seconds * 1000:.0f}ms.prof"
+            )
+            path = os.path.join(self.directory, name)
+            profile.dump_stats(path)
+            self.stats["profiled"] += 1
+            self.recent.append(name)
+            self._prune()
+            return path
+        finally:
+            self._busy.release()
+
+    def snapshot(self):
+        return dict(
+            self.stats,
+            sample_every=self.sample_every,
+            header_enabled=self.token is not None,
+            directory=self.directory,
+            recent=list(self.recent),
+        )
+
+    def _requested(self, handler):
+        if self.token is None:
+            return False
+        value = handler.headers.get(self.header)
+        return value is not None and hmac.compare_digest(value.encode(), self.token.encode())
+
+    def _sampled(self):
+        return self.sample_every > 0 and next(self._counter) % self.sample_every == 0
+
+    def _prune(self):
+        files = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".prof")
+        ]
+        if len(files) <= self.max_files:
+            return
+        # Names start with the time and a sequence number, so they sort oldest first
+        files.sort()
+        for path in files[: len(files) - self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+profiler = RequestProfiler(
+    sample_every=Config.PROFILE_SAMPLE_EVERY,
+    token=Config.PROFILE_TOKEN,
+    directory=Config.PROFILE_DIR,
+    max_files=Config.PROFILE_MAX_FILES,
+)
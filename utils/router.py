@@ -0,0 +1,99 @@
+import re
+
+_PARAM = re.compile(r"<(?:(\w+):)?(\w+)>")
+
+
+def _to_int(value):
+    # int() alone would also accept "+5", " 5" and non-ASCII digits
+    if not (value.isascii() and value.isdigit()):
+        raise ValueError(value)
+    return int(value)
+
+
+CONVERTERS = {"int": _to_int, "str": str}
+
+
+class RouteError(Exception):
+    def __init__(self, status, message, allow=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.allow = allow
+
+
+class Route:
+    __slots__ = ("method", "pattern", "handler", "body")
+
+    def __init__(self, method, pattern, handler, body=None):
+        self.method = method
+        self.pattern = pattern
+        self.handler = handler
+        # None: no request body; "required" or "optional": JSON body passed
+        # to the handler after the path parameters
+        self.body = body
+
+
+class Router:
+    # Static paths are a single dict lookup; patterns with <type:name>
+    # parameters are compiled to regexes when added and tried in order.
+    def __init__(self):
+        self._static = {}  # path -> {method: Route}
+        self._dynamic = []  # (regex, [(name, converter)], {method: Route})
+        self._patterns = {}  # pattern -> {method: Route}
+
+    def add(self, method, pattern, handler, body=None):
+        methods = self._patterns.get(pattern)
+        if methods is None:
+            methods = self._patterns[pattern] = {}
+            if "<" in pattern:
+                regex, params = _compile(pattern)
+                self._dynamic.append((regex, params, methods))
+            else:
+                self._static[pattern] = methods
+        if method in methods:
+            raise ValueError(f"Duplicate route: {method} {pattern}")
+        methods[method] = Route(method, pattern, handler, body)
+
+    def match(self, method, path):
+        # Returns (route, params); raises RouteError for 404, 405 and for
+        # path parameters that do not convert (400)
+        methods = self._static.get(path)
+        if methods is not None:
+            return _select(methods, method), ()
+        for regex, params, methods in self._dynamic:
+            found = regex.fullmatch(path)
+            if found is None:
+                continue
+            route = _select(methods, method)
+            values = []
+            for (name, convert), raw in zip(params, found.groups()):
+                try:
+                    values.append(convert(raw))
+                except ValueError:
+                    raise RouteError(400, f"Invalid {name}")
+            return route, tuple(values)
+        raise RouteError(404, "Not Found")
+
+
+def _select(methods, method):
+    route = methods.get(method)
+    if route is None:
+        raise RouteError(405, "Method Not Allowed", allow=sorted(methods))
+    return route
+
+
+def _compile(pattern):
+    params = []
+    regex = []
+    position = 0
+    for found in _PARAM.finditer(pattern):
+        kind, name = found.group(1) or "str", found.group(2)
+        if kind not in CONVERTERS:
+            raise ValueError(f"Unknown converter {kind!r} in {pattern}")
+        regex.append(re.escape(pattern[position:found.start()]))
+        # Any segment matches so a malformed value is a 400, not a 404
+        regex.append("([^/]+)")
+        params.append((name, CONVERTERS[kind]))
+        position = found.end()
+    regex.append(re.escape(pattern[position:]))
+    return re.compile("".join(regex)), params
@@ -0,0 +1,134 @@
+import json
+from functools import lru_cache
+from itertools import groupby, islice
+from json.encoder import encode_basestring_ascii
+from operator import itemgetter
+from config import Config
+
+
+def _float(value, _repr=float.__repr__, _dumps=json.dumps):
+    # repr() is what json.dumps writes for every finite float; inf - inf
+    # and nan - nan are nan, which is how the other two are told apart
+    return _repr(value) if value - value == 0.0 else _dumps(value)
+
+
+# The JSON text json.dumps() writes for each scalar type SQLite can return,
+# all but floats as C functions, so a batch of rows makes few Python calls
+_SCALARS = {
+    str: encode_basestring_ascii,
+    int: int.__repr__,
+    float: _float,
+    type(None): "null".format,
+    bool: {True: "true", False: "false"}.__getitem__,
+}
+
+
+def _compile(template, width, skip):
+    # Builds encode_rows(rows) for one row shape, unpacking the columns in
+    # a list comprehension: looping over each row's values, or calling a
+    # function per row, costs about a third more per item. Only the widths
+    # shape the source; keys live in the template.
+    names = [f"_{index}" for index in range(skip)] + [f"c{index}" for index in range(width)]
+    values = ", ".join(f"_scalars[type(c{index})](c{index})" for index in range(width))
+    source = (
+        "def encode_rows(rows, template=template, _scalars=_scalars):\n"
+        f"    return [template % ({values},) for {', '.join(names)}, in rows]\n"
+    )
+    namespace = {"template": template, "_scalars": _SCALARS}
+    exec(source, namespace)
+    return namespace["encode_rows"]
+
+
+class RowEncoder:
+    # Writes row tuples as JSON objects with the given keys: the same text
+    # as json.dumps(dict(zip(keys, row[skip:]))), without building the
+    # dict. skip leaves out leading columns (a joined parent's); columns
+    # past the keys (such as a search score) are left out too.
+    __slots__ = ("keys", "skip", "_template", "_width", "_encode_rows")
+
+    def __init__(self, keys, skip=0):
+        self.keys = tuple(keys)
+        self.skip = skip
+        fields = ", ".join(f"{_template_key(key)}: %s" for key in self.keys)
+        self._template = "{" + fields + "}"
+        self._width = skip + len(self.keys)
+        self._encode_rows = _compile(self._template, len(self.keys), skip)
+
+    def encode(self, row):
+        return self.join([row])
+
+    def dumps(self, row):
+        return self.encode(row).encode()
+
+    def dumps_array(self, rows):
+        return ("[" + self.join(rows) + "]").encode()
+
+    def iter_array(self, rows, batch_size=None):
+        # Streams the bytes of dumps_array(rows), batch_size rows at a time
+        batch_size = batch_size or Config.STREAM_FETCH_SIZE
+        rows = iter(rows)
+        separator = "["
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            yield (separator + self.join(batch)).encode()
+            separator = ", "
+        yield b"[]" if separator == "[" else b"]"
+
+    def join(self, rows):
+        # The rows encoded and separated by ", ", as inside a JSON array
+        if not isinstance(rows, list):
+            rows = list(rows)
+        if rows and len(rows[0]) != self._width:
+            rows = [row[: self._width] for row in rows]
+        try:
+            return ", ".join(self._encode_rows(rows))
+        except (KeyError, ValueError):
+            # A type without an encoder above (bytes, subclasses), or rows
+            # of mixed widths
+            return ", ".join([self._exact(row) for row in rows])
+
+    def _exact(self, row):
+        # json.dumps per value: the same text, and the same TypeError for
+        # values it cannot encode
+        return self._template % tuple(map(json.dumps, row[self.skip : self._width]))
+
+
+def _template_key(key):
+    return encode_basestring_ascii(key).replace("%", "%%")
+
+
+@lru_cache(maxsize=None)
+def row_encoder(keys, skip=0):
+    # One encoder per query shape, built on first use
+    return RowEncoder(keys, skip)
+
+
+def iter_grouped_array(rows, parent, child, field, batch_size=None):
+    # rows come from a LEFT JOIN ordered by parent id: the parent's columns
+    # (id first) followed by the child's, which are all NULL for a parent
+    # without children; child skips the parent's columns. Each parent is
+    # written as an object whose `field` holds its children, and finished
+    # parents are yielded once at least batch_size rows have gone into them.
+    batch_size = batch_size or Config.STREAM_FETCH_SIZE
+    width = len(parent.keys)
+    open_field = f", {encode_basestring_ascii(field)}: ["
+    batch = []
+    batch_rows = 0
+    separator = "["
+    for _, group in groupby(rows, itemgetter(0)):
+        group = list(group)
+        first = group[0]
+        children = child.join(group) if first[width] is not None else ""
+        batch.append(parent.encode(first)[:-1] + open_field + children + "]}")
+        batch_rows += len(group)
+        if batch_rows >= batch_size:
+            yield (separator + ", ".join(batch)).encode()
+            batch = []
+            batch_rows = 0
+            separator = ", "
+    if batch:
+        yield (separator + ", ".join(batch) + "]").encode()
+    else:
+        yield b"[]" if separator == "[" else b"]"
@@ -1,52 +1,343 @@
 import base64
-import os
+import hashlib
+import hmac
+import threading
 import time
 import json
 import random
 import string
+import zlib
+from collections import OrderedDict
+from itertools import chain
+from urllib.parse import urlparse
+from config import Config
+from utils.cache import response_cache, gzip_etag
 
 
 class Auth:
-    def __init__(self):
-        self.secret_key = os.urandom(32)
+    # Tokens are "<payload>.<signature>": base64url JSON claims signed with
+    # HMAC-SHA256. Verified tokens are remembered for a short while so repeat
+    # requests skip the decode and signature check.
+    def __init__(self, secret_key=None, cache_size=None, cache_ttl=None):
+        secret_key = secret_key or Config.SECRET_KEY
+        self.secret_key = secret_key.encode() if isinstance(secret_key, str) else secret_key
+        self.cache_size = Config.TOKEN_CACHE_SIZE if cache_size is None else cache_size
+        self.cache_ttl = Config.TOKEN_CACHE_TTL if cache_ttl is None else cache_ttl
+        self._verified = OrderedDict()  # token -> time the cached result expires
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
 
-    def generate_token(self):
-        payload = {"exp": int(time.time()) + 3600}  # expires in 1 hour
-        token = base64.b64encode(json.dumps(payload).encode()).decode()
-        return token
+    def generate_token(self, subject=None):
+        payload = {"exp": int(time.time()) + Config.TOKEN_TTL}
+        if subject is not None:
+            payload["sub"] = subject
+        body = _b64encode(json.dumps(payload, separators=(",", ":")).encode())
+        return f"{body}.{self._sign(body)}"
 
     def verify_token(self, token):
-        try:
-            payload = json.loads(base64.b64decode(token).decode())
-            if payload["exp"] < int(time.time()):
-                return False
-            return True
-        except Exception as e:
+        now = time.time()
+        with self._lock:
+            valid_until = self._verified.get(token)
+            if valid_until is not None and valid_until > now:
+                self._verified.move_to_end(token)
+                self.stats["hits"] += 1
+                return True
+            self.stats["misses"] += 1
+
+        expires = self._check(token, now)
+        if expires is None:
             return False
+        # Only valid tokens are cached, so garbage tokens cannot flush it
+        with self._lock:
+            self._verified[token] = min(expires, now + self.cache_ttl)
+            self._verified.move_to_end(token)
+            while len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+        return True
+
+    def _check(self, token, now):
+        body, _, signature = token.partition(".")
+        if not body or not hmac.compare_digest(signature.encode(), self._sign(body).encode()):
+            return None
+        try:
+            payload = json.loads(_b64decode(body))
+            expires = int(payload["exp"])
+        except (ValueError, KeyError, TypeError):
+            return None
+        if expires < now:
+            return None
+        return expires
+
+    def _sign(self, body):
+        return _b64encode(hmac.new(self.secret_key, body.encode(), hashlib.sha256).digest())
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+# Process-wide instance: the signing key is read from Config once
+auth = Auth()
+
 
 def authenticate(self):
     auth_header = self.headers.get("Authorization")
     if auth_header is None or not auth_header.startswith("Bearer "):
         send_json_response(self, 401, {"message": "Unauthorized"})
         return False
-    token = auth_header.split(" ")[1]
-    auth = Auth()
+    token = auth_header[7:]
     if not auth.verify_token(token):
         send_json_response(self, 401, {"message": "Unauthorized"})
         return False
     return True
 
 
-def send_json_response(self, status_code, data):
+def send_json_response(self, status_code, data, headers=None):
+    send_json_bytes(self, status_code, json.dumps(data).encode(), headers=headers)
+
+
+def send_json_bytes(self, status_code, body, etag=None, headers=None):
+    cache_target = _cache_target(self, status_code)
+    if cache_target is not None:
+        etag = cache_target[1]
+        # Stored first: the gzipped copy is attached to this entry
+        response_cache.store(cache_target[0], etag, body)
+    compressible = _compressible(len(body))
+    gzipped = compressible and accepts_gzip(self)
+    if gzipped and etag is not None:
+        etag = gzip_etag(etag)
+    if _not_modified_instead(self, cache_target, etag):
+        return
+    if gzipped:
+        body = _gzip_body(body, cache_target)
     self.send_response(status_code)
     self.send_header("Content-type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    if gzipped:
+        self.send_header("Content-Encoding", "gzip")
+    if compressible:
+        self.send_header("Vary", "Accept-Encoding")
+    if etag is not None:
+        self.send_header("ETag", etag)
+    if headers:
+        for name, value in headers.items():
+            self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(body)
+    count_response_bytes(self, len(body))
+
+
+def _not_modified_instead(self, cache_target, etag):
+    # cached_get flags "If-None-Match: *", which only matches a resource
+    # that exists; the handler sending a cacheable 200 shows that it does
+    if cache_target is None or not getattr(self, "if_none_match_any", False):
+        return False
+    response_cache.record_not_modified()
+    send_not_modified(self, etag)
+    return True
+
+
+def send_not_modified(self, etag):
+    self.send_response(304)
+    self.send_header("ETag", etag)
+    if Config.GZIP_LEVEL > 0:
+        self.send_header("Vary", "Accept-Encoding")
     self.end_headers()
-    self.wfile.write(json.dumps(data).encode())
+
+
+def accepts_gzip(self):
+    # Accept-Encoding with q-values: "gzip;q=0" refuses gzip, and "*"
+    # covers it when gzip is not named
+    header = self.headers.get("Accept-Encoding")
+    if not header:
+        return False
+    gzip_q = any_q = None
+    for part in header.split(","):
+        coding, *params = part.split(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding in ("gzip", "x-gzip"):
+            gzip_q = q
+        elif coding == "*":
+            any_q = q
+    if gzip_q is None:
+        gzip_q = any_q
+    return gzip_q is not None and gzip_q > 0
+
+
+def gzip_compressor():
+    # wbits=31 writes a gzip header with a zero mtime, so a body always
+    # compresses to the same bytes, whether in one call or streamed
+    return zlib.compressobj(Config.GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def gzip_compress(body):
+    compressor = gzip_compressor()
+    return compressor.compress(body) + compressor.flush()
+
+
+def _compressible(size):
+    return Config.GZIP_LEVEL > 0 and size >= Config.GZIP_MIN_BYTES
+
+
+def _gzip_body(body, cache_target):
+    if cache_target is None:
+        return gzip_compress(body)
+    key, etag = cache_target
+    gzipped = response_cache.get_gzip(key, etag)
+    if gzipped is None:
+        gzipped = gzip_compress(body)
+        response_cache.store_gzip(key, etag, gzipped)
+    return gzipped
+
+
+def _cache_target(self, status_code):
+    # Set by handlers.cached_get while a cacheable GET is being served;
+    # only successful responses are stored
+    target = getattr(self, "response_cache_target", None)
+    if target is None or status_code != 200:
+        return None
+    return target
+
+
+def send_json_stream(self, status_code, chunks):
+    # chunks is an iterable of encoded JSON fragments. HTTP/1.1 clients get
+    # chunked transfer encoding; HTTP/1.0 bodies end when the connection closes.
+    chunked = self.request_version == "HTTP/1.1" and self.protocol_version == "HTTP/1.1"
+    cache_target = _cache_target(self, status_code)
+    # Keep a copy of the body for the response cache unless it grows too big
+    captured = [] if cache_target is not None else None
+    captured_bytes = 0
+    try:
+        if cache_target is not None and getattr(self, "if_none_match_any", False):
+            # The tag of the representation this client would most likely get
+            etag = cache_target[1]
+            if Config.GZIP_LEVEL > 0 and accepts_gzip(self):
+                etag = gzip_etag(etag)
+            return _not_modified_instead(self, cache_target, etag)
+        # For gzip clients the stream is held back until GZIP_MIN_BYTES
+        # have arrived; bodies that end sooner are sent whole, uncompressed
+        remaining = iter(chunks)
+        head = []
+        compressor = None
+        if Config.GZIP_LEVEL > 0 and accepts_gzip(self):
+            head_bytes = 0
+            for chunk in remaining:
+                head.append(chunk)
+                head_bytes += len(chunk)
+                if _compressible(head_bytes):
+                    break
+            else:
+                return send_json_bytes(self, status_code, b"".join(head))
+            compressor = gzip_compressor()
+        gzipped = [] if compressor is not None and captured is not None else None
+        etag = cache_target[1] if cache_target is not None else None
+
+        self.send_response(status_code)
+        self.send_header("Content-type", "application/json")
+        if compressor is not None:
+            self.send_header("Content-Encoding", "gzip")
+            if etag is not None:
+                etag = gzip_etag(etag)
+        if Config.GZIP_LEVEL > 0:
+            self.send_header("Vary", "Accept-Encoding")
+        if etag is not None:
+            self.send_header("ETag", etag)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.close_connection = True
+        self.end_headers()
+
+        buffer = []
+        buffered = 0
+        for chunk in chain(head, remaining):
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if captured is not None:
+                captured.append(chunk)
+                captured_bytes += len(chunk)
+                if captured_bytes > response_cache.max_body_bytes:
+                    captured = gzipped = None
+            if buffered >= Config.STREAM_CHUNK_SIZE:
+                _write_body(self, b"".join(buffer), chunked, compressor, gzipped)
+                buffer = []
+                buffered = 0
+        _write_body(self, b"".join(buffer), chunked, compressor, gzipped, final=True)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+        if captured is not None:
+            response_cache.store(cache_target[0], cache_target[1], b"".join(captured))
+            if gzipped is not None:
+                response_cache.store_gzip(cache_target[0], cache_target[1], b"".join(gzipped))
+    finally:
+        # Lets generators release their database connection even when the
+        # client goes away mid-stream
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def _write_body(self, data, chunked, compressor, gzipped, final=False):
+    if compressor is not None:
+        # The compressor holds on to input until it has a block to emit
+        data = compressor.compress(data)
+        if final:
+            data += compressor.flush()
+        if gzipped is not None:
+            gzipped.append(data)
+    # An empty chunk would end a chunked body early
+    if data:
+        _write_chunk(self, data, chunked)
+
+
+def _write_chunk(self, data, chunked):
+    if chunked:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+    else:
+        self.wfile.write(data)
+    count_response_bytes(self, len(data))
+
+
+def count_response_bytes(self, size):
+    # Body bytes for this request, read back by the server's metrics
+    self.response_bytes = getattr(self, "response_bytes", 0) + size
+
+
+def encode_cursor(position):
+    return _b64encode(json.dumps(position, separators=(",", ":")).encode())
+
+
+def decode_cursor(cursor):
+    try:
+        position = json.loads(_b64decode(cursor).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(position, dict):
+        raise ValueError("Invalid cursor")
+    return position
+
+
+def request_url(self):
+    # The server's dispatcher parses the URL once and leaves it on the handler
+    url = getattr(self, "url", None)
+    return url if url is not None else urlparse(self.path)
 
 
 def parse_json_body(self):
     content_length = int(self.headers["Content-Length"])
     body = self.rfile.read(content_length)
+    self.body_read = True
     return json.loads(body.decode())
 
 